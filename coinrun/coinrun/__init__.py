@@ -1,7 +1,11 @@
-from .coinrunenv import init_args_and_threads
-from .coinrunenv import make
-
 __all__ = [
     'init_args_and_threads',
     'make'
     ]
+
+def __getattr__(name):
+    # importing coinrunenv builds and loads the native library, which procgen runs never need
+    if name in __all__:
+        from . import coinrunenv
+        return getattr(coinrunenv, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,107 @@
+"""
+Grid search over NUM_ENVS, NUM_STEPS and NUM_MINIBATCHES for the best update
+throughput per core of one agent, on the NumPy stand-in env.
+
+Grid points whose buffers (coinrun.sizing) don't fit the memory budget are
+skipped. Every other point runs a few updates of the agent's `learn` loop through
+coinrun.bench in its own subprocess, so each trial starts with a fresh graph,
+thread pools and heap, and a trial that runs out of memory only loses that point.
+
+To run:
+python -m coinrun.autotune --agent ppo --num-envs 16 32 64 --num-steps 128 256 --num-minibatches 4 8 --mem-budget 16 --set custom_rep_loss=1 rep_loss_m=5
+"""
+
+import sys
+import json
+import time
+import argparse
+import itertools
+import subprocess
+
+from coinrun.config import Config
+from coinrun import sizing
+from coinrun.bench.benchmarks import parse_overrides
+
+def run_trial(config_args, updates):
+    import resource
+    import tempfile
+    from coinrun import placement
+    from coinrun.bench.benchmarks import bench_agent
+
+    Config.initialize_args(use_cmd_line_args=False, **config_args)
+    Config.WORKDIR = tempfile.mkdtemp(prefix='coinrun_autotune_')
+    results = bench_agent(Config.AGENT, argparse.Namespace(updates=updates))
+
+    prefix = Config.AGENT + '/'
+    return {'run_s': results[prefix + 'run_s'],
+            'train_s': results[prefix + 'train_s'],
+            'update_sps': results[prefix + 'update_sps'],
+            'num_cores': placement.get_placement().num_cores,
+            'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+def trial_flags(trial):
+    return '--num-envs %d --num-steps %d --num-minibatches %d' % (trial['num_envs'], trial['num_steps'], trial['num_minibatches'])
+
+def main():
+    parser = argparse.ArgumentParser(description='Autotune NUM_ENVS, NUM_STEPS and NUM_MINIBATCHES for update throughput per core.')
+    parser.add_argument('--agent', default='ppo')
+    parser.add_argument('--num-envs', type=int, nargs='+', default=[16, 32, 64, 128])
+    parser.add_argument('--num-steps', type=int, nargs='+', default=[64, 128, 256])
+    parser.add_argument('--num-minibatches', type=int, nargs='+', default=[4, 8])
+    parser.add_argument('--updates', type=int, default=3)
+    parser.add_argument('--mem-budget', type=float, default=None, help='GB of buffers per rank, like -mem for train_agent')
+    parser.add_argument('--set', nargs='*', default=[], help='extra Config overrides, e.g. rep_loss_m=5')
+    parser.add_argument('--out', default=None, help='write trials and the best config as JSON')
+    parser.add_argument('--trial', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.trial is not None:
+        print(json.dumps(run_trial(json.loads(args.trial), args.updates)))
+        return
+
+    base_args = dict(bench_env=True, disable_wandb=1, run_id='autotune', agent=args.agent)
+    base_args.update(parse_overrides(args.set))
+    if args.mem_budget is not None:
+        base_args['mem_budget'] = args.mem_budget
+    Config.initialize_args(use_cmd_line_args=False, **base_args)
+    budget = sizing.budget_bytes()
+
+    trials = []
+    for num_envs, num_steps, num_minibatches in itertools.product(args.num_envs, args.num_steps, args.num_minibatches):
+        trial = {'num_envs': num_envs, 'num_steps': num_steps, 'num_minibatches': num_minibatches,
+                 'estimated_bytes': sizing.peak_bytes(num_envs, num_steps, num_minibatches)}
+        trials.append(trial)
+
+        if (num_envs * num_steps) % num_minibatches != 0:
+            trial['skipped'] = 'minibatches'
+        elif budget > 0 and trial['estimated_bytes'] > budget:
+            trial['skipped'] = 'memory'
+        else:
+            config_args = dict(base_args, num_envs=num_envs, num_steps=num_steps, num_minibatches=num_minibatches)
+            cmd = [sys.executable, '-m', 'coinrun.autotune', '--trial', json.dumps(config_args), '--updates', str(args.updates)]
+            proc = subprocess.run(cmd, stdout=subprocess.PIPE, universal_newlines=True)
+            if proc.returncode != 0:
+                trial['skipped'] = 'failed (exit %d)' % proc.returncode
+            else:
+                trial.update(json.loads(proc.stdout.strip().splitlines()[-1]))
+                trial['sps_per_core'] = trial['update_sps'] / trial['num_cores']
+
+        print('%s  est %6.2f GB  %s' % (trial_flags(trial), trial['estimated_bytes'] / sizing.GB,
+              trial['skipped'] if 'skipped' in trial else '%8.0f sps  %8.1f sps/core  rss %.2f GB' % (
+                  trial['update_sps'], trial['sps_per_core'], trial['max_rss'] / sizing.GB)))
+
+    finished = [trial for trial in trials if 'sps_per_core' in trial]
+    best = max(finished, key=lambda trial: trial['sps_per_core']) if finished else None
+
+    if best is None:
+        print('no grid point ran within the %.2f GB budget' % (budget / sizing.GB))
+    else:
+        print('best: %s  (%.1f sps/core)' % (trial_flags(best), best['sps_per_core']))
+
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump({'trials': trials, 'best': best, 'config': base_args, 'budget_bytes': budget, 'time': time.time()},
+                      f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+"""
+Offline throughput benchmarks with a local procgen stand-in.
+
+To run:
+python -m coinrun.bench --out bench.json
+python -m coinrun.bench --only env gae sinkhorn --baseline bench_baseline.json
+python -m coinrun.bench --agents ppo ppo_goal --set rep_loss_m=5 --save-baseline bench_baseline.json
+
+The native CoinRun stepping sweep needs the compiled library:
+python -m coinrun.bench.coinrun_step --nenvs 8 32 128 --threads 1 2 4 8
+"""
+
+from coinrun.bench.standin_env import StandInGym3Env
+
+__all__ = ['StandInGym3Env']
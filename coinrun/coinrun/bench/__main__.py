@@ -0,0 +1,62 @@
+import sys
+import json
+import time
+import argparse
+import platform
+
+from coinrun.config import Config
+from coinrun.bench.benchmarks import BENCHMARKS, compare, parse_overrides
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput benchmarks on the NumPy procgen stand-in.')
+    parser.add_argument('--only', nargs='+', default=list(BENCHMARKS), choices=list(BENCHMARKS))
+    parser.add_argument('--agents', nargs='+', default=['ppo', 'ppo_goal', 'ppg', 'ppo_curl', 'ppo_rnd'])
+    parser.add_argument('--num-envs', type=int, default=32)
+    parser.add_argument('--num-steps', type=int, default=256)
+    parser.add_argument('--num-minibatches', type=int, default=8)
+    parser.add_argument('--updates', type=int, default=3)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--set', nargs='*', default=[], help='extra Config overrides, e.g. rep_loss_m=5')
+    parser.add_argument('--out', default=None, help='write results as JSON')
+    parser.add_argument('--baseline', default=None, help='JSON results to compare against')
+    parser.add_argument('--save-baseline', default=None, help='also write results to this baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    config_args = dict(bench_env=True, disable_wandb=1, run_id='bench',
+                       num_envs=args.num_envs, num_steps=args.num_steps, num_minibatches=args.num_minibatches)
+    config_args.update(parse_overrides(args.set))
+    Config.initialize_args(use_cmd_line_args=False, **config_args)
+
+    results = {}
+    for name in args.only:
+        tstart = time.time()
+        results.update(BENCHMARKS[name](args))
+        print('%s done in %.1fs' % (name, time.time() - tstart))
+
+    report = {'results': results,
+              'config': config_args,
+              'host': {'node': platform.node(), 'processor': platform.processor(), 'python': platform.python_version()},
+              'time': time.time()}
+
+    for key in sorted(results):
+        print('%-40s %12.4f' % (key, results[key]))
+
+    for path in (args.out, args.save_baseline):
+        if path is not None:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+        changes, regressions = compare(results, baseline, args.tolerance)
+        for key in sorted(changes):
+            print('%-40s %+8.1f%%%s' % (key, 100 * changes[key], '  REGRESSION' if key in regressions else ''))
+
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
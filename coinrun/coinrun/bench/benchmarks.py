@@ -0,0 +1,279 @@
+"""
+Throughput benchmarks for the agent code.
+
+Every benchmark returns a flat dict of metrics. Metric names ending in '_sps'
+are throughputs (higher is better), names ending in '_s' are wall-clock seconds
+(lower is better). The agent benchmarks run each learner's own `learn` loop on
+the NumPy stand-in env (Config.BENCH_ENV) and time `Runner.run` and
+`Model.train` from the outside.
+"""
+
+import os
+import time
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from coinrun.config import Config
+from coinrun.bench.standin_env import StandInGym3Env
+
+BENCHMARKS = OrderedDict()
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+def timeit(fn, repeats=5, warmup=1):
+    """
+    Median wall-clock seconds of `fn()` over `repeats` calls.
+    """
+    for _ in range(warmup):
+        fn()
+
+    times = []
+    for _ in range(repeats):
+        tstart = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - tstart)
+
+    return float(np.median(times))
+
+@benchmark('env')
+def bench_env(args):
+    env = StandInGym3Env(num=args.num_envs)
+    actions = np.random.RandomState(0).randint(15, size=(args.num_steps, args.num_envs))
+
+    def rollout():
+        for t in range(args.num_steps):
+            env.act(actions[t])
+            env.observe()
+
+    secs = timeit(rollout, repeats=args.repeats)
+
+    return {'env/step_sps': args.num_steps * args.num_envs / secs}
+
+def gae(rewards, values, dones, last_values, last_dones, gamma, lam):
+    """
+    The advantage recursion used by the ppo2_* runners.
+    """
+    nsteps = len(rewards)
+    advs = np.zeros_like(rewards)
+    lastgaelam = 0
+    for t in reversed(range(nsteps)):
+        if t == nsteps - 1:
+            nextnonterminal = 1.0 - last_dones
+            nextvalues = last_values
+        else:
+            nextnonterminal = 1.0 - dones[t+1]
+            nextvalues = values[t+1]
+        delta = rewards[t] + gamma * nextvalues * nextnonterminal - values[t]
+        advs[t] = lastgaelam = delta + gamma * lam * nextnonterminal * lastgaelam
+
+    return advs
+
+@benchmark('gae')
+def bench_gae(args):
+    rng = np.random.RandomState(0)
+    shape = (args.num_steps, args.num_envs)
+    rewards = rng.randn(*shape).astype(np.float32)
+    values = rng.randn(*shape).astype(np.float32)
+    dones = rng.rand(*shape) < 0.01
+    last_values = rng.randn(args.num_envs).astype(np.float32)
+    last_dones = np.zeros(args.num_envs, dtype=np.bool_)
+
+    secs = timeit(lambda: gae(rewards, values, dones, last_values, last_dones, 0.999, 0.95), repeats=args.repeats)
+
+    return {'gae/sps': args.num_steps * args.num_envs / secs}
+
+@benchmark('sinkhorn')
+def bench_sinkhorn(args):
+    import tensorflow as tf
+    from coinrun.models import sinkhorn
+
+    nbatch = args.num_steps * args.num_envs // args.num_minibatches
+    scores_np = np.random.RandomState(0).randn(nbatch, Config.N_SKILLS).astype(np.float32)
+
+    with tf.Graph().as_default(), tf.compat.v1.Session() as sess:
+        scores = tf.compat.v1.placeholder(tf.float32, [None, Config.N_SKILLS])
+        codes = sinkhorn(scores)
+        secs = timeit(lambda: sess.run(codes, {scores: scores_np}), repeats=args.repeats)
+
+    return {'sinkhorn/%dx%d_s' % (nbatch, Config.N_SKILLS): secs}
+
+@benchmark('quant')
+def bench_quant(args):
+    """
+    fp32 vs int8 act model step latency at rollout batch size, on an untrained ppo policy.
+    """
+    import tensorflow as tf
+    from coinrun import export_policy, quantize_policy
+
+    agent = Config.AGENT
+    Config.parse_args_dict({'agent': 'ppo'})
+    try:
+        env = StandInGym3Env(num=args.num_envs)
+        rng = np.random.RandomState(0)
+        frames = []
+        for _ in range(2 * Config.QUANT_CALIB_FRAMES // args.num_envs + 1):
+            env.act(rng.randint(15, size=args.num_envs))
+            frames.append(env.observe()[1]['rgb'])
+        frames = np.concatenate(frames)
+        calib, held_out = frames[:Config.QUANT_CALIB_FRAMES], frames[Config.QUANT_CALIB_FRAMES:]
+
+        with tf.Graph().as_default(), tf.compat.v1.Session() as sess:
+            act = export_policy.build_act_model(sess)
+            export_policy.add_act_outputs(act)
+            sess.run(tf.compat.v1.global_variables_initializer())
+            fp32 = quantize_policy.ActModelReference(sess, act)
+            int8 = quantize_policy.quantize_act_model(sess, act, calib)
+
+            ob = held_out[:args.num_envs]
+            fp32_s = timeit(lambda: fp32.step(ob), repeats=args.repeats * 10)
+            int8_s = timeit(lambda: int8.step(ob), repeats=args.repeats * 10)
+            acc = quantize_policy.check_accuracy(fp32, int8, held_out)
+    finally:
+        Config.parse_args_dict({'agent': agent})
+
+    return {'quant/fp32_step_s': fp32_s,
+            'quant/int8_step_s': int8_s,
+            'quant/action_disagreement': 1. - acc['action_agreement'],
+            'quant/value_mae': acc['value_mae']}
+
+def _timed_agent_classes(agent, timings):
+    class TimedModel(agent.Model):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            train = self.train
+
+            def timed_train(*args, **kwargs):
+                tstart = time.perf_counter()
+                out = train(*args, **kwargs)
+                timings['train'][-1] += time.perf_counter() - tstart
+                return out
+
+            self.train = timed_train
+
+    class TimedRunner(agent.Runner):
+        def run(self, *args, **kwargs):
+            tstart = time.perf_counter()
+            out = super().run(*args, **kwargs)
+            timings['run'].append(time.perf_counter() - tstart)
+            timings['train'].append(0.)
+            return out
+
+    return TimedModel, TimedRunner
+
+def _bench_checkpoint(sess, prefix):
+    import joblib
+    import coinrun.main_utils as utils
+
+    filename = Config.get_save_file(base_name='bench')
+    save_s = timeit(lambda: utils.save_params_in_scopes(sess, ['model'], filename), repeats=1, warmup=0)
+
+    def load():
+        load_data = joblib.load(utils.file_to_path(filename))
+        loaded_params, params = utils.get_savable_params(load_data['params']['model'], 'model', keep_heads=True)
+        utils.restore_params(sess, loaded_params, params)
+
+    load_s = timeit(load, repeats=1, warmup=0)
+    size = os.path.getsize(utils.file_to_path(filename))
+
+    return {prefix + 'ckpt_save_s': save_s, prefix + 'ckpt_load_s': load_s, prefix + 'ckpt_mb': size / 2 ** 20}
+
+def bench_agent(agent_name, args):
+    import tensorflow as tf
+    from coinrun import train_agent
+
+    Config.parse_args_dict({'agent': agent_name})
+    agent, policies = train_agent.import_agent(agent_name)
+    nbatch = Config.NUM_ENVS * Config.NUM_STEPS
+    total_timesteps = nbatch * args.updates
+    timings = {'run': [], 'train': []}
+
+    model_cls, runner_cls = agent.Model, agent.Runner
+    agent.Model, agent.Runner = _timed_agent_classes(agent, timings)
+    try:
+        with tf.Graph().as_default(), tf.compat.v1.Session() as sess:
+            venv, _, _ = train_agent.make_env(steps_per_env=total_timesteps)
+            agent.learn(policy=policies.get_policy(),
+                        env=venv,
+                        eval_env=train_agent.make_eval_env(),
+                        save_interval=0,
+                        nsteps=Config.NUM_STEPS,
+                        nminibatches=Config.NUM_MINIBATCHES,
+                        lam=0.95,
+                        gamma=Config.GAMMA,
+                        noptepochs=Config.PPO_EPOCHS,
+                        log_interval=1,
+                        ent_coef=Config.ENTROPY_COEFF,
+                        lr=lambda f : f * Config.LEARNING_RATE,
+                        cliprange=lambda f : f * 0.2,
+                        total_timesteps=total_timesteps)
+            prefix = agent_name + '/'
+            ckpt = _bench_checkpoint(sess, prefix)
+    finally:
+        agent.Model, agent.Runner = model_cls, runner_cls
+
+    # the first update pays for graph warmup
+    skip = 1 if len(timings['run']) > 1 else 0
+    run_s = float(np.median(timings['run'][skip:]))
+    train_s = float(np.median(timings['train'][skip:]))
+
+    results = {prefix + 'run_s': run_s,
+               prefix + 'train_s': train_s,
+               prefix + 'update_sps': nbatch / (run_s + train_s)}
+    results.update(ckpt)
+
+    return results
+
+@benchmark('agents')
+def bench_agents(args):
+    results = {}
+    workdir = Config.WORKDIR
+    Config.WORKDIR = tempfile.mkdtemp(prefix='coinrun_bench_')
+    try:
+        for agent_name in args.agents:
+            results.update(bench_agent(agent_name, args))
+    finally:
+        Config.WORKDIR = workdir
+
+    return results
+
+def parse_overrides(pairs):
+    """
+    Config overrides from key=value pairs, typed like their Config fields.
+    """
+    types = {tk[1]: tk[2] for tk in Config.type_keys}
+    overrides = {}
+
+    for pair in pairs:
+        key, val = pair.split('=', 1)
+        if key in types:
+            overrides[key] = types[key](val)
+        else:
+            overrides[key] = val not in ('0', 'False', 'false')
+
+    return overrides
+
+def compare(results, baseline, tolerance):
+    """
+    Relative change of every metric present in both dicts, and the metrics that regressed by more than `tolerance`.
+    """
+    changes = {}
+    regressions = []
+
+    for key in sorted(results):
+        if key not in baseline or not baseline[key]:
+            continue
+
+        change = results[key] / baseline[key] - 1.
+        changes[key] = change
+
+        worse = -change if key.endswith('_sps') else change
+        if worse > tolerance:
+            regressions.append(key)
+
+    return changes, regressions
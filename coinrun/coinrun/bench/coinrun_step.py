@@ -0,0 +1,94 @@
+"""
+Steps/sec of the native CoinRun vec env against nenvs and stepping threads,
+and frames/sec of re-rendering the observations with Qt and the software renderer.
+
+The C++ thread pool can only be started once per process, so every thread
+count runs in its own subprocess.
+
+To run:
+python -m coinrun.bench.coinrun_step --nenvs 8 32 128 --threads 1 2 4 8 --out coinrun_step.json
+"""
+
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+RENDER_REPEATS = 20
+
+def run_worker(threads, nenvs_list, num_steps, game_type):
+    from baselines import logger
+    from coinrun.config import Config
+
+    Config.initialize_args(use_cmd_line_args=False, game_type=game_type)
+    logger.configure(dir=tempfile.mkdtemp(prefix='coinrun_bench_'), format_strs=[])
+
+    from coinrun import coinrunenv
+    coinrunenv.init_args_and_threads(cpu_count=threads, monitor_csv_policy='off', rand_seed=0)
+
+    results = {}
+    for nenvs in nenvs_list:
+        env = coinrunenv.make(game_type, nenvs)
+        actions = np.random.RandomState(0).randint(env.action_space.n, size=(num_steps, nenvs)).astype(np.int32)
+
+        env.step(actions[0])
+        tstart = time.perf_counter()
+        for t in range(num_steps):
+            env.step_async(actions[t])
+            env.step_wait()
+        secs = time.perf_counter() - tstart
+        results['coinrun_step/threads%d_nenvs%d_sps' % (threads, nenvs)] = num_steps * nenvs / secs
+
+        env.render_obs('software') # builds the sprite atlas
+        for renderer in ['qt', 'software']:
+            tstart = time.perf_counter()
+            for _ in range(RENDER_REPEATS):
+                env.render_obs(renderer)
+            secs = time.perf_counter() - tstart
+            results['coinrun_render/threads%d_nenvs%d_%s_fps' % (threads, nenvs, renderer)] = RENDER_REPEATS * nenvs / secs
+        env.close()
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='CoinRun vec env stepping throughput.')
+    parser.add_argument('--nenvs', type=int, nargs='+', default=[8, 32, 128])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--num-steps', type=int, default=500)
+    parser.add_argument('--game-type', default='standard')
+    parser.add_argument('--out', default=None, help='write results as JSON')
+    parser.add_argument('--worker', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(run_worker(args.worker, args.nenvs, args.num_steps, args.game_type)))
+        return
+
+    results = {}
+    for threads in args.threads:
+        cmd = [sys.executable, '-m', 'coinrun.bench.coinrun_step', '--worker', str(threads),
+               '--num-steps', str(args.num_steps), '--game-type', args.game_type,
+               '--nenvs'] + [str(n) for n in args.nenvs]
+        out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        results.update(json.loads(out.strip().splitlines()[-1]))
+
+    print('%8s' % 'nenvs' + ''.join('%12s' % ('%d thr' % t) for t in args.threads))
+    for nenvs in args.nenvs:
+        row = [results['coinrun_step/threads%d_nenvs%d_sps' % (t, nenvs)] for t in args.threads]
+        print('%8d' % nenvs + ''.join('%12.0f' % sps for sps in row))
+
+    print('%8s' % 'nenvs' + ''.join('%12s' % ('%d thr %s' % (t, r)) for t in args.threads for r in ['qt', 'sw']))
+    for nenvs in args.nenvs:
+        row = [results['coinrun_render/threads%d_nenvs%d_%s_fps' % (t, nenvs, r)] for t in args.threads for r in ['qt', 'software']]
+        print('%8d' % nenvs + ''.join('%12.0f' % fps for fps in row))
+
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump({'results': results, 'num_steps': args.num_steps, 'time': time.time()}, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
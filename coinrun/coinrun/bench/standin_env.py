@@ -0,0 +1,132 @@
+"""
+Deterministic NumPy stand-in for ProcgenGym3Env.
+
+Matches the parts of the procgen gym3 interface the agents rely on: a dict
+observation with a 64x64x3 uint8 'rgb' entry, 15 discrete actions, per-env
+info dicts and byte-string get_state/set_state. There is no game here, only a
+cheap grid walk with a goal tile, so throughput numbers measured against it
+isolate the agent code from the simulator.
+"""
+
+import numpy as np
+from gym3 import Env, types
+
+RES = 64
+CELL = 4
+GRID = RES // CELL
+NUM_ACTIONS = 15
+
+# procgen's combo ordering: (LEFT, DOWN), (LEFT,), (LEFT, UP), (DOWN,), (), (UP,), (RIGHT, DOWN), ...
+ACTION_DX = np.array([-1, -1, -1, 0, 0, 0, 1, 1, 1, 0, 0, 0, 0, 0, 0], dtype=np.int64)
+ACTION_DY = np.array([1, 0, -1, 1, 0, -1, 1, 0, -1, 0, 0, 0, 0, 0, 0], dtype=np.int64)
+
+GOAL_REWARD = 10.0
+AGENT_COLOR = np.array([255, 64, 64], dtype=np.uint8)
+GOAL_COLOR = np.array([255, 220, 0], dtype=np.uint8)
+
+# fields of the per-env int64 state vector, serialized by get_state
+F_SEED, F_EPISODE, F_LEVEL, F_X, F_Y, F_GX, F_GY, F_T = range(8)
+NUM_FIELDS = 8
+
+
+class StandInGym3Env(Env):
+    def __init__(self, num, env_name='coinrun', num_levels=0, start_level=0,
+                 distribution_mode='hard', paint_vel_info=False, rand_seed=0,
+                 max_episode_steps=500, **_kwargs):
+        ob_space = types.DictType(rgb=types.TensorType(eltype=types.Discrete(256, dtype_name="uint8"), shape=(RES, RES, 3)))
+        super().__init__(ob_space=ob_space, ac_space=types.discrete_scalar(NUM_ACTIONS), num=num)
+
+        self.env_name = env_name
+        self.num_levels = num_levels
+        self.start_level = start_level
+        self.distribution_mode = distribution_mode
+        self.paint_vel_info = paint_vel_info
+        self.max_episode_steps = max_episode_steps
+
+        self._backgrounds = {}
+        self._state = np.zeros((num, NUM_FIELDS), dtype=np.int64)
+        self._state[:, F_SEED] = rand_seed * 1000003 + np.arange(num)
+        self._rew = np.zeros(num, dtype=np.float32)
+        self._first = np.ones(num, dtype=np.bool_)
+        self._rgb = np.zeros((num, RES, RES, 3), dtype=np.uint8)
+        self._prev_level = np.zeros(num, dtype=np.int64)
+        self._prev_complete = np.zeros(num, dtype=np.bool_)
+
+        for i in range(num):
+            self._new_episode(i)
+            self._render(i)
+
+    def _level_seed(self, i):
+        s = self._state[i]
+        rng = np.random.RandomState((int(s[F_SEED]) * 7919 + int(s[F_EPISODE])) % (2 ** 32))
+        if self.num_levels > 0:
+            return self.start_level + rng.randint(self.num_levels)
+        return rng.randint(2 ** 31 - 1)
+
+    def _new_episode(self, i):
+        s = self._state[i]
+        s[F_LEVEL] = self._level_seed(i)
+        rng = np.random.RandomState(int(s[F_LEVEL]))
+        s[F_X], s[F_Y] = rng.randint(GRID, size=2)
+        s[F_GX], s[F_GY] = rng.randint(GRID, size=2)
+        s[F_T] = 0
+
+    def _background(self, level_seed):
+        bg = self._backgrounds.get(level_seed)
+        if bg is None:
+            rng = np.random.RandomState(level_seed)
+            tiles = rng.randint(0, 160, size=(GRID, GRID, 3)).astype(np.uint8)
+            bg = np.repeat(np.repeat(tiles, CELL, axis=0), CELL, axis=1)
+            if len(self._backgrounds) > 4096:
+                self._backgrounds.clear()
+            self._backgrounds[level_seed] = bg
+        return bg
+
+    def _render(self, i):
+        s = self._state[i]
+        frame = self._rgb[i]
+        frame[:] = self._background(int(s[F_LEVEL]))
+        gx, gy = s[F_GX] * CELL, s[F_GY] * CELL
+        frame[gy:gy + CELL, gx:gx + CELL] = GOAL_COLOR
+        x, y = s[F_X] * CELL, s[F_Y] * CELL
+        frame[y:y + CELL, x:x + CELL] = AGENT_COLOR
+
+    def observe(self):
+        return self._rew.copy(), {'rgb': self._rgb.copy()}, self._first.copy()
+
+    def get_info(self):
+        return [{'level_seed': int(self._state[i, F_LEVEL]),
+                 'prev_level_seed': int(self._prev_level[i]),
+                 'prev_level_complete': int(self._prev_complete[i])} for i in range(self.num)]
+
+    def act(self, ac):
+        ac = np.asarray(ac, dtype=np.int64).reshape(self.num)
+        s = self._state
+        s[:, F_X] = np.clip(s[:, F_X] + ACTION_DX[ac], 0, GRID - 1)
+        s[:, F_Y] = np.clip(s[:, F_Y] + ACTION_DY[ac], 0, GRID - 1)
+        s[:, F_T] += 1
+
+        complete = (s[:, F_X] == s[:, F_GX]) & (s[:, F_Y] == s[:, F_GY])
+        done = complete | (s[:, F_T] >= self.max_episode_steps)
+        self._rew[:] = np.where(complete, GOAL_REWARD, 0.0)
+        self._first[:] = done
+
+        for i in np.nonzero(done)[0]:
+            self._prev_level[i] = s[i, F_LEVEL]
+            self._prev_complete[i] = complete[i]
+            s[i, F_EPISODE] += 1
+            self._new_episode(i)
+
+        for i in range(self.num):
+            self._render(i)
+
+    def get_state(self):
+        return [self._state[i].tobytes() for i in range(self.num)]
+
+    def set_state(self, states):
+        assert len(states) == self.num
+        for i, state in enumerate(states):
+            self._state[i] = np.frombuffer(state, dtype=np.int64)
+            self._render(i)
+        self._rew[:] = 0
+        self._first[:] = False
@@ -25,14 +25,24 @@ Also includes a mode that creates a window you can interact with using the keybo
 #include <QtCore/QElapsedTimer>
 #include <QtCore/QDirIterator>
 #include <stdint.h>
+#include <string.h>
 #include <time.h>
 #include <sys/time.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <fcntl.h>
+#include <unistd.h>
 #include <cmath>
 #include <random>
 #include <iostream>
 #include <memory>
+#include <atomic>
+#include <algorithm>
 #include <assert.h>
 #include <set>
+#include <type_traits>
+#include <functional>
+#include <map>
 
 const int NUM_ACTIONS = 7;
 const int MAZE_OFFSET = 1;
@@ -91,6 +101,7 @@ bool RANDOM_TILE_COLORS = false;
 bool PAINT_VEL_INFO = false;
 bool USE_HIGH_DIF = false;
 bool USE_DATA_AUGMENTATION = false;
+bool SOFTWARE_RENDER = false;
 int DEFAULT_GAME_TYPE = CoinRunToTheRight_v0;
 
 static bool shutdown_flag = false;
@@ -268,6 +279,19 @@ public:
     delete[] walls;
   }
 
+  // deep copy, walls and monsters are not shared with this maze
+  std::shared_ptr<Maze> clone() const
+  {
+    std::shared_ptr<Maze> m(new Maze(w, h, game_type));
+    int* m_walls = m->walls;
+    *m = *this;
+    m->walls = m_walls;
+    memcpy(m->walls, walls, sizeof(int) * w * h);
+    for (std::shared_ptr<Monster>& monster: m->monsters)
+      monster = std::shared_ptr<Monster>(new Monster(*monster));
+    return m;
+  }
+
   int& get_elem(int x, int y)
   {
     return walls[w*y + x];
@@ -835,6 +859,11 @@ public:
 
 static QString resource_path;
 
+enum PlayerPose {
+  POSE_STAND, POSE_FRONT, POSE_WALK1, POSE_WALK2, POSE_CLIMB1, POSE_CLIMB2, POSE_JUMP, POSE_DUCK, POSE_HIT,
+  NUM_POSES
+};
+
 struct PlayerTheme {
   QString theme_name;
   QImage stand;
@@ -846,6 +875,11 @@ struct PlayerTheme {
   QImage jump;
   QImage duck;
   QImage hit;
+
+  const QImage& pose(int n) const {
+    const QImage* poses[NUM_POSES] = {&stand, &front, &walk1, &walk2, &climb1, &climb2, &jump, &duck, &hit};
+    return *poses[n];
+  }
 };
 
 struct GroundTheme {
@@ -876,6 +910,191 @@ static std::vector<EnemyTheme> enemy_themer_down;
 static std::vector<QImage> bg_images;
 static std::vector<QString> bg_images_fn;
 
+// -- asset pack --
+// every sprite images_load produces (decoded, mirrored, downsampled) is written
+// once to a binary pack. Later processes mmap it read-only and their QImages
+// point into the shared mapping, so nothing is decoded or scaled twice and the
+// pixels are shared between all ranks on a machine
+
+const uint32_t ASSET_PACK_MAGIC = 0xC0A55E7;
+const int ASSET_PACK_VERSION = 1;
+const int ASSET_KEY_LEN = 112;
+const int ASSET_ALIGN = 64;
+
+struct AssetPackHeader {
+  uint32_t magic;
+  int32_t version;
+  int32_t downsample;
+  int32_t count;
+};
+
+struct AssetPackEntry {
+  char key[ASSET_KEY_LEN]; // resource path, plus |mirrored and |down for derived images
+  int32_t w, h, bytes_per_line, format;
+  int64_t source_mtime; // of the png, 0 for derived images
+  int64_t offset;
+};
+
+static QString asset_pack_path; // empty disables the pack
+static const uint8_t* asset_pack_map = 0;
+static size_t asset_pack_map_size = 0;
+static std::map<QString, const AssetPackEntry*> asset_pack_index;
+static bool asset_pack_stale = false;
+static std::map<qint64, QString> asset_keys; // QImage::cacheKey() -> key, during images_load
+static std::vector<std::pair<AssetPackEntry, QImage>> assets_loaded;
+
+static
+int64_t file_mtime(const QString& path)
+{
+  struct stat st;
+  if (stat(path.toUtf8().constData(), &st) != 0)
+    return 0;
+  return int64_t(st.st_mtime);
+}
+
+static
+void asset_pack_open()
+{
+  if (asset_pack_path.isEmpty())
+    return;
+  asset_pack_stale = true;
+
+  int fd = open(asset_pack_path.toUtf8().constData(), O_RDONLY);
+  if (fd < 0)
+    return;
+  struct stat st;
+  if (fstat(fd, &st) == 0 && size_t(st.st_size) >= sizeof(AssetPackHeader)) {
+    void* m = mmap(0, st.st_size, PROT_READ, MAP_SHARED, fd, 0);
+    if (m != MAP_FAILED) {
+      asset_pack_map = (const uint8_t*)m;
+      asset_pack_map_size = st.st_size;
+    }
+  }
+  close(fd);
+  if (!asset_pack_map)
+    return;
+
+  const AssetPackHeader* hdr = (const AssetPackHeader*)asset_pack_map;
+  size_t index_end = sizeof(AssetPackHeader) + sizeof(AssetPackEntry) * size_t(hdr->count);
+  if (hdr->magic != ASSET_PACK_MAGIC || hdr->version != ASSET_PACK_VERSION || hdr->downsample != DOWNSAMPLE || index_end > asset_pack_map_size)
+    return;
+
+  const AssetPackEntry* entries = (const AssetPackEntry*)(asset_pack_map + sizeof(AssetPackHeader));
+  for (int i = 0; i < hdr->count; i++) {
+    const AssetPackEntry* e = &entries[i];
+    if (e->offset + int64_t(e->bytes_per_line) * e->h > int64_t(asset_pack_map_size))
+      return;
+    asset_pack_index[QString::fromUtf8(e->key)] = e;
+  }
+  asset_pack_stale = false;
+}
+
+// the image for key, from the pack if it is there and fresh, otherwise from make()
+static
+QImage asset_image(const QString& key, int64_t source_mtime, const std::function<QImage()>& make)
+{
+  auto f = asset_pack_index.find(key);
+  if (f != asset_pack_index.end() && f->second->source_mtime != source_mtime) {
+    // a png changed, so anything derived from the pack may be stale too
+    asset_pack_index.clear();
+    f = asset_pack_index.end();
+  }
+
+  QImage img;
+  if (f != asset_pack_index.end()) {
+    const AssetPackEntry* e = f->second;
+    img = QImage(asset_pack_map + e->offset, e->w, e->h, e->bytes_per_line, QImage::Format(e->format));
+  } else {
+    img = make();
+    asset_pack_stale = true;
+  }
+
+  QByteArray key_utf8 = key.toUtf8();
+  assert(key_utf8.size() < ASSET_KEY_LEN);
+  AssetPackEntry e;
+  memset(&e, 0, sizeof(e));
+  strncpy(e.key, key_utf8.constData(), ASSET_KEY_LEN - 1);
+  e.w = img.width();
+  e.h = img.height();
+  e.bytes_per_line = img.bytesPerLine();
+  e.format = img.format();
+  e.source_mtime = source_mtime;
+  assets_loaded.push_back(std::make_pair(e, img));
+  asset_keys[img.cacheKey()] = key;
+  return img;
+}
+
+static
+QString asset_key(const QImage& img)
+{
+  auto f = asset_keys.find(img.cacheKey());
+  assert(f != asset_keys.end() && "image did not come from asset_image");
+  return f->second;
+}
+
+// writes everything loaded by this process to a temporary file and renames it
+// over the pack, so readers never see a partial pack
+static
+void asset_pack_write()
+{
+  QString tmp_path = asset_pack_path + QString(".tmp%1").arg(getpid());
+  FILE* f = fopen(tmp_path.toUtf8().constData(), "wb");
+  if (!f) {
+    fprintf(stderr, "coinrun: cannot write asset pack %s\n", tmp_path.toUtf8().constData());
+    return;
+  }
+
+  AssetPackHeader hdr;
+  hdr.magic = ASSET_PACK_MAGIC;
+  hdr.version = ASSET_PACK_VERSION;
+  hdr.downsample = DOWNSAMPLE;
+  hdr.count = assets_loaded.size();
+
+  int64_t offset = sizeof(AssetPackHeader) + sizeof(AssetPackEntry) * assets_loaded.size();
+  std::vector<AssetPackEntry> entries;
+  for (auto& pair: assets_loaded) {
+    offset = (offset + ASSET_ALIGN - 1) / ASSET_ALIGN * ASSET_ALIGN;
+    AssetPackEntry e = pair.first;
+    e.offset = offset;
+    entries.push_back(e);
+    offset += int64_t(e.bytes_per_line) * e.h;
+  }
+
+  bool ok = fwrite(&hdr, sizeof(hdr), 1, f) == 1;
+  ok = ok && fwrite(entries.data(), sizeof(AssetPackEntry), entries.size(), f) == entries.size();
+  static const char zeros[ASSET_ALIGN] = {0};
+  for (size_t i = 0; ok && i < entries.size(); i++) {
+    long pad = entries[i].offset - ftell(f);
+    ok = fwrite(zeros, 1, pad, f) == size_t(pad);
+    const QImage& img = assets_loaded[i].second;
+    size_t nbytes = size_t(entries[i].bytes_per_line) * entries[i].h;
+    ok = ok && fwrite(img.constBits(), 1, nbytes, f) == nbytes;
+  }
+  ok = (fclose(f) == 0) && ok;
+
+  if (ok && rename(tmp_path.toUtf8().constData(), asset_pack_path.toUtf8().constData()) == 0)
+    return;
+  fprintf(stderr, "coinrun: failed to write asset pack %s\n", asset_pack_path.toUtf8().constData());
+  unlink(tmp_path.toUtf8().constData());
+}
+
+static
+void asset_pack_close()
+{
+  if (asset_pack_stale && !asset_pack_path.isEmpty())
+    asset_pack_write();
+  // images made this run stay on the heap, packed ones keep the mapping alive
+  asset_keys.clear();
+  assets_loaded.clear();
+  asset_pack_index.clear();
+}
+
+static
+QImage mirrored(const QImage& img)
+{
+  return asset_image(asset_key(img) + "|mirrored", 0, [&]() { return img.mirrored(true, false); });
+}
+
 static
 QImage downsample(QImage img)
 {
@@ -883,7 +1102,9 @@ QImage downsample(QImage img)
   assert(w > 0);
   int h = img.height();
 
-  return img.scaled(w / DOWNSAMPLE, h / DOWNSAMPLE, Qt::IgnoreAspectRatio, Qt::SmoothTransformation);
+  return asset_image(asset_key(img) + "|down", 0, [&]() {
+    return img.scaled(w / DOWNSAMPLE, h / DOWNSAMPLE, Qt::IgnoreAspectRatio, Qt::SmoothTransformation);
+  });
 }
 
 static
@@ -949,12 +1170,14 @@ EnemyTheme* choose_enemy_theme(const std::shared_ptr<Monster>& m, int monster_n,
 QImage load_resource(QString relpath)
 {
   auto path = resource_path + "/" + relpath;
-  auto img = QImage(path);
-  if (img.width() == 0) {
-    fprintf(stderr, "failed to load image %s\n", path.toUtf8().constData());
-    exit(EXIT_FAILURE);
-  }
-  return img;
+  return asset_image(relpath, file_mtime(path), [&]() {
+    auto img = QImage(path);
+    if (img.width() == 0) {
+      fprintf(stderr, "failed to load image %s\n", path.toUtf8().constData());
+      exit(EXIT_FAILURE);
+    }
+    return img;
+  });
 }
 
 void load_enemy_themes(const char **ethemes, std::vector<int> &type_theme_idxs, bool is_flying_type, bool is_walking_type) {
@@ -973,8 +1196,8 @@ void load_enemy_themes(const char **ethemes, std::vector<int> &type_theme_idxs,
     EnemyTheme e1d = e1;
 
     EnemyTheme e2 = e1;
-    e2.walk1 = e2.walk1.mirrored(true, false);
-    e2.walk2 = e2.walk2.mirrored(true, false);
+    e2.walk1 = mirrored(e2.walk1);
+    e2.walk2 = mirrored(e2.walk2);
     EnemyTheme e2d = e2;
     enemy_themer.push_back(e2);
 
@@ -1091,15 +1314,15 @@ void images_load()
     PlayerTheme t2;
     PlayerTheme t2d;
     t2.theme_name = QString::fromUtf8(*theme);
-    t2.stand = t1.stand.mirrored(true, false);
-    t2.front = t1.front.mirrored(true, false);
-    t2.walk1 = t1.walk1.mirrored(true, false);
-    t2.walk2 = t1.walk2.mirrored(true, false);
-    t2.climb1 = t1.climb1.mirrored(true, false);
-    t2.climb2 = t1.climb2.mirrored(true, false);
-    t2.jump = t1.jump.mirrored(true, false);
-    t2.duck = t1.duck.mirrored(true, false);
-    t2.hit = t1.hit.mirrored(true, false);
+    t2.stand = mirrored(t1.stand);
+    t2.front = mirrored(t1.front);
+    t2.walk1 = mirrored(t1.walk1);
+    t2.walk2 = mirrored(t1.walk2);
+    t2.climb1 = mirrored(t1.climb1);
+    t2.climb2 = mirrored(t1.climb2);
+    t2.jump = mirrored(t1.jump);
+    t2.duck = mirrored(t1.duck);
+    t2.hit = mirrored(t1.hit);
     player_themesl.push_back(t2);
 
     player_theme_downsample(&t1, &t1d);
@@ -1140,7 +1363,8 @@ struct Agent {
   float spring = 0;
   float zoom = 1.0;
   float target_zoom = 1.0;
-  uint8_t render_buf[RES_W*RES_H*4];
+  // this env's slices of the buffers registered at vec_create, the hires one is RGB888
+  uint8_t* render_buf = 0;
   uint8_t* render_hires_buf = 0;
   bool game_over = false;
   float reward = 0;
@@ -1155,10 +1379,6 @@ struct Agent {
   double t0;
 
   ~Agent() {
-    if (render_hires_buf) {
-      delete render_hires_buf;
-      render_hires_buf = 0;
-    }
     if (monitor_csv) {
       fclose(monitor_csv);
       monitor_csv = 0;
@@ -1378,18 +1598,23 @@ struct Agent {
     }
   }
 
-  QImage picture(PlayerTheme *theme) const
+  int pose() const
   {
     if (ladder_mode)
-      return (time_alive / 5 % 2 == 0) ? theme->climb1 : theme->climb2;
+      return (time_alive / 5 % 2 == 0) ? POSE_CLIMB1 : POSE_CLIMB2;
     if (vy != 0)
-      return theme->jump;
+      return POSE_JUMP;
     if (spring != 0)
-      return theme->duck;
+      return POSE_DUCK;
     if (vx == 0)
-      return theme->stand;
+      return POSE_STAND;
+
+    return (time_alive / 5 % 2 == 0) ? POSE_WALK1 : POSE_WALK2;
+  }
 
-    return (time_alive / 5 % 2 == 0) ? theme->walk1 : theme->walk2;
+  QImage picture(PlayerTheme *theme) const
+  {
+    return theme->pose(pose());
   }
 };
 
@@ -1433,34 +1658,27 @@ struct State {
    std::weak_ptr<VectorOfStates> belongs_to;
    int time;
    Agent agent;
+   RandGen level_rand_gen; // picks the level on reset, part of the snapshot
+};
 
-  QMutex step_mutex;
-   bool step_in_progress = false;
-   bool agent_ready = false;
+struct Level {
+  std::shared_ptr<Maze> maze;
+  int theme_n;
+  int ground_n;
+  int bg_n;
 };
 
-void state_reset(const std::shared_ptr<State>& state, int game_type)
+static
+Level generate_level(int level_seed, int game_type)
 {
-  assert(player_themesl.size() > 0 && "Please call init(threads) first");
-
-  int level_seed = 0;
-
-  if (USE_LEVEL_SET) {
-    int level_index = global_rand_gen.randint(0, NUM_LEVELS);
-    level_seed = LEVEL_SEEDS[level_index];
-  } else if (NUM_LEVELS > 0) {
-    level_seed = global_rand_gen.randint(0, NUM_LEVELS);
-  } else {
-    level_seed = global_rand_gen.randint();
-  }
-
   RandomMazeGenerator maze_gen;
   maze_gen.rand_gen.seed(level_seed);
 
   int w = 64;
   int h = 64;
-  state->maze.reset(new Maze(w, h, game_type));
-  maze_gen.maze = state->maze;
+  Level level;
+  level.maze.reset(new Maze(w, h, game_type));
+  maze_gen.maze = level.maze;
 
   maze_gen.initial_floor_and_walls(game_type);
 
@@ -1475,15 +1693,95 @@ void state_reset(const std::shared_ptr<State>& state, int game_type)
     maze_gen.generate_test_level();
   }
 
+  level.theme_n = maze_gen.randn(player_themesl.size());
+  level.ground_n = maze_gen.randn(ground_themes.size());
+  level.bg_n = maze_gen.randn(bg_images.size());
+
+  return level;
+}
+
+// -- maze cache --
+// with a finite level set the same seeds keep coming back, so generated levels
+// are kept as pristine templates keyed by (game_type, seed) and resets copy them
+
+struct CachedLevel {
+  Level level;
+  std::list<std::pair<int, int>>::iterator lru_it;
+};
+
+static int MAZE_CACHE_SIZE = 1024; // 0 disables the cache
+static QMutex maze_cache_mutex;
+static std::map<std::pair<int, int>, CachedLevel> maze_cache;
+static std::list<std::pair<int, int>> maze_cache_lru; // most recently used first
+static std::atomic<int64_t> maze_cache_hits{0};
+static std::atomic<int64_t> maze_cache_misses{0};
+
+static
+Level load_level(int level_seed, int game_type)
+{
+  if (NUM_LEVELS <= 0 || MAZE_CACHE_SIZE <= 0)
+    return generate_level(level_seed, game_type);
+
+  std::pair<int, int> key(game_type, level_seed);
+  Level level;
+  bool hit = false;
+  {
+    QMutexLocker lock(&maze_cache_mutex);
+    auto f = maze_cache.find(key);
+    if (f != maze_cache.end()) {
+      maze_cache_lru.splice(maze_cache_lru.begin(), maze_cache_lru, f->second.lru_it);
+      level = f->second.level;
+      hit = true;
+    }
+  }
+
+  if (hit) {
+    maze_cache_hits++;
+  } else {
+    maze_cache_misses++;
+    level = generate_level(level_seed, game_type);
+    QMutexLocker lock(&maze_cache_mutex);
+    if (maze_cache.find(key) == maze_cache.end()) {
+      maze_cache_lru.push_front(key);
+      maze_cache[key] = CachedLevel{level, maze_cache_lru.begin()};
+      while (int(maze_cache.size()) > MAZE_CACHE_SIZE) {
+        maze_cache.erase(maze_cache_lru.back());
+        maze_cache_lru.pop_back();
+      }
+    }
+  }
+
+  level.maze = level.maze->clone();
+  return level;
+}
+
+void state_reset(const std::shared_ptr<State>& state, int game_type)
+{
+  assert(player_themesl.size() > 0 && "Please call init(threads) first");
+
+  int level_seed = 0;
+
+  if (USE_LEVEL_SET) {
+    int level_index = state->level_rand_gen.randint(0, NUM_LEVELS);
+    level_seed = LEVEL_SEEDS[level_index];
+  } else if (NUM_LEVELS > 0) {
+    level_seed = state->level_rand_gen.randint(0, NUM_LEVELS);
+  } else {
+    level_seed = state->level_rand_gen.randint();
+  }
+
+  Level level = load_level(level_seed, game_type);
+  state->maze = level.maze;
+
   Agent &agent = state->agent;
   float zoom = state->maze->default_zoom;
   agent.maze = state->maze;
   agent.zoom = zoom;
   agent.target_zoom = zoom;
 
-  agent.theme_n = maze_gen.randn(player_themesl.size());
-  state->ground_n = maze_gen.randn(ground_themes.size());
-  state->bg_n = maze_gen.randn(bg_images.size());
+  agent.theme_n = level.theme_n;
+  state->ground_n = level.ground_n;
+  state->bg_n = level.bg_n;
 
   agent.reset(0);
 
@@ -1491,6 +1789,184 @@ void state_reset(const std::shared_ptr<State>& state, int game_type)
   state->time = 0;
 }
 
+// -- snapshots --
+// a State serializes to a header, its w*h walls, then its monsters. The header
+// records the snapshot's size in bytes, so envs are written back to back.
+// Everything in it is trivially copyable, so restoring is a few memcpys and
+// a restored env steps exactly like the one it was taken from.
+
+static_assert(std::is_trivially_copyable<Monster>::value, "Monster is copied bytewise");
+static_assert(std::is_trivially_copyable<RandGen>::value, "RandGen is copied bytewise");
+
+const uint32_t SNAPSHOT_MAGIC = 0xC014002;
+
+struct SnapshotHeader {
+  uint32_t magic;
+  uint32_t size;
+  int time;
+  int ground_n;
+  int bg_n;
+  RandGen level_rand_gen;
+
+  // maze
+  int spawnpos[2];
+  int w, h;
+  int game_type;
+  int coins;
+  bool is_terminated;
+  float gravity, max_jump, air_control, max_dy, max_dx, default_zoom, max_speed, mix_rate;
+  int monsters_n;
+
+  // agent, render buffers and the monitor file stay with the env
+  int theme_n;
+  float x, y, vx, vy;
+  float spring, zoom, target_zoom;
+  bool game_over;
+  float reward, reward_sum;
+  bool is_facing_right, ladder_mode;
+  int action_dx, action_dy;
+  int time_alive;
+  bool support;
+};
+
+static
+size_t snapshot_size(int w, int h, int monsters_n)
+{
+  return sizeof(SnapshotHeader) + sizeof(int)*size_t(w*h) + sizeof(Monster)*size_t(monsters_n);
+}
+
+static
+size_t state_snapshot_size(const std::shared_ptr<State>& state)
+{
+  const Maze* maze = state->maze.get();
+  return snapshot_size(maze->w, maze->h, maze->monsters.size());
+}
+
+// writes state_snapshot_size(state) bytes
+static
+void state_save(const std::shared_ptr<State>& state, uint8_t* out)
+{
+  const Maze* maze = state->maze.get();
+  const Agent& a = state->agent;
+  int monsters_n = maze->monsters.size();
+
+  SnapshotHeader hdr;
+  memset((void*)&hdr, 0, sizeof(hdr));
+  hdr.magic = SNAPSHOT_MAGIC;
+  hdr.size = snapshot_size(maze->w, maze->h, monsters_n);
+  hdr.time = state->time;
+  hdr.ground_n = state->ground_n;
+  hdr.bg_n = state->bg_n;
+  hdr.level_rand_gen = state->level_rand_gen;
+
+  hdr.spawnpos[0] = maze->spawnpos[0];
+  hdr.spawnpos[1] = maze->spawnpos[1];
+  hdr.w = maze->w;
+  hdr.h = maze->h;
+  hdr.game_type = maze->game_type;
+  hdr.coins = maze->coins;
+  hdr.is_terminated = maze->is_terminated;
+  hdr.gravity = maze->gravity;
+  hdr.max_jump = maze->max_jump;
+  hdr.air_control = maze->air_control;
+  hdr.max_dy = maze->max_dy;
+  hdr.max_dx = maze->max_dx;
+  hdr.default_zoom = maze->default_zoom;
+  hdr.max_speed = maze->max_speed;
+  hdr.mix_rate = maze->mix_rate;
+  hdr.monsters_n = monsters_n;
+
+  hdr.theme_n = a.theme_n;
+  hdr.x = a.x;
+  hdr.y = a.y;
+  hdr.vx = a.vx;
+  hdr.vy = a.vy;
+  hdr.spring = a.spring;
+  hdr.zoom = a.zoom;
+  hdr.target_zoom = a.target_zoom;
+  hdr.game_over = a.game_over;
+  hdr.reward = a.reward;
+  hdr.reward_sum = a.reward_sum;
+  hdr.is_facing_right = a.is_facing_right;
+  hdr.ladder_mode = a.ladder_mode;
+  hdr.action_dx = a.action_dx;
+  hdr.action_dy = a.action_dy;
+  hdr.time_alive = a.time_alive;
+  hdr.support = a.support;
+
+  memcpy(out, &hdr, sizeof(hdr));
+  out += sizeof(hdr);
+  memcpy(out, maze->walls, sizeof(int)*maze->w*maze->h);
+  out += sizeof(int)*maze->w*maze->h;
+  for (const std::shared_ptr<Monster>& m: maze->monsters) {
+    memcpy(out, m.get(), sizeof(Monster));
+    out += sizeof(Monster);
+  }
+}
+
+// reads one snapshot from at most avail bytes, returns its size or 0 if it is not a valid snapshot
+static
+size_t state_load(const std::shared_ptr<State>& state, const uint8_t* in, size_t avail)
+{
+  SnapshotHeader hdr;
+  if (avail < sizeof(hdr))
+    return 0;
+  memcpy(&hdr, in, sizeof(hdr));
+  in += sizeof(hdr);
+  if (hdr.magic != SNAPSHOT_MAGIC || hdr.w <= 0 || hdr.h <= 0 || hdr.monsters_n < 0 ||
+      hdr.size != snapshot_size(hdr.w, hdr.h, hdr.monsters_n) || hdr.size > avail)
+    return 0;
+
+  std::shared_ptr<Maze> maze(new Maze(hdr.w, hdr.h, hdr.game_type));
+  maze->spawnpos[0] = hdr.spawnpos[0];
+  maze->spawnpos[1] = hdr.spawnpos[1];
+  maze->coins = hdr.coins;
+  maze->is_terminated = hdr.is_terminated;
+  maze->gravity = hdr.gravity;
+  maze->max_jump = hdr.max_jump;
+  maze->air_control = hdr.air_control;
+  maze->max_dy = hdr.max_dy;
+  maze->max_dx = hdr.max_dx;
+  maze->default_zoom = hdr.default_zoom;
+  maze->max_speed = hdr.max_speed;
+  maze->mix_rate = hdr.mix_rate;
+  memcpy(maze->walls, in, sizeof(int)*hdr.w*hdr.h);
+  in += sizeof(int)*hdr.w*hdr.h;
+  maze->monsters.resize(hdr.monsters_n);
+  for (std::shared_ptr<Monster>& m: maze->monsters) {
+    m.reset(new Monster);
+    memcpy(m.get(), in, sizeof(Monster));
+    in += sizeof(Monster);
+  }
+
+  state->maze = maze;
+  state->time = hdr.time;
+  state->ground_n = hdr.ground_n;
+  state->bg_n = hdr.bg_n;
+  state->level_rand_gen = hdr.level_rand_gen;
+
+  Agent& a = state->agent;
+  a.maze = maze;
+  a.theme_n = hdr.theme_n;
+  a.x = hdr.x;
+  a.y = hdr.y;
+  a.vx = hdr.vx;
+  a.vy = hdr.vy;
+  a.spring = hdr.spring;
+  a.zoom = hdr.zoom;
+  a.target_zoom = hdr.target_zoom;
+  a.game_over = hdr.game_over;
+  a.reward = hdr.reward;
+  a.reward_sum = hdr.reward_sum;
+  a.is_facing_right = hdr.is_facing_right;
+  a.ladder_mode = hdr.ladder_mode;
+  a.action_dx = hdr.action_dx;
+  a.action_dy = hdr.action_dy;
+  a.time_alive = hdr.time_alive;
+  a.support = hdr.support;
+  return hdr.size;
+}
+
 // -- render --
 
 static
@@ -1672,6 +2148,302 @@ void paint_the_world(
   }
 }
 
+// -- software render --
+// 64x64 observations without QPainter. Sprites are scaled once per on-screen
+// tile size (i.e. per zoom level) into premultiplied RGBA atlases, then blitted
+// at integer positions into the RGB buffer. paint_the_world stays the reference
+// and is still used for hi-res frames.
+
+struct Sprite {
+  int w = 0;
+  int h = 0;
+  bool opaque = true;
+  std::vector<uint8_t> rgba; // premultiplied
+};
+
+static
+Sprite make_sprite(const QImage& img, int w, int h)
+{
+  Sprite s;
+  s.w = w;
+  s.h = h;
+  s.rgba.resize(w * h * 4);
+  QImage scaled = img.scaled(w, h, Qt::IgnoreAspectRatio, Qt::SmoothTransformation).convertToFormat(QImage::Format_RGBA8888_Premultiplied);
+  for (int y = 0; y < h; y++)
+    memcpy(&s.rgba[y * w * 4], scaled.constScanLine(y), w * 4);
+  for (int i = 3; i < w * h * 4; i += 4)
+    s.opaque &= s.rgba[i] == 255;
+  return s;
+}
+
+struct SpriteAtlas {
+  int tile_w, tile_h, bg_w, bg_h;
+  std::vector<std::map<int, Sprite>> walls; // per ground theme
+  std::vector<Sprite> default_wall;
+  std::vector<std::vector<Sprite>> player_l, player_r; // per player theme, indexed by PlayerPose
+  std::vector<std::vector<Sprite>> enemy_l, enemy_r;   // per enemy theme, walk1 and walk2
+  std::vector<Sprite> backgrounds;
+};
+
+static
+std::shared_ptr<SpriteAtlas> build_atlas(int tile_w, int tile_h, int bg_w, int bg_h)
+{
+  std::shared_ptr<SpriteAtlas> atlas(new SpriteAtlas);
+  atlas->tile_w = tile_w;
+  atlas->tile_h = tile_h;
+  atlas->bg_w = bg_w;
+  atlas->bg_h = bg_h;
+
+  for (const GroundTheme& g: ground_themes_down) {
+    std::map<int, Sprite> walls;
+    for (const std::pair<char, QImage> &pair : g.walls)
+      walls[pair.first] = make_sprite(pair.second, tile_w, tile_h);
+    atlas->walls.push_back(walls);
+    atlas->default_wall.push_back(make_sprite(g.default_wall, tile_w, tile_h));
+  }
+
+  for (int r = 0; r < 2; r++) {
+    const std::vector<PlayerTheme>& themes = r ? player_themesr_down : player_themesl_down;
+    std::vector<std::vector<Sprite>>& out = r ? atlas->player_r : atlas->player_l;
+    for (const PlayerTheme& t: themes) {
+      std::vector<Sprite> poses;
+      for (int n = 0; n < NUM_POSES; n++)
+        poses.push_back(make_sprite(t.pose(n), tile_w, 2 * tile_h));
+      out.push_back(poses);
+    }
+  }
+
+  for (int r = 0; r < 2; r++) {
+    const std::vector<EnemyTheme>& themes = r ? enemy_themer_down : enemy_themel_down;
+    std::vector<std::vector<Sprite>>& out = r ? atlas->enemy_r : atlas->enemy_l;
+    for (const EnemyTheme& e: themes)
+      out.push_back({make_sprite(e.walk1, tile_w, tile_h), make_sprite(e.walk2, tile_w, tile_h)});
+  }
+
+  for (const QImage& bg: bg_images)
+    atlas->backgrounds.push_back(make_sprite(bg, bg_w, bg_h));
+
+  return atlas;
+}
+
+static QMutex atlases_mutex;
+static std::map<std::vector<int>, std::shared_ptr<SpriteAtlas>> atlases;
+
+static
+std::shared_ptr<SpriteAtlas> find_atlas(int tile_w, int tile_h, int bg_w, int bg_h)
+{
+  // zoom is constant in practice, so each thread keeps the last atlas and skips the lock
+  thread_local std::shared_ptr<SpriteAtlas> last;
+  if (last && last->tile_w == tile_w && last->tile_h == tile_h && last->bg_w == bg_w && last->bg_h == bg_h)
+    return last;
+
+  QMutexLocker lock(&atlases_mutex);
+  std::vector<int> key = {tile_w, tile_h, bg_w, bg_h};
+  std::shared_ptr<SpriteAtlas>& atlas = atlases[key];
+  if (!atlas)
+    atlas = build_atlas(tile_w, tile_h, bg_w, bg_h);
+  last = atlas;
+  return atlas;
+}
+
+static inline
+int round_px(double f)
+{
+  return int(floor(f + 0.5));
+}
+
+// src-over blit of a premultiplied sprite, columns rotated left by `shift`
+static
+void blit(uint8_t* buf, int res_w, int res_h, const Sprite& s, int x0, int y0, int shift=0)
+{
+  int xa = max(x0, 0), xb = min(x0 + s.w, res_w);
+  int ya = max(y0, 0), yb = min(y0 + s.h, res_h);
+  for (int y = ya; y < yb; y++) {
+    uint8_t* d = buf + (y * res_w + xa) * 3;
+    const uint8_t* row = &s.rgba[(y - y0) * s.w * 4];
+    for (int x = xa; x < xb; x++, d += 3) {
+      const uint8_t* p = row + ((x - x0 + shift) % s.w) * 4;
+      if (s.opaque || p[3] == 255) {
+        d[0] = p[0]; d[1] = p[1]; d[2] = p[2];
+      } else if (p[3]) {
+        int ia = 255 - p[3];
+        d[0] = p[0] + (d[0] * ia + 127) / 255;
+        d[1] = p[1] + (d[1] * ia + 127) / 255;
+        d[2] = p[2] + (d[2] * ia + 127) / 255;
+      }
+    }
+  }
+}
+
+static
+void fill_rect(uint8_t* buf, int res_w, int res_h, double fx, double fy, double fw, double fh, int r, int g, int b, int a=255)
+{
+  int xa = max(round_px(fx), 0), xb = min(round_px(fx + fw), res_w);
+  int ya = max(round_px(fy), 0), yb = min(round_px(fy + fh), res_h);
+  for (int y = ya; y < yb; y++) {
+    uint8_t* d = buf + (y * res_w + xa) * 3;
+    for (int x = xa; x < xb; x++, d += 3) {
+      d[0] = (r * a + d[0] * (255 - a) + 127) / 255;
+      d[1] = (g * a + d[1] * (255 - a) + 127) / 255;
+      d[2] = (b * a + d[2] * (255 - a) + 127) / 255;
+    }
+  }
+}
+
+static
+void fill_ellipse(uint8_t* buf, int res_w, int res_h, double fx, double fy, double fw, double fh, int r, int g, int b, int a)
+{
+  double cx = fx + fw / 2, cy = fy + fh / 2;
+  double rx = fw / 2, ry = fh / 2;
+  if (rx <= 0 || ry <= 0)
+    return;
+  int xa = max(int(floor(fx)), 0), xb = min(int(ceil(fx + fw)), res_w);
+  int ya = max(int(floor(fy)), 0), yb = min(int(ceil(fy + fh)), res_h);
+  for (int y = ya; y < yb; y++) {
+    double ny = (y + 0.5 - cy) / ry;
+    for (int x = xa; x < xb; x++) {
+      double nx = (x + 0.5 - cx) / rx;
+      if (nx * nx + ny * ny > 1)
+        continue;
+      uint8_t* d = buf + (y * res_w + x) * 3;
+      d[0] = (r * a + d[0] * (255 - a) + 127) / 255;
+      d[1] = (g * a + d[1] * (255 - a) + 127) / 255;
+      d[2] = (b * a + d[2] * (255 - a) + 127) / 255;
+    }
+  }
+}
+
+// same layout math as paint_the_world, drawn with the blits above
+static
+void software_paint_the_world(
+  uint8_t* buf, int res_w, int res_h,
+  const std::shared_ptr<State>& state, const Agent* agent)
+{
+  const_cast<Agent*>(agent)->zoom = 0.9*agent->zoom + 0.1*agent->target_zoom;
+  double zoom = agent->zoom;
+  const double bgzoom = 0.4;
+
+  std::shared_ptr<Maze> maze = agent->maze;
+
+  bool maze_render = maze->game_type == CoinRunMaze_v0;
+
+  double kx = zoom * res_w / double(maze->h);  // not w!
+  double ky = zoom * res_h / double(maze->h);
+  double center_x = (res_w - 1) / 2;  // QRect::center() rounds down
+  double center_y = (res_h - 1) / 2;
+  double dx = (-agent->x) * kx + center_x - 0.5*kx;
+  double dy = (agent->y) * ky - center_y - 0.5*ky;
+  double zx = res_w * zoom;
+  double zy = res_h * zoom;
+
+  std::shared_ptr<SpriteAtlas> atlas = find_atlas(round_px(kx), round_px(ky), round_px(zx), round_px(zy));
+
+  if (maze_render) {
+    fill_rect(buf, res_w, res_h, 0, 0, res_w, res_h, 30, 30, 30);
+  } else {
+    const Sprite& bg = atlas->backgrounds[state->bg_n];
+    for (int tile_x=-1; tile_x<=2; tile_x++) {
+      for (int tile_y=-1; tile_y<=1; tile_y++) {
+        double cx = zx*tile_x + center_x + bgzoom*(dx + kx*maze->h/2);
+        double cy = zy*tile_y + center_y + bgzoom*(dy - ky*maze->h/2);
+        blit(buf, res_w, res_h, bg, round_px(cx - zx/2), round_px(cy - zy/2));
+      }
+    }
+  }
+
+  int radius = int(1 + maze->h / zoom);
+  int ix = int(agent->x + .5);
+  int iy = int(agent->y + .5);
+  int x_start = max(ix - radius, 0);
+  int x_end = min(ix + radius + 1, maze->w);
+  int y_start = max(iy - radius, 0);
+  int y_end = min(iy + radius + 1, maze->h);
+  double WINH = res_h;
+
+  const std::map<int, Sprite>& walls = atlas->walls[state->ground_n];
+  const Sprite& default_wall = atlas->default_wall[state->ground_n];
+
+  for (int y=y_start; y<y_end; ++y) {
+    for (int x=x_start; x<x_end; x++) {
+      int wkey = maze->get_elem(x, y);
+      if (wkey==SPACE) continue;
+
+      double fx = kx*x + dx;
+      double fy = WINH - ky*y + dy;
+
+      if (maze_render) {
+        if (is_coin(wkey)) {
+          fill_rect(buf, res_w, res_h, fx, fy, kx, ky, 255, 255, 0);
+        } else if (wkey == WALL_MIDDLE || wkey == WALL_SURFACE) {
+          fill_rect(buf, res_w, res_h, fx, fy, kx, ky, 150, 150, 150);
+        }
+        continue;
+      }
+
+      auto f = walls.find(wkey);
+      const Sprite& sprite = f == walls.end() ? default_wall : f->second;
+      int shift = 0;
+      if (wkey==LAVA_MIDDLE || wkey==LAVA_SURFACE) {
+        float tr = state->time*0.1;
+        tr -= int(tr);
+        shift = round_px(tr * sprite.w) % sprite.w;
+      }
+      blit(buf, res_w, res_h, sprite, round_px(fx), round_px(fy), shift);
+    }
+  }
+
+  if (maze_render) {
+    fill_rect(buf, res_w, res_h, kx * agent->x + dx, WINH - ky * (agent->y+1) + dy + ky, kx, ky, 0, 255, 199);
+  } else {
+    const std::vector<Sprite>& poses = (agent->is_facing_right ? atlas->player_r : atlas->player_l)[agent->theme_n];
+    blit(buf, res_w, res_h, poses[agent->pose()], round_px(kx * agent->x + dx), round_px(WINH - ky * (agent->y+1) + dy));
+  }
+
+  for (const std::shared_ptr<Monster>& m: maze->monsters) {
+    if (m->is_flying || m->is_walking) {
+      for (int t=2; t<MONSTER_TRAIL; t+=2) {
+        float ft = 1 - float(t)/MONSTER_TRAIL;
+        float smaller = 0.20;
+        float lower = -0.22;
+        float soar = -0.4;
+        double left = kx*m->prev_x[t] + dx + (smaller-0.2*ft)*kx;
+        double top = WINH - ky*m->prev_y[t] + dy + (soar*ft-0.2*ft-lower+smaller)*ky;
+        double right = kx*m->prev_x[t] + dx + kx + (-smaller+0.2*ft)*kx;
+        double bottom = WINH - ky*m->prev_y[t] + dy + ky + (soar*ft+0.2*ft-lower-smaller)*ky;
+        fill_ellipse(buf, res_w, res_h, left, top, right - left, bottom - top, 255, 255, 255, t*127/MONSTER_TRAIL);
+      }
+    }
+    const std::vector<Sprite>& frames = (m->vx>0 ? atlas->enemy_r : atlas->enemy_l)[m->theme_n];
+    int anim_freq = enemy_themel[m->theme_n].anim_freq;
+    blit(buf, res_w, res_h, frames[state->time / anim_freq % 2], round_px(kx*m->x + dx), round_px(WINH - ky*m->y + dy));
+  }
+
+  if (USE_DATA_AUGMENTATION) {
+    float max_rand_dim = .25;
+    float min_rand_dim = .1;
+    int num_blotches = global_rand_gen.randint(0, 6);
+
+    for (int j = 0; j < num_blotches; j++) {
+      float rx = global_rand_gen.rand01() * res_w;
+      float ry = global_rand_gen.rand01() * res_h;
+      float rdx = (global_rand_gen.rand01() * max_rand_dim + min_rand_dim) * res_w;
+      float rdy = (global_rand_gen.rand01() * max_rand_dim + min_rand_dim) * res_h;
+      int r = global_rand_gen.randint(0, 255);
+      int g = global_rand_gen.randint(0, 255);
+      int b = global_rand_gen.randint(0, 255);
+      fill_rect(buf, res_w, res_h, rx, ry, rdx, rdy, r, g, b);
+    }
+  }
+
+  if (PAINT_VEL_INFO) {
+    float infodim = res_h * .2;
+    int s1 = to_shade(.5 * agent->vx / maze->max_speed + .5);
+    int s2 = to_shade(.5 * agent->vy / maze->max_jump + .5);
+    fill_rect(buf, res_w, res_h, 0, 0, infodim, infodim, s1, s1, s1);
+    fill_rect(buf, res_w, res_h, infodim, 0, infodim, infodim, s2, s2, s2);
+  }
+}
+
 // -- vecenv --
 
 class VectorOfStates {
@@ -1681,13 +2453,38 @@ public:
   int handle;
   QMutex states_mutex;
   std::vector<std::shared_ptr<State>> states; // nenvs
+  // caller-owned, written by the stepping threads
+  float* rew;
+  bool* done;
+
+  int frame_skip = 1;
+  bool render = true; // for the step in flight
+
+  // observations are [nenvs, RES_H, RES_W, obs_slots, obs_channels], 3 channels
+  // is RGB and 1 grayscale. Each rendered step writes the frame to obs_slot and,
+  // if set, obs_mirror_slot, which is how frame stacking keeps a ring in place
+  int obs_channels = 3;
+  int obs_slots = 1;
+  int obs_slot = 0;
+  int obs_mirror_slot = -1;
+
+  // the step in flight is split into nchunks runs of contiguous envs, threads
+  // claim them through next_chunk and whoever finishes the last one signals
+  int nchunks = 1;
+  std::atomic<int> next_chunk{0};
+  std::atomic<int> chunks_done{0};
+  QMutex step_mutex;
+  QWaitCondition step_completed;
+  bool step_done = true;
 };
 
+// more chunks than threads lets idle threads take work from slow ones
+const int STEP_CHUNKS_PER_THREAD = 2;
+
 static QMutex h2s_mutex;
 static QWaitCondition wait_for_actions;
-static QWaitCondition wait_for_step_completed;
 static std::map<int, std::shared_ptr<VectorOfStates>> h2s;
-static std::list<std::shared_ptr<State>> workers_todo;
+static std::list<std::shared_ptr<VectorOfStates>> steps_todo; // vec steps with unclaimed chunks
 static int handle_seq = 100;
 
 static std::shared_ptr<VectorOfStates> vstate_find(int handle)
@@ -1702,91 +2499,128 @@ static std::shared_ptr<VectorOfStates> vstate_find(int handle)
 }
 
 static
-void copy_render_buf(int e, uint8_t* obs_rgb, uint8_t* buf, int res_w, int res_h)
+void paint_render_buf(uint8_t* buf, int res_w, int res_h, const std::shared_ptr<State>& todo_state, const Agent* a, bool recon, bool lasers)
 {
-  for (int y = 0; y<res_h; y++) {
-    for (int x = 0; x<res_w; x++) {
-      uint8_t* p = obs_rgb + e*res_h*res_w*3 + y*res_w*3 + x*3;
+  // paints straight into the caller's RGB observation, no BGRA intermediate
+  QImage img((uchar*)buf, res_w, res_h, res_w * 3, QImage::Format_RGB888);
+  QPainter p(&img);
+  paint_the_world(p, QRect(0, 0, res_w, res_h), todo_state, a, recon, lasers);
+}
 
-      p[0] = buf[y*res_w*4 + x*4 + 2];
-      p[1] = buf[y*res_w*4 + x*4 + 1];
-      p[2] = buf[y*res_w*4 + x*4 + 0];
+static
+void pack_obs(const uint8_t* rgb, uint8_t* dst, int channels, int stride)
+{
+  int npix = RES_W * RES_H;
+  if (channels == 3) {
+    for (int i = 0; i < npix; i++, rgb += 3, dst += stride) {
+      dst[0] = rgb[0];
+      dst[1] = rgb[1];
+      dst[2] = rgb[2];
     }
+  } else {
+    // truncating mean, same values as the old np.mean(...).astype(np.uint8)
+    for (int i = 0; i < npix; i++, rgb += 3, dst += stride)
+      dst[0] = (rgb[0] + rgb[1] + rgb[2]) / 3;
   }
 }
 
 static
-void paint_render_buf(uint8_t* buf, int res_w, int res_h, const std::shared_ptr<State>& todo_state, const Agent* a, bool recon, bool lasers)
+void step_state(const std::shared_ptr<State>& todo_state, VectorOfStates* belongs_to)
 {
-  QImage img((uchar*)buf, res_w, res_h, res_w * 4, QImage::Format_RGB32);
-  QPainter p(&img);
-  paint_the_world(p, QRect(0, 0, res_w, res_h), todo_state, a, recon, lasers);
+  QMutexLocker lock(&todo_state->state_mutex);
+  Agent& a = todo_state->agent;
+
+  // physics advances frame_skip times with rewards summed, an episode end cuts the skip short
+  for (int k = 0; k < belongs_to->frame_skip && !a.game_over; k++) {
+    todo_state->time += 1;
+    bool game_over = todo_state->maze->is_terminated;
+
+    for (const std::shared_ptr<Monster>& m: todo_state->maze->monsters) {
+      m->step(todo_state->maze);
+      if (fabs(m->x - a.x) + fabs(m->y - a.y) < 1.0)
+        todo_state->maze->is_terminated = true;  // no effect on agent score
+    }
+
+    if (game_over)
+      a.monitor_csv_episode_over();
+    a.game_over = game_over;
+    a.step(belongs_to->game_type);
+
+    if (game_over) {
+      state_reset(todo_state, belongs_to->game_type);
+    }
+  }
+
+  if (belongs_to->render) {
+    // plain RGB is painted in place, other layouts go through an RGB scratch frame
+    int channels = belongs_to->obs_channels;
+    bool direct = channels == 3 && belongs_to->obs_slots == 1;
+    thread_local std::vector<uint8_t> scratch;
+    scratch.resize(RES_W * RES_H * 3);
+    uint8_t* rgb = direct ? a.render_buf : scratch.data();
+
+    if (SOFTWARE_RENDER)
+      software_paint_the_world(rgb, RES_W, RES_H, todo_state, &a);
+    else
+      paint_render_buf(rgb, RES_W, RES_H, todo_state, &a, false, false);
+
+    if (!direct) {
+      int stride = belongs_to->obs_slots * channels;
+      pack_obs(rgb, a.render_buf + belongs_to->obs_slot * channels, channels, stride);
+      if (belongs_to->obs_mirror_slot >= 0)
+        pack_obs(rgb, a.render_buf + belongs_to->obs_mirror_slot * channels, channels, stride);
+    }
+    if (a.render_hires_buf)
+      paint_render_buf(a.render_hires_buf, VIDEORES, VIDEORES, todo_state, &a, false, false);
+  }
+
+  int e = todo_state->state_n;
+  belongs_to->rew[e] = a.reward;
+  belongs_to->done[e] = a.game_over;
+  a.reward = 0;
+  a.game_over = false;
 }
 
 static
 void stepping_thread(int n)
 {
   while (1) {
-    std::shared_ptr<State> todo_state;
-    std::list<std::shared_ptr<State>> my_todo;
-    while (1) {
-      if (shutdown_flag)
-        return;
+    std::shared_ptr<VectorOfStates> job;
+    {
       QMutexLocker sleeplock(&h2s_mutex);
-      if (workers_todo.empty()) {
+      while (steps_todo.empty()) {
+        if (shutdown_flag)
+          return;
         wait_for_actions.wait(&h2s_mutex, 1000); // milliseconds
-        continue;
       }
-      my_todo.splice(my_todo.begin(), workers_todo, workers_todo.begin());
-      break;
-    }
-    todo_state = my_todo.front();
-
-    {
-      QMutexLocker lock(&todo_state->step_mutex);
-      assert(todo_state->agent_ready);
-      todo_state->step_in_progress = true;
+      if (shutdown_flag)
+        return;
+      job = steps_todo.front();
     }
 
-    {
-      QMutexLocker lock(&todo_state->state_mutex);
-      std::shared_ptr<VectorOfStates> belongs_to = todo_state->belongs_to.lock();
-      if (!belongs_to)
-        continue;
-      todo_state->time += 1;
-      bool game_over = todo_state->maze->is_terminated;
-
-      for (const std::shared_ptr<Monster>& m: todo_state->maze->monsters) {
-        m->step(todo_state->maze);
-        Agent& a = todo_state->agent;
-        if (fabs(m->x - a.x) + fabs(m->y - a.y) < 1.0)
-          todo_state->maze->is_terminated = true;  // no effect on agent score
-      }
-
-      Agent& a = todo_state->agent;
-      if (game_over)
-        a.monitor_csv_episode_over();
-      a.game_over = game_over;
-      a.step(belongs_to->game_type);
-
-      if (game_over) {
-        state_reset(todo_state, belongs_to->game_type);
+    // no locks shared between threads on this path, only the chunk counters
+    while (1) {
+      int c = job->next_chunk.fetch_add(1);
+      if (c >= job->nchunks)
+        break;
+      int begin = c * job->nenvs / job->nchunks;
+      int end = (c + 1) * job->nenvs / job->nchunks;
+      for (int e = begin; e < end; e++)
+        step_state(job->states[e], job.get());
+
+      if (job->chunks_done.fetch_add(1) + 1 == job->nchunks) {
+        QMutexLocker lock(&job->step_mutex);
+        job->step_done = true;
+        job->step_completed.wakeAll();
       }
-
-      paint_render_buf(a.render_buf, RES_W, RES_H, todo_state, &a, false, false);
-      if (a.render_hires_buf)
-        paint_render_buf(a.render_hires_buf, VIDEORES, VIDEORES, todo_state, &a, false, false);
     }
 
     {
-      QMutexLocker lock(&todo_state->step_mutex);
-      assert(todo_state->agent_ready);
-      assert(todo_state->step_in_progress);
-      todo_state->agent_ready = false;
-      todo_state->step_in_progress = false;
+      QMutexLocker sleeplock(&h2s_mutex);
+      // the next step may already have been queued on this vstate
+      if (job->next_chunk.load() >= job->nchunks)
+        steps_todo.remove(job);
     }
-
-    wait_for_step_completed.wakeAll();
   }
 }
 
@@ -1817,6 +2651,7 @@ void initialize_args(int *int_args) {
 
   int training_sets_seed = int_args[5];
   int rand_seed = int_args[6];
+  SOFTWARE_RENDER = int_args[7] == 1;
 
   if (NUM_LEVELS > 0 && (training_sets_seed != -1)) {
     global_rand_gen.seed(training_sets_seed);
@@ -1833,6 +2668,12 @@ void initialize_args(int *int_args) {
   global_rand_gen.seed(rand_seed);
 }
 
+// where the decoded sprites are cached between processes, "" to always decode
+void initialize_asset_pack(const char *path)
+{
+  asset_pack_path = QString::fromUtf8(path);
+}
+
 void initialize_set_monitor_dir(const char *d, int monitor_csv_policy_)
 {
   monitor_dir = d;
@@ -1847,7 +2688,9 @@ void init(int threads)
       if (resource_path == "") {
         throw std::runtime_error("missing environment variable COINRUN_RESOURCES_PATH");
       }
+      asset_pack_open();
       images_load();
+      asset_pack_close();
     } catch (const std::exception &e) {
       fprintf(stderr, "ERROR: %s\n", e.what());
       return;
@@ -1861,17 +2704,35 @@ void init(int threads)
   }
 }
 
-int vec_create(int game_type, int nenvs, int lump_n, bool want_hires, float default_zoom)
+int vec_create(
+  int game_type,
+  int nenvs,
+  int lump_n,
+  bool want_hires,
+  float default_zoom,
+  int frame_skip,
+  int obs_channels,
+  int obs_slots,
+  uint8_t* obs,
+  uint8_t* obs_hires_rgb,
+  float* rew,
+  bool* done)
 {
   std::shared_ptr<VectorOfStates> vstate(new VectorOfStates);
   vstate->states.resize(nenvs);
   vstate->game_type = game_type;
+  vstate->rew = rew;
+  vstate->done = done;
+  vstate->frame_skip = max(frame_skip, 1);
+  assert(obs_channels == 1 || obs_channels == 3);
+  vstate->obs_channels = obs_channels;
+  vstate->obs_slots = max(obs_slots, 1);
 
   for (int n = 0; n < nenvs; n++) {
     vstate->states[n] = std::shared_ptr<State>(new State(vstate));
     vstate->states[n]->state_n = n;
+    vstate->states[n]->level_rand_gen.seed(global_rand_gen.randint());
     state_reset(vstate->states[n], vstate->game_type);
-    vstate->states[n]->agent_ready = false;
     vstate->states[n]->agent.zoom = default_zoom;
     vstate->states[n]->agent.target_zoom = default_zoom;
     if (
@@ -1880,10 +2741,12 @@ int vec_create(int game_type, int nenvs, int lump_n, bool want_hires, float defa
     {
       vstate->states[n]->agent.monitor_csv_open(n + lump_n * nenvs);
     }
+    vstate->states[n]->agent.render_buf = obs + n*RES_H*RES_W*vstate->obs_slots*obs_channels;
     if (want_hires)
-        vstate->states[n]->agent.render_hires_buf = new uint8_t[VIDEORES*VIDEORES*4];
+        vstate->states[n]->agent.render_hires_buf = obs_hires_rgb + n*VIDEORES*VIDEORES*3;
   }
   vstate->nenvs = nenvs;
+  vstate->nchunks = std::min(nenvs, std::max(1, int(all_threads.size())) * STEP_CHUNKS_PER_THREAD);
   int h;
   {
     QMutexLocker lock(&h2s_mutex);
@@ -1905,10 +2768,20 @@ void vec_close(int handle)
   }
 }
 
-void vec_step_async_discrete(int handle, int32_t *actions)
+// render=false leaves the obs buffers untouched, for callers that only need rewards and dones.
+// The frame goes to obs_slot, and also to obs_mirror_slot unless it is -1
+void vec_step_async(int handle, int32_t *actions, bool render, int obs_slot, int obs_mirror_slot)
 {
   std::shared_ptr<VectorOfStates> vstate = vstate_find(handle);
-  QMutexLocker sleeplock(&h2s_mutex);
+  {
+    QMutexLocker lock(&vstate->step_mutex);
+    assert(vstate->step_done && "call vec_wait before stepping again");
+    vstate->step_done = false;
+  }
+  vstate->render = render;
+  assert(0 <= obs_slot && obs_slot < vstate->obs_slots && obs_mirror_slot < vstate->obs_slots);
+  vstate->obs_slot = obs_slot;
+  vstate->obs_mirror_slot = obs_mirror_slot;
   {
     QMutexLocker lock2(&vstate->states_mutex);
     for (int e = 0; e < vstate->nenvs; e++) {
@@ -1916,53 +2789,120 @@ void vec_step_async_discrete(int handle, int32_t *actions)
       assert((unsigned int)actions[e] < (unsigned int)NUM_ACTIONS);
       state->agent.action_dx = DISCRETE_ACTIONS[2 * actions[e] + 0];
       state->agent.action_dy = DISCRETE_ACTIONS[2 * actions[e] + 1];
-      {
-        QMutexLocker lock3(&state->step_mutex);
-        state->agent_ready = true;
-        workers_todo.push_back(state);
-      }
     }
   }
+  QMutexLocker sleeplock(&h2s_mutex);
+  vstate->chunks_done = 0;
+  vstate->next_chunk = 0;
+  if (std::find(steps_todo.begin(), steps_todo.end(), vstate) == steps_todo.end())
+    steps_todo.push_back(vstate);
   wait_for_actions.wakeAll();
 }
 
-void vec_wait(
-  int handle,
-  uint8_t* obs_rgb,
-  uint8_t* obs_hires_rgb,
-  float* rew,
-  bool* done)
+void vec_step_async_discrete(int handle, int32_t *actions)
+{
+  vec_step_async(handle, actions, true, 0, -1);
+}
+
+// blocks until the last vec_step_async_discrete is done, observations, rewards
+// and dones are then in the buffers registered at vec_create
+void vec_wait(int handle)
 {
   std::shared_ptr<VectorOfStates> vstate = vstate_find(handle);
-  while (1) {
-    QMutexLocker sleeplock(&h2s_mutex);
-    bool all_steps_completed = true;
-    {
-      QMutexLocker lock2(&vstate->states_mutex);
-      for (int e = 0; e < vstate->nenvs; e++) {
-        std::shared_ptr<State> state = vstate->states[e];
-        QMutexLocker lock3(&state->step_mutex);
-        all_steps_completed &= !state->agent_ready;
-      }
-    }
-    if (all_steps_completed)
-      break;
-    wait_for_step_completed.wait(&h2s_mutex, 1000); // milliseconds
+  QMutexLocker lock(&vstate->step_mutex);
+  while (!vstate->step_done)
+    vstate->step_completed.wait(&vstate->step_mutex);
+}
+
+// writes the snapshot size of every env into sizes, returns their sum
+long vec_state_sizes(int handle, int* sizes)
+{
+  std::shared_ptr<VectorOfStates> vstate = vstate_find(handle);
+  vec_wait(handle);
+  QMutexLocker lock1(&vstate->states_mutex);
+  long total = 0;
+  for (int e = 0; e < vstate->nenvs; e++) {
+    std::shared_ptr<State> state_e = vstate->states[e];
+    QMutexLocker lock2(&state_e->state_mutex);
+    sizes[e] = state_snapshot_size(state_e);
+    total += sizes[e];
   }
+  return total;
+}
+
+// writes the snapshots of every env back to back into out, at most capacity bytes,
+// returns the number of envs saved, which is less than nenvs if out is too small
+int vec_get_state(int handle, uint8_t* out, long capacity)
+{
+  std::shared_ptr<VectorOfStates> vstate = vstate_find(handle);
+  vec_wait(handle);
   QMutexLocker lock1(&vstate->states_mutex);
+  size_t offset = 0;
   for (int e = 0; e < vstate->nenvs; e++) {
     std::shared_ptr<State> state_e = vstate->states[e];
     QMutexLocker lock2(&state_e->state_mutex);
-    // don't really need a mutex, because step is completed, but it's cheap to lock anyway
-    Agent& a = state_e->agent;
-    if (a.render_hires_buf)
-      copy_render_buf(e, obs_hires_rgb, a.render_hires_buf, VIDEORES, VIDEORES);
-    copy_render_buf(e, obs_rgb, a.render_buf, RES_W, RES_H);
+    size_t size = state_snapshot_size(state_e);
+    if (offset + size > size_t(capacity))
+      return e;
+    state_save(state_e, out + offset);
+    offset += size;
+  }
+  return vstate->nenvs;
+}
+
+// restores every env from nbytes of snapshots laid out as vec_get_state writes them,
+// returns the number of envs restored
+int vec_set_state(int handle, const uint8_t* in, long nbytes)
+{
+  std::shared_ptr<VectorOfStates> vstate = vstate_find(handle);
+  vec_wait(handle);
+  QMutexLocker lock1(&vstate->states_mutex);
+  size_t offset = 0;
+  for (int e = 0; e < vstate->nenvs; e++) {
+    std::shared_ptr<State> state_e = vstate->states[e];
+    QMutexLocker lock2(&state_e->state_mutex);
+    size_t size = state_load(state_e, in + offset, size_t(nbytes) - offset);
+    if (!size)
+      return e;
+    offset += size;
+  }
+  return vstate->nenvs;
+}
 
-    rew[e] = a.reward;
-    done[e] = a.game_over;
-    a.reward = 0;
-    a.game_over = false;
+void maze_cache_configure(int max_size)
+{
+  QMutexLocker lock(&maze_cache_mutex);
+  MAZE_CACHE_SIZE = max_size;
+  maze_cache.clear();
+  maze_cache_lru.clear();
+  maze_cache_hits = 0;
+  maze_cache_misses = 0;
+}
+
+// hits, misses, size, capacity
+void maze_cache_stats(int64_t* out)
+{
+  QMutexLocker lock(&maze_cache_mutex);
+  out[0] = maze_cache_hits;
+  out[1] = maze_cache_misses;
+  out[2] = maze_cache.size();
+  out[3] = MAZE_CACHE_SIZE;
+}
+
+// re-renders the current frame of every env into obs_rgb without stepping,
+// renderer 0 is the Qt reference and 1 the software renderer
+void vec_render(int handle, int renderer, uint8_t* obs_rgb)
+{
+  std::shared_ptr<VectorOfStates> vstate = vstate_find(handle);
+  QMutexLocker lock1(&vstate->states_mutex);
+  for (int e = 0; e < vstate->nenvs; e++) {
+    std::shared_ptr<State> state_e = vstate->states[e];
+    QMutexLocker lock2(&state_e->state_mutex);
+    uint8_t* buf = obs_rgb + e*RES_H*RES_W*3;
+    if (renderer == 1)
+      software_paint_the_world(buf, RES_W, RES_H, state_e, &state_e->agent);
+    else
+      paint_render_buf(buf, RES_W, RES_H, state_e, &state_e->agent, false, false);
   }
 }
 
@@ -2104,10 +3044,7 @@ public:
   void timeout()
   {
     vec_step_async_discrete(viz->control_handle, actions);
-    uint8_t bufrgb[RES_W * RES_H * 3];
-    float bufrew[1];
-    bool bufdone[1];
-    vec_wait(viz->control_handle, bufrgb, 0, bufrew, bufdone);
+    vec_wait(viz->control_handle);
     // fprintf(stderr, "%+0.2f %+0.2f %+0.2f\n", bufvel[0], bufvel[1], bufvel[2]);
   }
 
@@ -2209,7 +3146,10 @@ extern "C" void test_main_loop()
     app = new QApplication(argc, const_cast<char **>(argv));
   }
 
-  int handle = vec_create(DEFAULT_GAME_TYPE, 1, 0, false, 5.0);
+  static uint8_t bufrgb[RES_W * RES_H * 3];
+  static float bufrew[1];
+  static bool bufdone[1];
+  int handle = vec_create(DEFAULT_GAME_TYPE, 1, 0, false, 5.0, 1, 3, 1, bufrgb, 0, bufrew, bufdone);
 
   window = new TestWindow();
   window->resize(800, 800);
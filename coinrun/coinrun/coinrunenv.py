@@ -1,14 +1,19 @@
 """
 Python interface to the CoinRun shared library using ctypes.
 
-On import, this will attempt to build the shared library.
+On import, this will build the shared library if coinrun.cpp or the Makefile
+changed since the last build. Set COINRUN_DEBUG=1 to build and load the debug
+library instead of the optimized one.
 """
 
 import os
 import atexit
+import hashlib
 import random
 import sys
-from ctypes import c_int, c_char_p, c_float, c_bool
+import time
+IMPORT_TSTART = time.time()
+from ctypes import c_int, c_long, c_char_p, c_float, c_bool
 
 import gym
 import gym.spaces
@@ -26,8 +31,9 @@ mpi_print = utils.mpi_print
 
 # if the environment is crashing, try using the debug build to get
 # a readable stack trace
-DEBUG = True
+DEBUG = os.environ.get('COINRUN_DEBUG', '0') == '1'
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BUILD_SOURCES = ['coinrun.cpp', 'Makefile']
 
 game_versions = {
     'standard':   1000,
@@ -35,29 +41,51 @@ game_versions = {
     'maze': 1002,
 }
 
+if DEBUG:
+    lib_path = '.build-debug/coinrun_cpp_d'
+else:
+    lib_path = '.build-release/coinrun_cpp'
+
+def source_hash():
+    h = hashlib.sha256()
+    for fname in BUILD_SOURCES:
+        with open(os.path.join(SCRIPT_DIR, fname), 'rb') as f:
+            h.update(f.read())
+
+    return h.hexdigest()
+
 def build():
+    """
+    Runs make on the first local rank, unless the library was already built from the current sources.
+    """
     lrank, _lsize = mpi_util.get_local_rank_size(MPI.COMM_WORLD)
+    built = False
     if lrank == 0:
-        dirname = os.path.dirname(__file__)
-        if len(dirname):
-            make_cmd = "QT_SELECT=5 make -C %s" % dirname
-        else:
-            make_cmd = "QT_SELECT=5 make"
-
-        r = os.system(make_cmd)
-        if r != 0:
-            logger.error('coinrun: make failed')
-            sys.exit(1)
+        stamp_path = os.path.join(SCRIPT_DIR, lib_path + '.hash')
+        current = source_hash()
+        try:
+            with open(stamp_path) as f:
+                up_to_date = f.read().strip() == current
+        except OSError:
+            up_to_date = False
+
+        if not up_to_date:
+            make_cmd = "QT_SELECT=5 make -C %s %s" % (SCRIPT_DIR, 'debug' if DEBUG else 'release')
+            r = os.system(make_cmd)
+            if r != 0:
+                logger.error('coinrun: make failed')
+                sys.exit(1)
+            with open(stamp_path, 'w') as f:
+                f.write(current)
+            built = True
     MPI.COMM_WORLD.barrier()
 
-build()
+    return built
 
-if DEBUG:
-    lib_path = '.build-debug/coinrun_cpp_d'
-else:
-    lib_path = '.build-release/coinrun_cpp'
+built = build()
 
 lib = npct.load_library(lib_path, os.path.dirname(__file__))
+mpi_print('coinrun: imported %s library in %.2fs%s' % ('debug' if DEBUG else 'release', time.time() - IMPORT_TSTART, ', rebuilt' if built else ''))
 lib.init.argtypes = [c_int]
 lib.get_NUM_ACTIONS.restype = c_int
 lib.get_RES_W.restype = c_int
@@ -70,23 +98,38 @@ lib.vec_create.argtypes = [
     c_int,    # lump_n
     c_bool,   # want_hires_render
     c_float,  # default_zoom
+    c_int,    # frame_skip
+    c_int,    # obs_channels
+    c_int,    # obs_slots
+    npct.ndpointer(dtype=np.uint8, ndim=4, flags='C_CONTIGUOUS'),    # observations
+    npct.ndpointer(dtype=np.uint8, ndim=4, flags='C_CONTIGUOUS'),    # larger rgb for render()
+    npct.ndpointer(dtype=np.float32, ndim=1, flags='C_CONTIGUOUS'),  # rew
+    npct.ndpointer(dtype=np.bool, ndim=1, flags='C_CONTIGUOUS'),     # done
     ]
 lib.vec_create.restype = c_int
 
 lib.vec_close.argtypes = [c_int]
 
 lib.vec_step_async_discrete.argtypes = [c_int, npct.ndpointer(dtype=np.int32, ndim=1)]
+lib.vec_step_async.argtypes = [c_int, npct.ndpointer(dtype=np.int32, ndim=1), c_bool, c_int, c_int]
 
 lib.initialize_args.argtypes = [npct.ndpointer(dtype=np.int32, ndim=1)]
 lib.initialize_set_monitor_dir.argtypes = [c_char_p, c_int]
+lib.initialize_asset_pack.argtypes = [c_char_p]
 
-lib.vec_wait.argtypes = [
-    c_int,
-    npct.ndpointer(dtype=np.uint8, ndim=4),    # normal rgb
-    npct.ndpointer(dtype=np.uint8, ndim=4),    # larger rgb for render()
-    npct.ndpointer(dtype=np.float32, ndim=1),  # rew
-    npct.ndpointer(dtype=np.bool, ndim=1),     # done
-    ]
+lib.vec_wait.argtypes = [c_int]
+
+lib.maze_cache_configure.argtypes = [c_int]
+lib.maze_cache_stats.argtypes = [npct.ndpointer(dtype=np.int64, ndim=1)]
+
+lib.vec_render.argtypes = [c_int, c_int, npct.ndpointer(dtype=np.uint8, ndim=4, flags='C_CONTIGUOUS')]
+
+lib.vec_state_sizes.argtypes = [c_int, npct.ndpointer(dtype=np.int32, ndim=1, flags='C_CONTIGUOUS')]
+lib.vec_state_sizes.restype = c_long
+lib.vec_get_state.argtypes = [c_int, npct.ndpointer(dtype=np.uint8, ndim=1, flags='C_CONTIGUOUS'), c_long]
+lib.vec_get_state.restype = c_int
+lib.vec_set_state.argtypes = [c_int, npct.ndpointer(dtype=np.uint8, ndim=1, flags='C_CONTIGUOUS'), c_long]
+lib.vec_set_state.restype = c_int
 
 already_inited = False
 
@@ -96,7 +139,8 @@ def init_args_and_threads(cpu_count=4,
     """
     Perform one-time global init for the CoinRun library.  This must be called
     before creating an instance of CoinRunVecEnv.  You should not
-    call this multiple times from the same process.
+    call this multiple times from the same process.  `make` calls it with the
+    placement's env threads if it hasn't been called yet.
     """
     os.environ['COINRUN_RESOURCES_PATH'] = os.path.join(SCRIPT_DIR, 'assets')
     is_high_difficulty = Config.HIGH_DIFFICULTY
@@ -109,19 +153,45 @@ def init_args_and_threads(cpu_count=4,
         rand_seed = rand_seed - rand_seed % mpi_size + mpi_rank
     print('set env config coinrun')
     mpi_print('testing MPI print')
-    int_args = np.array([int(is_high_difficulty), Config.NUM_LEVELS, int(Config.PAINT_VEL_INFO), Config.USE_DATA_AUGMENTATION, game_versions[Config.GAME_TYPE], Config.SET_SEED, rand_seed]).astype(np.int32)
+    int_args = np.array([int(is_high_difficulty), Config.NUM_LEVELS, int(Config.PAINT_VEL_INFO), Config.USE_DATA_AUGMENTATION, game_versions[Config.GAME_TYPE], Config.SET_SEED, rand_seed, int(Config.SOFTWARE_RENDER)]).astype(np.int32)
 
     lib.initialize_args(int_args)
+    lib.maze_cache_configure(Config.MAZE_CACHE_SIZE)
     lib.initialize_set_monitor_dir(logger.get_dir().encode('utf-8'), {'off': 0, 'first_env': 1, 'all': 2}[monitor_csv_policy])
     mpi_print('init args coinrun')
     global already_inited
     if already_inited:
         return
+    # decoded sprites are shared through a memory-mapped pack, the first rank on
+    # each machine builds it if needed and the others map what it wrote
+    asset_pack = os.environ.get('COINRUN_ASSET_PACK', os.path.join(SCRIPT_DIR, '.build-release', 'assets.pack'))
+    if asset_pack:
+        os.makedirs(os.path.dirname(asset_pack), exist_ok=True)
+    lib.initialize_asset_pack(asset_pack.encode('utf-8'))
+    lrank, _lsize = mpi_util.get_local_rank_size(MPI.COMM_WORLD)
+
     mpi_print('setting MPI cpus')
+    tstart = time.time()
+    if lrank != 0:
+        MPI.COMM_WORLD.barrier()
     lib.init(cpu_count)
+    if lrank == 0:
+        MPI.COMM_WORLD.barrier()
+    mpi_print('loaded assets in %.2fs' % (time.time() - tstart))
     mpi_print('set MPI cpus')
     already_inited = True
 
+def maze_cache_stats():
+    """
+    Counters of the process-wide level cache used when NUM_LEVELS is finite.
+    """
+    stats = np.zeros(4, dtype=np.int64)
+    lib.maze_cache_stats(stats)
+    hits, misses, size, capacity = [int(v) for v in stats]
+
+    return {'hits': hits, 'misses': misses, 'size': size, 'capacity': capacity,
+            'hit_rate': hits / max(hits + misses, 1)}
+
 @atexit.register
 def shutdown():
     global already_inited
@@ -138,8 +208,19 @@ class CoinRunVecEnv(VecEnv):
     `num_envs`: number of environments to create in this VecEnv
     `lump_n`: only used when the environment creates `monitor.csv` files
     `default_zoom`: controls how much of the level the agent can see
+    `frame_skip`: physics steps per env step, rewards are summed and only the last frame is rendered
+    `frame_stack`: number of most recent frames stacked along the channel axis, oldest first
+
+    The stepping threads write observations, rewards and dones straight into
+    buffers registered at creation, so `step_wait` returns views that the next
+    step overwrites. Copy them if they need to outlive the step.
+
+    Observations are grayscale when `Config.USE_BLACK_WHITE` is set, converted
+    by the stepping threads. Stacked frames live in a ring of 2 * `frame_stack`
+    slots where every frame is written twice, k slots apart, so the last
+    `frame_stack` frames are always a contiguous view of the buffer.
     """
-    def __init__(self, game_type, num_envs, lump_n=0, default_zoom=5.0):
+    def __init__(self, game_type, num_envs, lump_n=0, default_zoom=5.0, frame_skip=1, frame_stack=1):
         self.metadata = {'render.modes': []}
         self.reward_range = (-float('inf'), float('inf'))
 
@@ -150,15 +231,19 @@ class CoinRunVecEnv(VecEnv):
 
         self.buf_rew = np.zeros([num_envs], dtype=np.float32)
         self.buf_done = np.zeros([num_envs], dtype=np.bool)
-        self.buf_rgb   = np.zeros([num_envs, self.RES_H, self.RES_W, 3], dtype=np.uint8)
+        self.num_channels = 1 if Config.USE_BLACK_WHITE else 3
+        self.frame_stack = frame_stack
+        self.obs_slots = 2 * frame_stack if frame_stack > 1 else 1
+        self.obs_slot = 0 # written by the next rendered step
+        self.rendering = False # a frame is waiting in obs_slot
+        self.buf_obs = np.zeros([num_envs, self.RES_H, self.RES_W, self.obs_slots * self.num_channels], dtype=np.uint8)
         self.hires_render = Config.IS_HIGH_RES
         if self.hires_render:
             self.buf_render_rgb = np.zeros([num_envs, self.VIDEORES, self.VIDEORES, 3], dtype=np.uint8)
         else:
             self.buf_render_rgb = np.zeros([1, 1, 1, 1], dtype=np.uint8)
 
-        num_channels = 1 if Config.USE_BLACK_WHITE else 3
-        obs_space = gym.spaces.Box(0, 255, shape=[self.RES_H, self.RES_W, num_channels], dtype=np.uint8)
+        obs_space = gym.spaces.Box(0, 255, shape=[self.RES_H, self.RES_W, frame_stack * self.num_channels], dtype=np.uint8)
 
         super().__init__(
             num_envs=num_envs,
@@ -170,7 +255,14 @@ class CoinRunVecEnv(VecEnv):
             self.num_envs,
             lump_n,
             self.hires_render,
-            default_zoom)
+            default_zoom,
+            frame_skip,
+            self.num_channels,
+            self.obs_slots,
+            self.buf_obs,
+            self.buf_render_rgb,
+            self.buf_rew,
+            self.buf_done)
         self.dummy_info = [{} for _ in range(num_envs)]
 
     def __del__(self):
@@ -190,32 +282,82 @@ class CoinRunVecEnv(VecEnv):
     def get_images(self):
         if self.hires_render:
             return self.buf_render_rgb
+        elif self.obs_slots == 1 and self.num_channels == 3:
+            return self.buf_obs
         else:
-            return self.buf_rgb
+            return self.render_obs('software' if Config.SOFTWARE_RENDER else 'qt')
+
+    def render_obs(self, renderer='software'):
+        """
+        Re-render the current observation of every env without stepping, with either 'qt' or 'software'.
+        """
+        obs = np.zeros([self.num_envs, self.RES_H, self.RES_W, 3], dtype=np.uint8)
+        lib.vec_render(self.handle, {'qt': 0, 'software': 1}[renderer], obs)
+
+        return obs
+
+    def get_state(self):
+        """
+        Per-env snapshots as bytes, like procgen's `get_state`. Each holds its env's
+        maze, agent, monsters and level RNG, sized to the level.
+        """
+        sizes = np.zeros(self.num_envs, dtype=np.int32)
+        buf = np.zeros(lib.vec_state_sizes(self.handle, sizes), dtype=np.uint8)
+        saved = lib.vec_get_state(self.handle, buf, len(buf))
+        assert saved == self.num_envs, 'no room for the snapshot of env %d' % saved
 
-    def step_async(self, actions):
+        return [chunk.tobytes() for chunk in np.split(buf, np.cumsum(sizes)[:-1])]
+
+    def set_state(self, states):
+        buf = np.frombuffer(b''.join(states), dtype=np.uint8)
+        restored = lib.vec_set_state(self.handle, buf, len(buf))
+        assert restored == self.num_envs, 'bad snapshot for env %d' % restored
+
+    def callmethod(self, method, *args, **kwargs):
+        return getattr(self, method)(*args, **kwargs)
+
+    def step_async(self, actions, render=True):
         assert actions.dtype in [np.int32, np.int64]
         actions = actions.astype(np.int32)
-        lib.vec_step_async_discrete(self.handle, actions)
+        self.rendering = render
+        mirror_slot = self.obs_slot + self.frame_stack if self.obs_slots > 1 else -1
+        lib.vec_step_async(self.handle, actions, render, self.obs_slot, mirror_slot)
 
-    def step_wait(self):
-        self.buf_rew = np.zeros_like(self.buf_rew)
-        self.buf_done = np.zeros_like(self.buf_done)
+    def step(self, actions, render=True):
+        """
+        With `render=False` only rewards and dones are updated, the returned observations are stale.
+        """
+        self.step_async(actions, render=render)
+        return self.step_wait()
 
-        lib.vec_wait(
-            self.handle,
-            self.buf_rgb,
-            self.buf_render_rgb,
-            self.buf_rew,
-            self.buf_done)
-
-        obs_frames = self.buf_rgb
+    def step_wait(self):
+        lib.vec_wait(self.handle)
+
+        if self.obs_slots == 1:
+            return self.buf_obs, self.buf_rew, self.buf_done, self.dummy_info
+
+        c = self.num_channels
+        newest = self.obs_slot
+        if self.rendering:
+            self.rendering = False
+            self.obs_slot = (newest + 1) % self.frame_stack
+            done = np.flatnonzero(self.buf_done)
+            if len(done):
+                # a new episode starts from an empty stack, like VecFrameStack
+                frame = self.buf_obs[done, :, :, newest * c:(newest + 1) * c]
+                self.buf_obs[done] = 0
+                for slot in [newest, newest + self.frame_stack]:
+                    self.buf_obs[done, :, :, slot * c:(slot + 1) * c] = frame
+        else:
+            newest = (newest - 1) % self.frame_stack
 
-        if Config.USE_BLACK_WHITE:
-            obs_frames = np.mean(obs_frames, axis=-1).astype(np.uint8)[...,None]
+        obs_frames = self.buf_obs[..., (newest + 1) * c:(newest + 1 + self.frame_stack) * c]
 
         return obs_frames, self.buf_rew, self.buf_done, self.dummy_info
 
 def make(env_id, num_envs, **kwargs):
     assert env_id in game_versions, 'cannot find environment "%s", maybe you mean one of %s' % (env_id, list(game_versions.keys()))
+    if not already_inited:
+        from coinrun.placement import get_placement
+        init_args_and_threads(get_placement().env_threads)
     return CoinRunVecEnv(env_id, num_envs, **kwargs)
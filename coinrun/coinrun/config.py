@@ -172,6 +172,9 @@ class ConfigSingle(object):
         # NOTE: This value must and will be saved, in order to use the same training set for evaluation and/or visualization.
         type_keys.append(('set-seed', 'set_seed', int, -1, True))
 
+        # The number of generated CoinRun levels kept for reuse when NUM_LEVELS is finite (0 disables)
+        type_keys.append(('maze-cache', 'maze_cache_size', int, 1024))
+
         # PPO Hyperparameters
         type_keys.append(('ns', 'num_steps', int, 256))
         type_keys.append(('nmb', 'num_minibatches', int, 8))
@@ -223,6 +226,9 @@ class ConfigSingle(object):
         # No frame stack is necessary if PAINT_VEL_INFO = 1
         type_keys.append(('fs', 'frame_stack', int, 1, True))
 
+        # The number of CoinRun physics steps per env step, rewards are summed over them
+        type_keys.append(('fskip', 'frame_skip', int, 1, True))
+
         # Should observations be transformed to grayscale
         # 1/0 means True/False
         type_keys.append(('ubw', 'use_black_white', int, 0, True))
@@ -233,6 +239,26 @@ class ConfigSingle(object):
         # The number of evaluation environments to use
         type_keys.append(('num-eval', 'num_eval', int, 20, False))
 
+        # Frozen policy graph written by coinrun.export_policy
+        # enjoy.py runs it instead of rebuilding the policy from a checkpoint
+        type_keys.append(('frozen', 'frozen_policy', str, None))
+
+        # Collect ppo rollouts with an int8 copy of the act model, re-quantized from the fp32 weights every this many updates
+        # 0 disables quantization
+        type_keys.append(('quant', 'quantize_act', int, 0))
+
+        # The number of rollout frames used to calibrate int8 activation ranges
+        type_keys.append(('quant-frames', 'quant_calib_frames', int, 256))
+
+        # Directory of model MetaGraphs keyed by the config, imported instead of rebuilding the graph (ppo only)
+        type_keys.append(('gcache', 'graph_cache_dir', str, None))
+
+        # Pin each MPI rank to its own block of cores on the host (see coinrun.placement), 0 leaves affinity to the OS
+        type_keys.append(('pin', 'pin_cpus', int, 1))
+
+        # GB of rollout and train buffers per rank (see coinrun.sizing), launches over it are refused. Defaults to 80% of host memory shared by the host's ranks, 0 disables the check
+        type_keys.append(('mem', 'mem_budget', float, None))
+
         # The number of episodes to evaluate with each evaluation environment
         type_keys.append(('rep', 'rep', int, 1))
 
@@ -252,6 +278,15 @@ class ConfigSingle(object):
         # Use high resolution images for rendering
         bool_keys.append(('hres', 'is_high_res'))
 
+        # Replace procgen with the deterministic NumPy stand-in env from coinrun.bench
+        bool_keys.append(('bench-env', 'bench_env'))
+
+        # Render 64x64 CoinRun observations with the sprite-blitting software renderer instead of Qt
+        bool_keys.append(('software-render', 'software_render', True))
+
+        # Print the time spent importing, building envs and the agent until the first env step
+        bool_keys.append(('profile-startup', 'profile_startup'))
+
         self.RES_KEYS = []
 
         for tk in type_keys:
@@ -270,6 +305,9 @@ class ConfigSingle(object):
         self.bool_keys = bool_keys
         self.type_keys = type_keys
 
+        # str args holding file paths, kept as given instead of having '-' replaced by '_'
+        self.path_keys = ['frozen_policy', 'graph_cache_dir']
+
         self.load_data = {}
         self.args_dict = {}
 
@@ -311,7 +349,7 @@ class ConfigSingle(object):
         for ak in self.args_dict:
             val = self.args_dict[ak]
 
-            if isinstance(val, str):
+            if isinstance(val, str) and ak not in self.path_keys:
                 val = self.process_field(val)
 
             setattr(self, ak.upper(), val)
@@ -41,13 +41,17 @@ def enjoy_env_sess(sess):
 
     nenvs = env.num_envs
 
-    agent = create_act_model(sess, env, nenvs)
+    if Config.FROZEN_POLICY is not None:
+        from coinrun.export_policy import load_frozen_policy
+        agent = load_frozen_policy(Config.FROZEN_POLICY)
+    else:
+        agent = create_act_model(sess, env, nenvs)
 
-    sess.run(tf.compat.v1.global_variables_initializer())
-    loaded_params = utils.load_params_for_scope(sess, 'model')
+        sess.run(tf.compat.v1.global_variables_initializer())
+        loaded_params = utils.load_params_for_scope(sess, 'model')
 
-    if not loaded_params:
-        print('NO SAVED PARAMS LOADED')
+        if not loaded_params:
+            print('NO SAVED PARAMS LOADED')
 
     obs = env.reset()
     t_step = 0
@@ -0,0 +1,140 @@
+"""
+Export a policy saved by train_agent.py as a frozen, inference-only graph
+(observation -> action logits, value, sampled action), and load it back.
+
+To run:
+python -m coinrun.export_policy -resid myrun -frozen myrun.pb
+
+Then evaluate or render with it:
+python -m coinrun.enjoy -resid myrun -frozen myrun.pb --test-eval
+"""
+
+import json
+import time
+
+import numpy as np
+import tensorflow as tf
+from gym.spaces import Box, Discrete
+from tensorflow.python.tools import optimize_for_inference_lib
+
+from coinrun import setup_utils
+import coinrun.main_utils as utils
+from coinrun.config import Config
+
+mpi_print = utils.mpi_print
+
+OUTPUT_NAMES = ['logits', 'value', 'action']
+
+# agents whose act path only depends on the observation
+EXPORTABLE_AGENTS = ['ppo', 'ppo_rnd', 'ppo_curl', 'ppg', 'ppg_ssl']
+
+def build_act_model(sess, ob_space=None):
+    from coinrun import policies
+
+    if Config.AGENT not in EXPORTABLE_AGENTS:
+        raise NotImplementedError('export needs an observation-only act path, agent %s is not supported' % Config.AGENT)
+
+    if ob_space is None:
+        ob_space = Box(0, 255, shape=(64, 64, 3), dtype=np.uint8)
+    ac_space = Discrete(15)
+
+    policy = policies.get_policy()
+
+    return policy(sess, ob_space, ac_space, 1, 1, None)
+
+def add_act_outputs(act):
+    """
+    Named logits/value/action ops on top of an act model. Safe to call after variables are initialized.
+    """
+    if not hasattr(act, 'export_outputs'):
+        with tf.compat.v1.name_scope(None):
+            logits = tf.identity(act.pd_run[0].logits, name='logits')
+            value = tf.identity(act.vf_run[0], name='value')
+            action = tf.identity(act.pd_run[0].sample(), name='action')
+        act.export_outputs = [logits, value, action]
+
+    return act.export_outputs
+
+def freeze_act_model(sess, act, output_names=OUTPUT_NAMES):
+    """
+    GraphDef of the act model with variables folded into constants and training-only nodes stripped.
+    """
+    outputs = dict(zip(OUTPUT_NAMES, [t.op.name for t in add_act_outputs(act)]))
+    output_names = [outputs[name] for name in output_names]
+    input_name = act.X.op.name
+
+    graph_def = tf.compat.v1.graph_util.convert_variables_to_constants(sess, sess.graph.as_graph_def(), output_names)
+    graph_def = optimize_for_inference_lib.optimize_for_inference(graph_def, [input_name], output_names, act.X.dtype.as_datatype_enum)
+
+    return graph_def, input_name, output_names
+
+def export_frozen_policy(sess, path):
+    act = build_act_model(sess)
+    add_act_outputs(act)
+
+    sess.run(tf.compat.v1.global_variables_initializer())
+    load_data = Config.get_load_data()
+    assert load_data is not None, 'nothing to export, pass -resid'
+
+    for scope in load_data['params']:
+        utils.load_params_for_scope(sess, scope)
+
+    graph_def, input_name, output_names = freeze_act_model(sess, act)
+
+    with open(path, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+
+    meta = {'input': input_name, 'outputs': output_names, 'args': Config.get_args_dict()}
+    with open(path + '.json', 'w') as f:
+        json.dump(meta, f, indent=2, sort_keys=True, default=str)
+
+    mpi_print('exported', len(graph_def.node), 'nodes to', path)
+
+class FrozenPolicy(object):
+    """
+    Runs an exported graph in its own session. `step` mirrors the act model's return signature.
+    """
+    def __init__(self, path, config=None):
+        with open(path + '.json') as f:
+            self.meta = json.load(f)
+
+        graph_def = tf.compat.v1.GraphDef()
+        with open(path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+
+        self.X = self.graph.get_tensor_by_name(self.meta['input'] + ':0')
+        self.logits, self.vf, self.action = [self.graph.get_tensor_by_name(name + ':0') for name in self.meta['outputs']]
+        self.sess = tf.compat.v1.Session(graph=self.graph, config=config)
+        self.initial_state = None
+
+    def step(self, ob, *_args, **_kwargs):
+        a, v = self.sess.run([self.action, self.vf], {self.X: ob})
+        return a, v, self.initial_state, None
+
+    def value(self, ob, *_args, **_kwargs):
+        # one entry per head, like the act model
+        return [self.sess.run(self.vf, {self.X: ob})]
+
+    def action_logits(self, ob):
+        return self.sess.run(self.logits, {self.X: ob})
+
+def load_frozen_policy(path, config=None):
+    tstart = time.time()
+    policy = FrozenPolicy(path, config=config)
+    mpi_print('loaded frozen policy', path, 'in %.2fs' % (time.time() - tstart))
+
+    return policy
+
+def main():
+    setup_utils.setup_and_load()
+    assert Config.FROZEN_POLICY is not None, 'pass the output path with -frozen'
+
+    with tf.compat.v1.Session() as sess:
+        export_frozen_policy(sess, Config.FROZEN_POLICY)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+MetaGraph cache for the model graph, so relaunches with the same configuration
+import the graph instead of rebuilding it in Python.
+
+The cache key hashes every Config field that can change the graph, the model
+shapes, the TensorFlow version and the source of the modules that build the
+graph. Each entry is <key>.meta plus <key>.json, which lists the tensors the
+learner needs back.
+
+To run:
+python -m coinrun.train_agent --run-id myrun -gcache graph_cache
+"""
+
+import os
+import json
+import hashlib
+
+import tensorflow as tf
+from mpi4py import MPI
+
+from coinrun.config import Config
+
+# run bookkeeping, env, logging and eval options, and values fed through placeholders
+UNKEYED_FIELDS = [
+    'run_id', 'restore_id', 'restore_idd', 'restore_step', 'set_seed', 'num_gpus',
+    'long_training', 'short_training', 'very_short_training', 'first_phase', 'second_phase',
+    'num_levels', 'maze_cache_size', 'paint_vel_info', 'high_difficulty', 'is_high_res', 'bench_env', 'software_render',
+    'learning_rate', 'gamma', 's_clip', 'r_clip', 'ppo_epochs', 'save_interval', 'save_images',
+    'disable_wandb', 'num_eval', 'test', 'train_eval', 'test_eval', 'test_ratio', 'rep',
+    'frozen_policy', 'quant_calib_frames', 'profile_startup', 'graph_cache_dir', 'pin_cpus', 'mem_budget',
+]
+
+COLLECTION_PREFIX = 'graph_cache/'
+
+def graph_key(source_files, **shapes):
+    fields = {k: getattr(Config, k.upper()) for k in Config.args_dict if k not in UNKEYED_FIELDS}
+
+    h = hashlib.sha1()
+    h.update(json.dumps({'fields': fields, 'shapes': shapes, 'tf': tf.__version__}, sort_keys=True, default=str).encode())
+    for path in source_files:
+        with open(path, 'rb') as f:
+            h.update(f.read())
+
+    return h.hexdigest()[:16]
+
+def graph_path(source_files, **shapes):
+    return os.path.join(Config.GRAPH_CACHE_DIR, graph_key(source_files, **shapes) + '.meta')
+
+def layout_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+def export_graph(path, tensors):
+    """
+    Writes the default graph to `path` on rank 0. `tensors` maps names to a tensor or a list of tensors, None entries are skipped.
+    """
+    if MPI.COMM_WORLD.Get_rank() != 0:
+        return
+
+    graph = tf.compat.v1.get_default_graph()
+    layout = {}
+
+    for name, value in tensors.items():
+        if value is None:
+            continue
+
+        is_list = isinstance(value, (list, tuple))
+        graph.clear_collection(COLLECTION_PREFIX + name)
+        for t in (value if is_list else [value]):
+            graph.add_to_collection(COLLECTION_PREFIX + name, t)
+        layout[name] = is_list
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump({'tensors': layout, 'args': Config.get_args_dict()}, f, indent=2, sort_keys=True, default=str)
+    os.replace(tmp, layout_path(path))
+
+    # the .meta file appears last, so a cache hit always has its layout
+    tf.compat.v1.train.export_meta_graph(filename=tmp, graph=graph, clear_devices=True)
+    os.replace(tmp, path)
+
+def reseed(graph_def, graph_seed):
+    """
+    Random ops keep the seeds they were exported with. Re-derive them from the current graph seed,
+    so runs with different seeds don't share initial weights and action samples.
+    """
+    for node in graph_def.node:
+        if 'seed2' not in node.attr:
+            continue
+
+        if graph_seed is None:
+            node.attr['seed'].i = 0
+            node.attr['seed2'].i = 0
+        else:
+            node.attr['seed'].i = graph_seed
+            node.attr['seed2'].i = int(hashlib.sha1(node.name.encode()).hexdigest()[:7], 16)
+
+def import_graph(path):
+    """
+    Imports a graph written by `export_graph` into the default graph and returns its named tensors.
+    """
+    with open(layout_path(path)) as f:
+        layout = json.load(f)['tensors']
+
+    meta_graph_def = tf.compat.v1.MetaGraphDef()
+    with open(path, 'rb') as f:
+        meta_graph_def.ParseFromString(f.read())
+
+    graph = tf.compat.v1.get_default_graph()
+    reseed(meta_graph_def.graph_def, graph.seed)
+    tf.compat.v1.train.import_meta_graph(meta_graph_def)
+
+    tensors = {}
+    for name, is_list in layout.items():
+        values = graph.get_collection(COLLECTION_PREFIX + name)
+        tensors[name] = values if is_list else values[0]
+
+    return tensors
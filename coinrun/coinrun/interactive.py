@@ -2,12 +2,14 @@
 Run a CoinRun environment in a window where you can interact with it using the keyboard
 """
 
-from coinrun.coinrunenv import lib
+from coinrun.coinrunenv import lib, init_args_and_threads
 from coinrun import setup_utils
+from coinrun.placement import get_placement
 
 
 def main():
     setup_utils.setup_and_load(paint_vel_info=0)
+    init_args_and_threads(get_placement().env_threads)
     print("""Control with arrow keys,
 F1, F2 -- switch resolution,
 F5, F6, F7, F8 -- zoom,
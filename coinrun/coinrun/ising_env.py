@@ -1,7 +1,150 @@
+import os
+import threading
 import numpy as np
 from numpy.random import rand
 import matplotlib.pyplot as plt
 import gym
+from gym3 import Env, types
+
+# spin flip costs 2*s*nb for the 5 possible neighbour sums, lowest first
+FLIP_COSTS = np.arange(-8, 9, 4)
+
+def acceptance_table(beta):
+    ''' Metropolis acceptance probability of each cost in FLIP_COSTS, shape beta.shape + (5,) '''
+    return np.minimum(1., np.exp(-np.multiply.outer(beta, FLIP_COSTS)))
+
+_checkerboards = {}
+
+def checkerboard(N):
+    ''' The two sublattices of an N x N periodic lattice as boolean masks '''
+    if N not in _checkerboards:
+        assert N % 2 == 0, 'periodic checkerboard updates need an even lattice'
+        parity = np.add.outer(np.arange(N), np.arange(N)) % 2
+        _checkerboards[N] = (parity == 0, parity == 1)
+    return _checkerboards[N]
+
+def neighbour_sum(config):
+    return (np.roll(config, 1, -1) + np.roll(config, -1, -1) +
+            np.roll(config, 1, -2) + np.roll(config, -1, -2))
+
+def checkerboard_sweep(config, beta, rng=np.random):
+    ''' One Metropolis sweep over every lattice in config (..., N, N), in place.
+    Sites of one colour only neighbour the other colour, so each half of the
+    lattice is updated at once. beta broadcasts against the leading axes.'''
+    lead = config.shape[:-2]
+    table = acceptance_table(np.broadcast_to(beta, lead)).reshape(-1, len(FLIP_COSTS))
+    for mask in checkerboard(config.shape[-1]):
+        cost = 2 * config * neighbour_sum(config)
+        p = np.take_along_axis(table, ((cost + 8) // 4).reshape(table.shape[0], -1), axis=1)
+        flip = mask & (rng.random_sample(config.shape) < p.reshape(config.shape))
+        np.negative(config, out=config, where=flip)
+    return config
+
+def random_spins(shape, rng=np.random):
+    return (2 * rng.randint(2, size=shape) - 1).astype(np.int8)
+
+def generate_goals(n, N, beta_min, beta_max, max_t, rng=np.random):
+    ''' n goal configurations, each a random lattice swept a random number of
+    times below max_t at a random beta. Returns betas, sweeps and (n, N, N) int8 configs.'''
+    betas = rng.uniform(beta_min, beta_max, n)
+    sweeps = rng.randint(0, max_t, n)
+    goals = random_spins((n, N, N), rng)
+    for t in range(sweeps.max(initial=0)):
+        # goals that are still running are gathered, swept and put back
+        running = sweeps > t
+        goals[running] = checkerboard_sweep(goals[running], betas[running], rng)
+    return betas, sweeps, goals
+
+class GoalBank():
+    ''' A pool of pre-generated goals, so resets sample one instead of simulating it.
+
+    A background thread fills the pool in chunks, and with refresh=True keeps
+    regenerating one chunk in place every refresh_interval seconds afterwards.
+    With a path the pool lives in memory-mapped .npy files that later runs
+    reuse, which makes them start full.
+    sample only waits until the first chunk exists.'''
+
+    def __init__(self, size=4096, N=64, beta_min=0.01, beta_max=0.3, max_t=32,
+                 path=None, refresh=False, refresh_interval=1.0, chunk=64, seed=None):
+        self.size = size
+        self.N = N
+        self.beta_min = beta_min
+        self.beta_max = beta_max
+        self.max_t = max_t
+        self.refresh = refresh
+        self.refresh_interval = refresh_interval
+        self.chunk = chunk
+        self.rng = np.random.RandomState(seed)
+
+        self.filled = 0
+        self.lock = threading.Condition()
+        self.stopped = threading.Event()
+
+        config_shape = (size, N, N)
+        if path is not None and os.path.exists(path + '.configs.npy'):
+            mode = 'r+' if refresh else 'r'
+            self.configs = np.load(path + '.configs.npy', mmap_mode=mode)
+            self.params = np.load(path + '.params.npy', mmap_mode=mode)
+            assert self.configs.shape == config_shape, 'goal bank %s has shape %s' % (path, self.configs.shape)
+            self.filled = size
+        elif path is not None:
+            # written under temporary names and renamed once full, so a killed run leaves no half-filled bank
+            self.configs = np.lib.format.open_memmap(path + '.configs.npy.partial', mode='w+', dtype=np.int8, shape=config_shape)
+            self.params = np.lib.format.open_memmap(path + '.params.npy.partial', mode='w+', dtype=np.float64, shape=(size, 2))
+        else:
+            self.configs = np.zeros(config_shape, dtype=np.int8)
+            self.params = np.zeros((size, 2)) # beta, sweeps
+
+        self.path = path
+        self.thread = None
+        if self.filled < size or refresh:
+            self.thread = threading.Thread(target=self._fill, daemon=True)
+            self.thread.start()
+
+    def _fill(self):
+        start = self.filled
+        while not self.stopped.is_set():
+            if start >= self.size:
+                self._persist()
+                if not self.refresh:
+                    break
+                start = 0
+            if self.filled >= self.size and self.stopped.wait(self.refresh_interval):
+                break
+            n = min(self.chunk, self.size - start)
+            betas, sweeps, goals = generate_goals(n, self.N, self.beta_min, self.beta_max, self.max_t, self.rng)
+            with self.lock:
+                self.configs[start:start + n] = goals
+                self.params[start:start + n, 0] = betas
+                self.params[start:start + n, 1] = sweeps
+                self.filled = max(self.filled, start + n)
+                self.lock.notify_all()
+            start += n
+        self._persist()
+
+    def _persist(self):
+        if self.path is None or not self.configs.flags.writeable:
+            return
+        self.configs.flush()
+        self.params.flush()
+        if self.filled < self.size:
+            return
+        for name in ['.configs.npy', '.params.npy']:
+            if os.path.exists(self.path + name + '.partial'):
+                os.replace(self.path + name + '.partial', self.path + name)
+
+    def sample(self, n):
+        ''' betas (n,) and int8 configs (n, N, N) of n goals drawn uniformly from the pool '''
+        with self.lock:
+            while self.filled == 0:
+                self.lock.wait()
+            idx = np.random.randint(0, self.filled, n)
+            return self.params[idx, 0], self.configs[idx]
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
 
 class Ising():
     ''' Simulating the Ising model
@@ -11,9 +154,12 @@ class Ising():
     '''
 
         
-    def __init__(self,beta=1/4,N=64):
+    def __init__(self,beta=1/4,N=64,method='checkerboard'):
+        ''' method is 'checkerboard' for vectorized sweeps or 'random' for random site updates '''
+        assert method in ['checkerboard', 'random']
         self.beta = beta
         self.N = N
+        self.method = method
 
     def reset(self):
         config = 2*np.random.randint(2, size=(self.N,self.N))-1
@@ -42,8 +188,18 @@ class Ising():
     def simulate_n(self,n_steps):   
         ''' This module simulates the Ising model'''
         for i in range(n_steps):
-            self.mcmove(self.config, self.config.shape[0], self.beta)
+            if self.method == 'checkerboard':
+                checkerboard_sweep(self.config, np.asarray(self.beta).item())
+            else:
+                self.mcmove(self.config, self.config.shape[0], self.beta)
         return self.config
+
+    def magnetization(self):
+        return self.config.mean()
+
+    def energy(self):
+        ''' Energy per spin with J=1 '''
+        return -(self.config * (np.roll(self.config, 1, 0) + np.roll(self.config, 1, 1))).mean()
                  
                     
     def configPlot(self, f, config, i, N, n_):
@@ -57,8 +213,13 @@ class Ising():
         plt.show()
 
 class IsingEnv(gym.Env):
+    ''' With lazy=True a path is only simulated when it is observed, catching up
+    on the sweeps it missed. The paths are independent Markov chains, so what
+    the agent sees is distributed exactly as with every path swept every step.'''
 
-    def __init__(self,T=32,k=5):
+    def __init__(self,T=32,k=5,lazy=False,goal_bank=None):
+        self.lazy = lazy
+        self.goal_bank = goal_bank
         self.BETA_MIN = 0.01
         self.BETA_MAX = 0.3
         self.N = 64
@@ -69,6 +230,7 @@ class IsingEnv(gym.Env):
 
         self.betas = np.linspace(self.BETA_MIN,self.BETA_MAX,k)
         self.models = [Ising(beta=beta,N=self.N) for beta in self.betas]
+        self.pending = np.zeros(k, dtype=np.int64) # sweeps each path owes, lazy only
 
         self.action_space = gym.spaces.Discrete(k)
         self.observation_space = gym.spaces.Box(
@@ -88,6 +250,11 @@ class IsingEnv(gym.Env):
         return state
 
     def _generate_goal(self):
+        if self.goal_bank is not None:
+            self.goal_beta, goals = self.goal_bank.sample(1)
+            self.goal = goals[0]
+            return
+
         goal_beta = np.random.uniform(self.BETA_MIN,self.BETA_MAX,1)
 
         self.goal_beta = goal_beta
@@ -108,6 +275,7 @@ class IsingEnv(gym.Env):
                 state = self.models[i].reset()
             else:
                 self.models[i].reset()
+        self.pending[:] = 0
         self.t = 0
         x = self._rescale_state(state)
         return np.transpose(np.stack([x]*3),(1,2,0))
@@ -115,20 +283,135 @@ class IsingEnv(gym.Env):
     def step(self,action):
         self.current_path = action
         state = None
-        for i in range(len(self.models)):
-            if i == self.current_path:
-                state = self.models[i].simulate_n(1).copy()
-            else:
-                self.models[i].simulate_n(1)
+        if self.lazy:
+            self.pending += 1
+            state = self.models[action].simulate_n(self.pending[action]).copy()
+            self.pending[action] = 0
+        else:
+            for i in range(len(self.models)):
+                if i == self.current_path:
+                    state = self.models[i].simulate_n(1).copy()
+                else:
+                    self.models[i].simulate_n(1)
            
         reward = -(np.linalg.norm(state-self.goal,ord=2)) # when ||s-goal||=0, reward=infty
         self.t += 1
-        done = bool( self.t < self.T )
+        done = bool( self.t >= self.T )
         x = self._rescale_state(state)
         if done:
             self.reset()
         return np.transpose(np.stack([x]*3),(1,2,0)), reward, done, {}
 
+class IsingGym3Env(Env):
+    ''' Batched IsingEnv behind the procgen gym3 interface, for FakeEnv and the ppo2_* learners.
+
+    num envs of k temperature paths each are held as one (num, k, N, N) int8 spin
+    tensor and every path of every env advances with one checkerboard sweep per
+    step. Observations are {'rgb': (num, N, N, 3) uint8} like procgen. With
+    lazy=True only the observed path is swept, catching up like IsingEnv(lazy=True).'''
+
+    def __init__(self, num, T=32, k=5, N=64, lazy=False, goal_bank=None, **_kwargs):
+        ob_space = types.DictType(rgb=types.TensorType(eltype=types.Discrete(256, dtype_name="uint8"), shape=(N, N, 3)))
+        super().__init__(ob_space=ob_space, ac_space=types.discrete_scalar(k), num=num)
+
+        self.BETA_MIN = 0.01
+        self.BETA_MAX = 0.3
+        self.N = N
+        self.MAX_T = T
+        self.k = k
+        self.T = T
+
+        self.betas = np.linspace(self.BETA_MIN, self.BETA_MAX, k)
+        self.spins = np.zeros((num, k, N, N), dtype=np.int8)
+        self.goals = np.zeros((num, N, N), dtype=np.int8)
+        self.goal_betas = np.zeros(num)
+        self.current_path = np.zeros(num, dtype=np.int64)
+        self.t = np.zeros(num, dtype=np.int64)
+        self.lazy = lazy
+        self.pending = np.zeros((num, k), dtype=np.int64)
+        self.goal_bank = goal_bank
+
+        self._rew = np.zeros(num, dtype=np.float32)
+        self._first = np.ones(num, dtype=np.bool_)
+        self._reset(np.arange(num))
+        self._ob = self._observe_paths()
+
+    def _generate_goals(self, envs):
+        if self.goal_bank is not None:
+            goal_betas, goals = self.goal_bank.sample(len(envs))
+        else:
+            goal_betas, _, goals = generate_goals(len(envs), self.N, self.BETA_MIN, self.BETA_MAX, self.MAX_T)
+        self.goals[envs] = goals
+        self.goal_betas[envs] = goal_betas
+
+    def _reset(self, envs):
+        self._generate_goals(envs)
+        self.spins[envs] = random_spins((len(envs), self.k, self.N, self.N))
+        self.current_path[envs] = np.random.randint(0, self.k, len(envs))
+        self.pending[envs] = 0
+        self.t[envs] = 0
+
+    def _observe_paths(self):
+        state = self.spins[np.arange(self.num), self.current_path]
+        x = (state + 1) / 2 + np.random.uniform(0, 0.1, size=state.shape)
+        x = (x / x.max(axis=(1, 2), keepdims=True) * 255.).astype(np.uint8)
+        return np.repeat(x[..., None], 3, axis=-1)
+
+    def observe(self):
+        return self._rew.copy(), {'rgb': self._ob}, self._first.copy()
+
+    def get_info(self):
+        return [{'goal_beta': self.goal_betas[i]} for i in range(self.num)]
+
+    def act(self, ac):
+        self.current_path = np.asarray(ac, dtype=np.int64).reshape(self.num)
+        if self.lazy:
+            envs = np.arange(self.num)
+            self.pending += 1
+            owed = self.pending[envs, self.current_path]
+            paths = self.spins[envs, self.current_path]
+            betas = self.betas[self.current_path]
+            for t in range(owed.max()):
+                running = owed > t
+                paths[running] = checkerboard_sweep(paths[running], betas[running])
+            self.spins[envs, self.current_path] = paths
+            self.pending[envs, self.current_path] = 0
+        else:
+            checkerboard_sweep(self.spins, self.betas)
+
+        state = self.spins[np.arange(self.num), self.current_path].astype(np.float64)
+        # spectral norm, as np.linalg.norm(ord=2) on one lattice in IsingEnv
+        self._rew[:] = -np.linalg.norm(state - self.goals, ord=2, axis=(1, 2))
+        self.t += 1
+
+        done = self.t >= self.T
+        self._first[:] = done
+        if done.any():
+            self._reset(np.flatnonzero(done))
+        self._ob = self._observe_paths()
+
+    def get_state(self):
+        return [self.spins[i].tobytes() + self.goals[i].tobytes() +
+                np.array([self.goal_betas[i]]).tobytes() +
+                np.array([self.current_path[i], self.t[i]]).tobytes() +
+                self.pending[i].tobytes() for i in range(self.num)]
+
+    def set_state(self, states):
+        assert len(states) == self.num
+        n_spins = self.k * self.N * self.N
+        n_goal = self.N * self.N
+        for i, state in enumerate(states):
+            buf = np.frombuffer(state, dtype=np.uint8)
+            self.spins[i] = buf[:n_spins].view(np.int8).reshape(self.k, self.N, self.N)
+            self.goals[i] = buf[n_spins:n_spins + n_goal].view(np.int8).reshape(self.N, self.N)
+            self.goal_betas[i] = buf[n_spins + n_goal:n_spins + n_goal + 8].view(np.float64)[0]
+            counters = buf[n_spins + n_goal + 8:].view(np.int64)
+            self.current_path[i], self.t[i] = counters[:2]
+            self.pending[i] = counters[2:]
+        self._rew[:] = 0
+        self._first[:] = False
+        self._ob = self._observe_paths()
+
 if __name__ == '__main__':
     env = IsingEnv(T=32,k=5)
     state = env.reset()
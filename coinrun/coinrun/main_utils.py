@@ -5,7 +5,6 @@ import numpy as np
 
 from mpi4py import MPI
 
-from baselines.common.vec_env.vec_frame_stack import VecFrameStack
 from coinrun.config import Config
 from coinrun import setup_utils, wrappers
 
@@ -14,10 +13,8 @@ import platform
 def make_general_env(num_env, seed=0, use_sub_proc=True):
     from coinrun import coinrunenv
     
-    env = coinrunenv.make(Config.GAME_TYPE, num_env)
-
-    if Config.FRAME_STACK > 1:
-        env = VecFrameStack(env, Config.FRAME_STACK)
+    # frames are stacked natively, in a ring inside the observation buffer
+    env = coinrunenv.make(Config.GAME_TYPE, num_env, frame_skip=Config.FRAME_SKIP, frame_stack=Config.FRAME_STACK)
 
     epsilon = Config.EPSILON_GREEDY
 
@@ -0,0 +1,113 @@
+"""
+CPU placement for the MPI ranks sharing a host: core affinity, env worker threads
+and TF op pools, derived from the host topology.
+
+Each local rank gets a contiguous block of whole physical cores, SMT siblings
+included, so N ranks on one machine don't oversubscribe it. The block is split
+between the env worker threads and TF's intra-op pool, so env workers and TF
+ops don't compete for the same cores. The train, eval and probe envs each get
+an env pool of that size, but only one of them steps at a time. If the
+launcher already bound ranks to different CPUs (e.g. mpirun --bind-to), that
+binding is kept.
+"""
+
+import os
+import socket
+from collections import namedtuple
+
+from mpi4py import MPI
+
+from coinrun.config import Config
+
+Placement = namedtuple('Placement', ['local_rank', 'local_size', 'cpus', 'num_cores',
+                                     'env_threads', 'intra_op_threads', 'inter_op_threads'])
+
+_placement = None
+
+def read_int(path):
+    with open(path) as f:
+        return int(f.read())
+
+def cpu_cores(cpus):
+    """
+    `cpus` grouped into lists of SMT siblings, one per physical core, in (package, core) order.
+    """
+    cores = {}
+
+    for cpu in sorted(cpus):
+        topology = '/sys/devices/system/cpu/cpu%d/topology/' % cpu
+        try:
+            key = (read_int(topology + 'physical_package_id'), read_int(topology + 'core_id'))
+        except (OSError, ValueError):
+            key = (0, cpu)
+        cores.setdefault(key, []).append(cpu)
+
+    return [cores[key] for key in sorted(cores)]
+
+def rank_cores(cores, local_rank, local_size):
+    """
+    The block of `cores` for `local_rank`. Ranks only share a core when there are more ranks than cores.
+    """
+    if local_size >= len(cores):
+        return [cores[local_rank % len(cores)]]
+
+    start = local_rank * len(cores) // local_size
+    end = (local_rank + 1) * len(cores) // local_size
+
+    return cores[start:end]
+
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+
+    return list(range(os.cpu_count()))
+
+def compute_placement(comm=None):
+    if comm is None:
+        comm = MPI.COMM_WORLD
+    local_comm = comm.Split_type(MPI.COMM_TYPE_SHARED)
+    local_rank, local_size = local_comm.Get_rank(), local_comm.Get_size()
+
+    cpus = available_cpus()
+    if all(other == cpus for other in local_comm.allgather(cpus)):
+        cores = rank_cores(cpu_cores(cpus), local_rank, local_size)
+    else:
+        cores = cpu_cores(cpus)
+
+    num_cores = len(cores)
+    env_threads = max(1, num_cores // 2)
+    placement = Placement(local_rank=local_rank, local_size=local_size,
+                          cpus=sorted(cpu for core in cores for cpu in core), num_cores=num_cores,
+                          env_threads=env_threads, intra_op_threads=max(1, num_cores - env_threads),
+                          inter_op_threads=2 if num_cores >= 4 else 1)
+
+    line = '%s rank %d/%d: cpus %s (%d cores), env threads %d, tf intra %d inter %d' % (
+        socket.gethostname(), local_rank, local_size, ','.join(map(str, placement.cpus)), num_cores,
+        placement.env_threads, placement.intra_op_threads, placement.inter_op_threads)
+    lines = local_comm.gather(line)
+    if local_rank == 0:
+        for line in lines:
+            print('placement', line)
+
+    return placement
+
+def get_placement():
+    """
+    This rank's placement, computed and applied on first use. Threads started afterwards inherit the affinity.
+    """
+    global _placement
+
+    if _placement is None:
+        _placement = compute_placement()
+
+        if Config.PIN_CPUS and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, _placement.cpus)
+
+    return _placement
+
+def configure_tf(config):
+    placement = get_placement()
+    config.intra_op_parallelism_threads = placement.intra_op_threads
+    config.inter_op_parallelism_threads = placement.inter_op_threads
+
+    return config
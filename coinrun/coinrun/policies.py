@@ -3,7 +3,7 @@ import tensorflow as tf
 from baselines.a2c.utils import conv, fc, conv_to_fc, batch_to_seq, seq_to_batch, lstm
 from baselines.common.distributions import make_pdtype, _matching_fc
 from baselines.common.input import observation_input
-from coinrun.ppo2_goal import sinkhorn
+from coinrun.models import sinkhorn
 from coinrun.models import FiLM, TemporalBlock
 # TODO this is no longer supported in tfv2, so we'll need to
 # properly refactor where it's used if we want to use
@@ -208,6 +208,8 @@ class CnnPolicy(object):
 			CLUSTER_DIMS = 256
 			HIDDEN_DIMS_SSL = 256
 			STEP_BOOL = tf.placeholder(tf.bool, shape=[])
+			# online embeddings of the frames preceding REP_PROC, cached from the previous step. Empty unless stepping with a cache
+			H_TM1 = tf.compat.v1.placeholder_with_default(tf.zeros((0, 256)), shape=(None, 256), name='H_tm1')
 			self.protos = tf.compat.v1.Variable(initial_value=tf.random.normal(shape=(CLUSTER_DIMS, Config.N_SKILLS)), trainable=True, name='Prototypes')
 			self.A = self.pdtype.sample_placeholder([None],name='A')
 			# trajectories of length m, for N policy heads.
@@ -372,7 +374,10 @@ class CnnPolicy(object):
 			with tf.compat.v1.variable_scope("online", reuse=tf.compat.v1.AUTO_REUSE):
 				# h_codes: n_batch x n_t x n_rkhs
 				act_condit, act_invariant, _, _ = choose_cnn(obs_cluster)
-				self.h_codes =  tf.transpose(tf.reshape(tf.concat([act_condit, act_invariant], axis=1),[-1,Config.NUM_ENVS,256]),(1,0,2))
+				h_online = tf.concat([H_TM1, tf.concat([act_condit, act_invariant], axis=1)], axis=0)
+				# latent-only entry into the clustering head: feed online embeddings computed at step time instead of frames
+				H_ONLINE = tf.compat.v1.placeholder_with_default(h_online, shape=(None, 256), name='H_online')
+				self.h_codes =  tf.transpose(tf.reshape(H_ONLINE,[-1,Config.NUM_ENVS,256]),(1,0,2))
 				h_t = self.h_codes[:,:-1]
 				h_tp1 = self.h_codes[:,1:]
 				
@@ -472,7 +477,8 @@ class CnnPolicy(object):
 			Condition on soft-cluster assignments for policy head (Cluster Conditioned Policy )
 			"""
 			if Config.CLUSTER_CONDIT_POLICY:
-				self.h = self.h[Config.NUM_ENVS:]
+				# drop the first frame of each env, unless its predecessor came in through H_TM1
+				self.h = self.h[Config.NUM_ENVS - tf.shape(H_TM1)[0]:]
 				concat_code_1 = tf.compat.v1.Variable(initial_value=tf.random.normal(shape=(32, Config.N_SKILLS)), trainable=False, name='Code_Var_step')
 				concat_code_2 = tf.compat.v1.Variable(initial_value=tf.random.normal(shape=(1024, Config.N_SKILLS)), trainable=False, name='Code_Var_train')
 				def live_codes():
@@ -556,7 +562,7 @@ class CnnPolicy(object):
 		neglogp0_run = [self.pd_run[head_idx].neglogp(a0_run[head_idx]) for head_idx in range(Config.POLICY_NHEADS)]
 		self.initial_state = None
 
-		def step(ob, update_frac, skill_idx=None, one_hot_skill=None, nce_dict = {},  *_args, **_kwargs):
+		def step(ob, update_frac, skill_idx=None, one_hot_skill=None, nce_dict = {}, h_tm1=None, *_args, **_kwargs):
 			if Config.REPLAY:
 				ob = ob.astype(np.float32)
 			if Config.AGENT == 'ppo_rnd':
@@ -568,7 +574,11 @@ class CnnPolicy(object):
 			elif Config.AGENT == 'ppo_goal':
 				if Config.CLUSTER_CONDIT_POLICY:
 					# for step, pass in dummy values for code placeholder since we compute the codes live
-					a, v, v_i, neglogp, h, h_codes, ht, htp1, ccode = sess.run([a0_run[0], self.vf_run[0], self.vf_i_run, neglogp0_run[0], self.h, self.h_codes, h_t, h_tp1, self.concat_code], {REP_PROC: ob, Z: one_hot_skill, CODES: np.zeros(shape=(1024, Config.N_SKILLS)), STEP_BOOL: True})
+					td_map = {REP_PROC: ob, Z: one_hot_skill, CODES: np.zeros(shape=(1024, Config.N_SKILLS)), STEP_BOOL: True}
+					# with a cached h for o_{t-1}, ob only holds o_t and the CNNs run once per frame
+					if h_tm1 is not None:
+						td_map[H_TM1] = h_tm1
+					a, v, v_i, neglogp, h, h_codes, ht, htp1, ccode = sess.run([a0_run[0], self.vf_run[0], self.vf_i_run, neglogp0_run[0], self.h, self.h_codes, h_t, h_tp1, self.concat_code], td_map)
 					return a, v, v_i, self.initial_state, neglogp,  h, h_codes, ht, htp1, ccode
 				else:
 					a, v, v_i, neglogp = sess.run([a0_run[0], self.vf_run[0], self.vf_i_run, neglogp0_run[0]], {REP_PROC: ob, Z: one_hot_skill})
@@ -627,6 +637,9 @@ class CnnPolicy(object):
 		def compute_codes(ob,act):
 			return sess.run([tf.reshape(self.codes , (Config.NUM_ENVS,Config.NUM_STEPS,-1)), tf.reshape(self.u_t , (Config.NUM_ENVS,Config.NUM_STEPS,-1)), tf.reshape(self.z_t_1 , (Config.NUM_ENVS,Config.NUM_STEPS,-1)) , self.h_codes[:,1:]], {REP_PROC: ob, self.A_cluster: act})
 		
+		def compute_latent_codes(h_online, act):
+			return sess.run([tf.reshape(self.codes , (Config.NUM_ENVS,Config.NUM_STEPS,-1)), tf.reshape(self.u_t , (Config.NUM_ENVS,Config.NUM_STEPS,-1)), tf.reshape(self.z_t_1 , (Config.NUM_ENVS,Config.NUM_STEPS,-1)) , self.h_codes[:,1:]], {H_ONLINE: h_online, self.A_cluster: act})
+
 		def compute_hard_codes(ob):
 			return sess.run([self.codes, self.u_t, self.z_t_1], {REP_PROC: ob})
 
@@ -635,6 +648,8 @@ class CnnPolicy(object):
 
 		self.X = X
 		self.processed_x = processed_x
+		self.a0_run = a0_run
+		self.neglogp0_run = neglogp0_run
 		self.step = step
 		self.value = value
 		self.value_i = value_i
@@ -645,10 +660,12 @@ class CnnPolicy(object):
 		self.REP_PROC = REP_PROC
 		self.Z = Z
 		self.compute_codes = compute_codes
+		self.compute_latent_codes = compute_latent_codes
 		self.compute_hard_codes = compute_hard_codes
 		self.compute_cluster_returns = compute_cluster_returns
 		self.CODES = CODES
 		self.STEP_BOOL = STEP_BOOL
+		self.H_TM1 = H_TM1
 
 
 def get_policy():
@@ -1,15 +1,11 @@
 """
 This is a copy of PPO from openai/baselines (https://github.com/openai/baselines/blob/52255beda5f5c8760b0ae1f676aa656bb1a61f80/baselines/ppo2/ppo2.py) with some minor changes.
 """
-import wandb
 import time
 import joblib
 import numpy as np
 import tensorflow as tf
 from collections import deque
-import gym3
-from PIL import Image
-import ffmpeg
 import datetime
 
 
@@ -20,8 +16,8 @@ from mpi4py import MPI
 from coinrun.tb_utils import TB_Writer
 import coinrun.main_utils as utils
 
-from coinrun.train_agent import make_env
 from coinrun.config import Config, count_latent_factors
+from coinrun import graph_cache, models, sizing
 
 mpi_print = utils.mpi_print
 
@@ -84,6 +80,7 @@ def soft_update(source_variables,target_variables,tau=1.0):
 
 # helper function to turn numpy array into video file
 def vidwrite(filename, images, framerate=60, vcodec='libx264'):
+	import ffmpeg
 	if not isinstance(images, np.ndarray):
 		images = np.asarray(images)
 	n,height,width,channels = images.shape
@@ -204,22 +201,67 @@ def tanh_clip(x, clip_val=20.):
 	return x_clip
 
 
-class Model(object):
-	def __init__(self, *, policy, ob_space, ac_space, nbatch_act, nbatch_train,
-				nsteps, ent_coef, vf_coef, max_grad_norm):
-		self.max_grad_norm = max_grad_norm
-		self.head_idx_current_batch = 0
-		self.critic_idx_current_batch = 0
-		sess = tf.compat.v1.get_default_session()
+# placeholders and fetches of the plain ppo loss, restored from a cached model graph
+LOSS_INPUTS = ['A', 'ADV', 'R', 'OLDNEGLOGPAC', 'OLDVPRED', 'LR', 'CLIPRANGE']
+LOSS_OUTPUTS = ['pg_loss', 'vf_loss', 'entropy', 'approxkl_train', 'clipfrac_train', 'approxkl_run', 'clipfrac_run', 'l2_loss', 'info_loss', 'loss']
+# the representation loss tensors, never cached
+REP_LOSS_TENSORS = ['R_NCE', 'OLDNEGLOGPAC_i', 'ADV_i', 'OLDVPRED_i', 'R_i', 'rep_loss', 'vf_loss_i', 'pg_loss_i']
 
-		self.running_stats_s = RunningStats()
-		self.running_stats_s_ = RunningStats()
-		self.running_stats_r = RunningStats()
-		self.running_stats_r_i = RunningStats()
+def cached_graph_path(policy, **shapes):
+	"""
+	Cache file of the model graph, or None when -gcache is unset or the agent needs more than the plain ppo act and train paths.
+	The optimizer is always rebuilt on top of the cached loss, since MpiAdamOptimizer's allreduce is a py_func.
+	"""
+	if Config.GRAPH_CACHE_DIR is None or Config.AGENT != 'ppo' or Config.CUSTOM_REP_LOSS or Config.QUANTIZE_ACT:
+		return None
 
-		train_model = policy(sess, ob_space, ac_space, nbatch_train, nsteps, max_grad_norm)
-		act_model = policy(sess, ob_space, ac_space, nbatch_act, 1, max_grad_norm)
-		self.train_model = train_model
+	sources = [__file__, sys.modules[policy.__module__].__file__, models.__file__]
+
+	return graph_cache.graph_path(sources, **shapes)
+
+class CachedPolicy(object):
+	"""
+	The plain ppo act model interface on top of tensors imported from a cached model graph.
+	"""
+	def __init__(self, sess, tensors, prefix):
+		self.sess = sess
+		self.X = tensors[prefix + '/X']
+		self.STATE = tensors.get(prefix + '/STATE')
+		self.h = tensors[prefix + '/h']
+		self.a0 = tensors[prefix + '/a0']
+		self.neglogp0 = tensors[prefix + '/neglogp0']
+		self.vf_run = tensors[prefix + '/vf_run']
+		self.train_dropout_assign_ops = tensors[prefix + '/train_dropout_assign_ops']
+		self.run_dropout_assign_ops = tensors[prefix + '/run_dropout_assign_ops']
+		self.initial_state = None
+		self.custom_train = None
+
+	@staticmethod
+	def named_tensors(policy, prefix):
+		return {prefix + '/X': policy.X, prefix + '/STATE': getattr(policy, 'STATE', None), prefix + '/h': policy.h,
+				prefix + '/a0': policy.a0_run[0], prefix + '/neglogp0': policy.neglogp0_run[0], prefix + '/vf_run': policy.vf_run,
+				prefix + '/train_dropout_assign_ops': list(policy.train_dropout_assign_ops), prefix + '/run_dropout_assign_ops': list(policy.run_dropout_assign_ops)}
+
+	def step(self, ob, *_args, **_kwargs):
+		if Config.REPLAY:
+			ob = ob.astype(np.float32)
+		a, v, neglogp = self.sess.run([self.a0, self.vf_run[0], self.neglogp0], {self.X: ob})
+		return a, v, self.initial_state, neglogp
+
+	def value(self, ob, *_args, **_kwargs):
+		td_map = {self.X: ob}
+		if self.STATE is not None:
+			td_map[self.STATE] = ob
+		return self.sess.run(self.vf_run, td_map)
+
+	def rep_vec(self, ob, *_args, **_kwargs):
+		return self.sess.run(self.h, {self.X: ob})
+
+class Model(object):
+	def _build_loss(self, train_model, ent_coef, vf_coef):
+		"""
+		Placeholders and losses on top of train_model, as a dict keyed by LOSS_INPUTS, LOSS_OUTPUTS and, with Config.CUSTOM_REP_LOSS, REP_LOSS_TENSORS.
+		"""
 		# in case we don't use rep loss
 		rep_loss = None
 		# HEAD_IDX = tf.compat.v1.placeholder(tf.int32, [None])
@@ -345,6 +387,46 @@ class Model(object):
 		else:
 			loss = pg_loss - entropy * ent_coef + vf_loss * vf_coef + l2_loss * Config.L2_WEIGHT + beta * info_loss
 
+		tensors = dict(zip(LOSS_INPUTS, [A, ADV, R, OLDNEGLOGPAC, OLDVPRED, LR, CLIPRANGE]))
+		tensors.update(zip(LOSS_OUTPUTS, [pg_loss, vf_loss, entropy, approxkl_train, clipfrac_train, approxkl_run, clipfrac_run, l2_loss, info_loss, loss]))
+		if Config.CUSTOM_REP_LOSS:
+			tensors.update(zip(REP_LOSS_TENSORS, [R_NCE, OLDNEGLOGPAC_i, ADV_i, OLDVPRED_i, R_i, rep_loss, vf_loss_i, pg_loss_i]))
+
+		return tensors
+
+	def __init__(self, *, policy, ob_space, ac_space, nbatch_act, nbatch_train,
+				nsteps, ent_coef, vf_coef, max_grad_norm):
+		self.max_grad_norm = max_grad_norm
+		self.head_idx_current_batch = 0
+		self.critic_idx_current_batch = 0
+		sess = tf.compat.v1.get_default_session()
+
+		self.running_stats_s = RunningStats()
+		self.running_stats_s_ = RunningStats()
+		self.running_stats_r = RunningStats()
+		self.running_stats_r_i = RunningStats()
+
+		graph_path = cached_graph_path(policy, ob_shape=ob_space.shape, ob_dtype=str(ob_space.dtype), nact=ac_space.n,
+					nbatch_act=nbatch_act, nbatch_train=nbatch_train, nsteps=nsteps, ent_coef=ent_coef, vf_coef=vf_coef)
+		if graph_path is not None and os.path.exists(graph_path):
+			tstart = time.time()
+			tensors = graph_cache.import_graph(graph_path)
+			train_model = CachedPolicy(sess, tensors, 'train')
+			act_model = CachedPolicy(sess, tensors, 'act')
+			mpi_print('imported model graph', graph_path, 'in %.2fs' % (time.time() - tstart))
+		else:
+			train_model = policy(sess, ob_space, ac_space, nbatch_train, nsteps, max_grad_norm)
+			act_model = policy(sess, ob_space, ac_space, nbatch_act, 1, max_grad_norm)
+			self.train_model = train_model
+			tensors = self._build_loss(train_model, ent_coef, vf_coef)
+			if graph_path is not None:
+				graph_cache.export_graph(graph_path, {**CachedPolicy.named_tensors(train_model, 'train'), **CachedPolicy.named_tensors(act_model, 'act'), **tensors})
+
+		A, ADV, R, OLDNEGLOGPAC, OLDVPRED, LR, CLIPRANGE = [tensors[name] for name in LOSS_INPUTS]
+		pg_loss, vf_loss, entropy, approxkl_train, clipfrac_train, approxkl_run, clipfrac_run, l2_loss, info_loss, loss = [tensors[name] for name in LOSS_OUTPUTS]
+		R_NCE, OLDNEGLOGPAC_i, ADV_i, OLDVPRED_i, R_i, rep_loss, vf_loss_i, pg_loss_i = [tensors.get(name) for name in REP_LOSS_TENSORS]
+		params = tf.compat.v1.trainable_variables()
+
 		if Config.SYNC_FROM_ROOT:
 			trainer = MpiAdamOptimizer(MPI.COMM_WORLD, learning_rate=LR, epsilon=1e-5)
 		else:
@@ -452,22 +534,16 @@ class Runner(AbstractEnvRunner):
 
 		self.lam = lam
 		self.gamma = gamma
+		# act path of the training rollouts, an int8 copy of model's when Config.QUANTIZE_ACT is set. Eval rollouts always use model
+		self.collect_model = model
 		# List of two element tuples containing state lists for procgen,
 		# where each tuple is the start & ending state for a trajectory.
 		# The intuition here is that start and ending states will be very
 		# different, giving us good positive/negative examples.
 		self.diff_states = []
-		# create env just for resets
-		# TODO: Set a Config variable that takes this in as arg
-		total_timesteps = int(160e6)
-		if Config.LONG_TRAINING:
-			total_timesteps = int(200e6)
-		elif Config.SHORT_TRAINING:
-			#total_timesteps = int(120e6)
-			total_timesteps = int(25e6)
-		elif Config.VERY_SHORT_TRAINING:
-			total_timesteps = int(5e6)
-		self.reset_env = make_env(steps_per_env=total_timesteps//2)[0] # for _ in range(Config.POLICY_NHEADS)]
+		# probe env for rollouts from restored states, built on first use for the active phase of env
+		from coinrun.train_agent import make_probe_env
+		self.reset_env = make_probe_env(env)
 		self.eval_env = eval_env
 
 	def get_NCE_samples(self, s_0, env,obs_0,done):
@@ -587,7 +663,7 @@ class Runner(AbstractEnvRunner):
 			else:
 				# Given observations, get action value and neglopacs
 				# We already have self.obs because Runner superclass run self.obs[:] = env.reset() on init
-				actions, values, self.states, neglogpacs = self.model.step(self.obs,  update_frac,None, self.dones)
+				actions, values, self.states, neglogpacs = self.collect_model.step(self.obs,  update_frac,None, self.dones)
 
 			mb_obs.append(self.obs.copy())
 			mb_actions.append(actions)
@@ -645,7 +721,7 @@ class Runner(AbstractEnvRunner):
 				mb_infos_nce = np.asarray(mb_infos_nce, dtype=np.float32).transpose(0,3,1,2,4)
 			mb_labels_nce = np.asarray(mb_labels_nce, dtype=np.float32).transpose(0,2,1)
 
-		last_values = self.model.value(self.obs, update_frac, self.states, self.dones)[self.model.critic_idx_current_batch] #use first critic
+		last_values = self.collect_model.value(self.obs, update_frac, self.states, self.dones)[self.model.critic_idx_current_batch] #use first critic
 		
 		if Config.CUSTOM_REP_LOSS:
 			last_values_i = self.model.train_model.value_i(self.obs, update_frac, self.states, self.dones)
@@ -748,6 +824,11 @@ def learn(*, policy, env, eval_env, nsteps, total_timesteps, ent_coef, lr,
 
 	runner = Runner(env=env, eval_env=eval_env, model=model, nsteps=nsteps, gamma=gamma, lam=lam)
 
+	if Config.QUANTIZE_ACT:
+		assert Config.AGENT == 'ppo' and not Config.CUSTOM_REP_LOSS, 'int8 rollouts need the plain ppo act path'
+		from coinrun import quantize_policy
+		quant_acc = {}
+
 	epinfobuf10 = deque(maxlen=10)
 	epinfobuf100 = deque(maxlen=100)
 	eval_epinfobuf100 = deque(maxlen=100)
@@ -784,6 +865,7 @@ def learn(*, policy, env, eval_env, nsteps, total_timesteps, ent_coef, lr,
 	import os
 	os.environ["WANDB_API_KEY"] = "02e3820b69de1b1fcc645edcfc3dd5c5079839a1"
 	group_name = "%s__%s__%f" %(Config.ENVIRONMENT,Config.AGENT,Config.REP_LOSS_WEIGHT)
+	import wandb
 	wandb.init(project='procgen_generalization', entity='ssl_rl', config=Config.args_dict, group=group_name, mode="disabled" if Config.DISABLE_WANDB else "online")
 	for update in range(start_update+1, nupdates+1):
 		assert nbatch % nminibatches == 0
@@ -857,6 +939,15 @@ def learn(*, policy, env, eval_env, nsteps, total_timesteps, ent_coef, lr,
 		sess.run([model.train_model.train_dropout_assign_ops])
 		sess.run([model.train_model.run_dropout_assign_ops])
 
+		# training rollouts use an int8 copy of the fresh fp32 weights, calibrated on frames from this batch
+		if Config.QUANTIZE_ACT and (update - start_update - 1) % Config.QUANTIZE_ACT == 0:
+			frame_inds = np.random.permutation(nbatch)
+			calib = obs[frame_inds[:Config.QUANT_CALIB_FRAMES]]
+			held_out = obs[frame_inds[Config.QUANT_CALIB_FRAMES:2 * Config.QUANT_CALIB_FRAMES]]
+			quant_model = quantize_policy.quantize_act_model(sess, model.act_model, calib)
+			quant_acc = quantize_policy.check_accuracy(quantize_policy.ActModelReference(sess, model.act_model), quant_model, held_out)
+			runner.collect_model = quant_model
+
 		train_elapsed = time.time() - train_tstart
 		train_t_total += train_elapsed
 		mpi_print('update complete')
@@ -880,6 +971,10 @@ def learn(*, policy, env, eval_env, nsteps, total_timesteps, ent_coef, lr,
 			tb_writer.log_scalar(fps, 'fps', step=step)
 			tb_writer.log_scalar(avg_value, 'avg_value', step=step)
 			tb_writer.log_scalar(mean_cust_loss, 'custom_loss', step=step)
+			if Config.QUANTIZE_ACT:
+				for key, val in quant_acc.items():
+					mpi_print('quant_' + key, val)
+					tb_writer.log_scalar(val, 'quant_' + key, step=step)
 
 
 			mpi_print('time_elapsed', tnow - tfirststart, run_t_total, train_t_total)
@@ -891,6 +986,7 @@ def learn(*, policy, env, eval_env, nsteps, total_timesteps, ent_coef, lr,
 			mpi_print('eprew', rew_mean_10)
 			mpi_print('eprew_eval', eval_rew_mean)
 			mpi_print('fps', fps)
+			sizing.log_memory(tb_writer, step)
 			mpi_print('total_timesteps', update*nbatch)
 			mpi_print([epinfo['r'] for epinfo in epinfobuf10])
 
@@ -1,15 +1,11 @@
 """
 This is a copy of PPO from openai/baselines (https://github.com/openai/baselines/blob/52255beda5f5c8760b0ae1f676aa656bb1a61f80/baselines/ppo2/ppo2.py) with some minor changes.
 """
-import wandb
 import time
 import joblib
 import numpy as np
 import tensorflow as tf
 from collections import deque
-import gym3
-from PIL import Image
-import ffmpeg
 import datetime
 
 
@@ -19,8 +15,8 @@ from mpi4py import MPI
 
 from coinrun.tb_utils import TB_Writer
 import coinrun.main_utils as utils
+from coinrun import sizing
 
-from coinrun.train_agent import make_env
 from coinrun.config import Config, count_latent_factors
 
 mpi_print = utils.mpi_print
@@ -84,6 +80,7 @@ def soft_update(source_variables,target_variables,tau=1.0):
 
 # helper function to turn numpy array into video file
 def vidwrite(filename, images, framerate=60, vcodec='libx264'):
+    import ffmpeg
     if not isinstance(images, np.ndarray):
         images = np.asarray(images)
     n,height,width,channels = images.shape
@@ -460,17 +457,9 @@ class Runner(AbstractEnvRunner):
         # The intuition here is that start and ending states will be very
         # different, giving us good positive/negative examples.
         self.diff_states = []
-        # create env just for resets
-        # TODO: Set a Config variable that takes this in as arg
-        total_timesteps = int(160e6)
-        if Config.LONG_TRAINING:
-            total_timesteps = int(200e6)
-        elif Config.SHORT_TRAINING:
-            #total_timesteps = int(120e6)
-            total_timesteps = int(25e6)
-        elif Config.VERY_SHORT_TRAINING:
-            total_timesteps = int(5e6)
-        self.reset_env = make_env(steps_per_env=total_timesteps//2)[0] # for _ in range(Config.POLICY_NHEADS)]
+        # probe env for rollouts from restored states, built on first use for the active phase of env
+        from coinrun.train_agent import make_probe_env
+        self.reset_env = make_probe_env(env)
         self.eval_env = eval_env
 
     def get_NCE_samples(self, s_0, env,obs_0,done):
@@ -788,6 +777,7 @@ def learn(*, policy, env, eval_env, nsteps, total_timesteps, ent_coef, lr,
     os.environ["WANDB_API_KEY"] = "02e3820b69de1b1fcc645edcfc3dd5c5079839a1"
     group_name = "%s__%s__%d__%d__%f__%d" %(Config.ENVIRONMENT,Config.RUN_ID,Config.CLUSTER_T,Config.N_KNN, Config.TEMP, Config.N_SKILLS)
     name = "%s__%s__%d__%d__%f__%d__%d" %(Config.ENVIRONMENT,Config.RUN_ID,Config.CLUSTER_T,Config.N_KNN,  Config.TEMP, Config.N_SKILLS, np.random.randint(100000000))
+    import wandb
     wandb.init(project='ising_generalization' if Config.ENVIRONMENT == 'ising' else 'procgen_generalization' , entity='ssl_rl', config=Config.args_dict, group=group_name, name=name, mode="disabled" if Config.DISABLE_WANDB else "online")
     for update in range(start_update+1, nupdates+1):
         assert nbatch % nminibatches == 0
@@ -893,6 +883,7 @@ def learn(*, policy, env, eval_env, nsteps, total_timesteps, ent_coef, lr,
             mpi_print('eprew', rew_mean_10)
             mpi_print('eprew_eval', eval_rew_mean)
             mpi_print('fps', fps)
+            sizing.log_memory(tb_writer, step)
             mpi_print('total_timesteps', update*nbatch)
             mpi_print([epinfo['r'] for epinfo in epinfobuf10])
 
@@ -1,15 +1,11 @@
 """
 This is a copy of PPO from openai/baselines (https://github.com/openai/baselines/blob/52255beda5f5c8760b0ae1f676aa656bb1a61f80/baselines/ppo2/ppo2.py) with some minor changes.
 """
-import wandb
 import time
 import joblib
 import numpy as np
 import tensorflow as tf
 from collections import deque
-import gym3
-from PIL import Image
-import ffmpeg
 import datetime
 
 
@@ -19,9 +15,10 @@ from mpi4py import MPI
 
 from coinrun.tb_utils import TB_Writer
 import coinrun.main_utils as utils
+from coinrun import sizing
 
-from coinrun.train_agent import make_env
 from coinrun.config import Config, count_latent_factors
+from coinrun.models import sinkhorn
 
 mpi_print = utils.mpi_print
 
@@ -36,37 +33,8 @@ from tensorflow.python.ops.ragged.ragged_util import repeat
 
 from random import choice
 
-from sklearn.metrics import silhouette_score
-
-
-# k: k parameter for K-nn
-def sinkhorn(scores, temp=0.1, k=3):
-    def remove_infs(x):
-        m = tf.math.reduce_max(x[tf.math.is_inf(x)])
-        casted_x = tf.cast(tf.ones_like(x, dtype=tf.dtypes.float32), tf.float32)
-        max_tensor = tf.math.multiply(casted_x, m)
-        return tf.where(tf.math.is_inf(x), max_tensor, x)
-
-    # set temperature through flag
-    temp = Config.TEMP
-    Q = scores / temp
-    Q -= tf.math.reduce_max(Q)
-
-    Q = tf.transpose(tf.math.exp(Q))
-    Q /= tf.math.reduce_sum(Q)
-
-    r = tf.ones(tf.shape(Q)[0]) / tf.cast(tf.shape(Q)[0], tf.float32)
-    c = tf.ones(tf.shape(Q)[1]) / tf.cast(tf.shape(Q)[1], tf.float32)
-
-    for it in range(k):
-        u = tf.reduce_sum(Q, axis=1)
-        u = tf.cast(u, tf.float32)
-        u = remove_infs(r / u)
-        Q = tf.cast(Q, tf.float32)
-        Q *= tf.expand_dims(u, axis=1)
-        Q *= tf.expand_dims((c / tf.math.reduce_sum(Q, axis=0)), axis=0)
-    Q = Q / tf.math.reduce_sum(Q, axis=0, keepdims=True)
-    return tf.transpose(Q)
+
+
 """
 Intrinsic advantage methods
 """
@@ -122,6 +90,7 @@ def running_stats_fun(run_stats, buf, clip, clip_state):
 
 # helper function to turn numpy array into video file
 def vidwrite(filename, images, framerate=60, vcodec='libx264'):
+	import ffmpeg
 	if not isinstance(images, np.ndarray):
 		images = np.asarray(images)
 	n,height,width,channels = images.shape
@@ -482,6 +451,7 @@ class Model(object):
 		self.custom_train = train_model.custom_train
 		self.value_i = act_model.value_i
 		self.compute_codes = act_model.compute_codes
+		self.compute_latent_codes = act_model.compute_latent_codes
 		self.compute_hard_codes = act_model.compute_hard_codes
 
 		if Config.SYNC_FROM_ROOT:
@@ -541,6 +511,8 @@ class Runner(AbstractEnvRunner):
 		epinfos = []
 		eval_epinfos = []
 		mb_pre_codes = []
+		# step-time online embeddings of o_t, reused for the post-rollout codes
+		mb_h_online = []
 
 		head_idx_current_batch = 0 #np.random.randint(0,Config.POLICY_NHEADS,1).item()
 	   
@@ -550,6 +522,8 @@ class Runner(AbstractEnvRunner):
 		one_hot_skill = np.stack(Config.NUM_ENVS*[one_hot_skill])
 		# the skill remains fixed for each minibatch 
 		mb_skill = np.asarray([one_hot_skill]*self.nsteps, dtype=np.int32)
+		# online embeddings of o_{t-1} carried between steps, so each frame goes through the CNN once
+		h_tm1 = eval_h_tm1 = None
 		# For n in range number of steps
 		for i in range(self.nsteps):
 			# Given observations, get action value and neglopacs
@@ -557,11 +531,18 @@ class Runner(AbstractEnvRunner):
 			if i == 0:
 				ob_tm1 = np.expand_dims(self.obs, 0)
 			ob_t = np.expand_dims(self.obs, 0)
-			# concat o_t and o_t_m1 for joint step clustering on step function
-			joint_ob = np.concatenate([ob_tm1, ob_t], 0)
 			if Config.CLUSTER_CONDIT_POLICY:
-				actions, values, values_i, self.states, neglogpacs, h, h_codes, ht, htp1, ccode = self.model.step(joint_ob.reshape(-1, 64, 64, 3),  update_frac, skill_idx=z, one_hot_skill=one_hot_skill)
+				if h_tm1 is None:
+					# concat o_t and o_t_m1 for joint step clustering on step function
+					step_ob = np.concatenate([ob_tm1, ob_t], 0).reshape(-1, 64, 64, 3)
+				else:
+					step_ob = self.obs
+				actions, values, values_i, self.states, neglogpacs, h, h_codes, ht, htp1, ccode = self.model.step(step_ob,  update_frac, skill_idx=z, one_hot_skill=one_hot_skill, h_tm1=h_tm1)
+				h_tm1 = htp1[:, -1]
+				mb_h_online.append(h_tm1)
 			else:
+				# concat o_t and o_t_m1 for joint step clustering on step function
+				joint_ob = np.concatenate([ob_tm1, ob_t], 0)
 				actions, values, values_i, self.states, neglogpacs = self.model.step(joint_ob.reshape(-1,64,64,3),  update_frac, skill_idx=z, one_hot_skill=one_hot_skill)
 			mb_obs.append(self.obs.copy())
 			mb_actions.append(actions)
@@ -581,11 +562,17 @@ class Runner(AbstractEnvRunner):
 			if i == 0:
 				eval_ob_tm1 = np.expand_dims(self.eval_obs, 0)
 			eval_ob_t = np.expand_dims(self.eval_obs, 0)
-			# concat o_t and o_t_m1 for joint step clustering on step function
-			joint_ob_eval = np.concatenate([eval_ob_tm1, eval_ob_t], 0)
 			if Config.CLUSTER_CONDIT_POLICY:
-				eval_actions, eval_values, _, eval_states, eval_neglogpacs, h, h_codes, ht, htp1, ccode = self.model.step(joint_ob_eval.reshape(-1,64,64,3), update_frac, skill_idx=z, one_hot_skill=one_hot_skill)
+				if eval_h_tm1 is None:
+					# concat o_t and o_t_m1 for joint step clustering on step function
+					eval_step_ob = np.concatenate([eval_ob_tm1, eval_ob_t], 0).reshape(-1, 64, 64, 3)
+				else:
+					eval_step_ob = self.eval_obs
+				eval_actions, eval_values, _, eval_states, eval_neglogpacs, _, _, _, eval_htp1, _ = self.model.step(eval_step_ob, update_frac, skill_idx=z, one_hot_skill=one_hot_skill, h_tm1=eval_h_tm1)
+				eval_h_tm1 = eval_htp1[:, -1]
 			else:
+				# concat o_t and o_t_m1 for joint step clustering on step function
+				joint_ob_eval = np.concatenate([eval_ob_tm1, eval_ob_t], 0)
 				eval_actions, eval_values, _, eval_states, eval_neglogpacs = self.model.step(joint_ob_eval.reshape(-1,64,64,3), update_frac, skill_idx=z, one_hot_skill=one_hot_skill)
 			self.eval_obs[:], eval_rewards, self.eval_dones, self.eval_infos = self.eval_env.step(eval_actions)
 
@@ -614,12 +601,15 @@ class Runner(AbstractEnvRunner):
 		mb_infos = np.asarray(mb_infos, dtype=np.float32)
 		mb_dones = np.asarray(mb_dones, dtype=np.bool)	
 		mb_pre_codes = np.asarray(mb_pre_codes, dtype=np.float32)
+		# [o_{t-1}, o_t] of the last step
+		joint_ob = mb_obs[[max(self.nsteps - 2, 0), self.nsteps - 1]]
 		last_values = self.model.value(joint_ob.reshape(-1, 64, 64, 3), update_frac, one_hot_skill=one_hot_skill)[0]
 		last_values_i = self.model.value_i(joint_ob.reshape(-1, 64, 64, 3), update_frac, one_hot_skill=one_hot_skill)
 		# compute codes
+		if intrinsic:
+			mb_codes, mb_u_t, mb_z_t_1, mb_h = self.compute_codes(mb_obs, mb_h_online, mb_actions)
 		
 		if intrinsic and Config.HARD_CODES:
-			mb_codes, mb_u_t, mb_z_t_1, mb_h = self.model.compute_codes(np.concatenate([np.expand_dims(mb_obs[0],0),mb_obs],0).reshape(-1, 64, 64, 3),mb_actions)
 			mb_rewards_i = mb_codes.argmax(-1).transpose()
 			# for each observation, find the most likely code/cluster
 			# hard_codes = np.argmax(mb_codes.reshape(-1,Config.N_SKILLS), axis=1)
@@ -631,7 +621,6 @@ class Runner(AbstractEnvRunner):
 			# mb_rewards_i = np.reshape(code_rewards, (256, 32))
 
 		elif intrinsic:
-			mb_codes, mb_u_t, mb_z_t_1, mb_h = self.model.compute_codes(np.concatenate([np.expand_dims(mb_obs[0],0),mb_obs],0).reshape(-1, 64, 64, 3),mb_actions)
 			sess = tf.compat.v1.get_default_session()
 			clusters = sess.run(self.model.train_model.protos).transpose(1,0)
 			nearest_Q_clusters = clusters[mb_codes.argmax(2).reshape(-1)]
@@ -668,6 +657,14 @@ class Runner(AbstractEnvRunner):
 		return (mb_obs, mb_returns, mb_dones, mb_actions, mb_values, mb_pre_codes, *map(sf01, ( mb_values_i, mb_skill, mb_neglogpacs, mb_infos, mb_u_t, mb_z_t_1, mb_codes)),
 			states_nce, anchors_nce, labels_nce, epinfos, eval_epinfos, mb_rewards_i, last_values_i)
 
+	def compute_codes(self, mb_obs, mb_h_online, mb_actions):
+		# the rollout's [o_{t-1}, o_t] pairs start with (o_0, o_0), as on the first step
+		if len(mb_h_online):
+			mb_h_online = np.asarray(mb_h_online, dtype=np.float32)
+			return self.model.compute_latent_codes(np.concatenate([mb_h_online[:1], mb_h_online], 0).reshape(-1, 256), mb_actions)
+		else:
+			return self.model.compute_codes(np.concatenate([np.expand_dims(mb_obs[0],0),mb_obs],0).reshape(-1, 64, 64, 3),mb_actions)
+
 	def compute_intrinsic_returns(self, mb_rewards_i, mb_values_i, last_values_i, mb_dones):
 		mb_returns_i = np.zeros_like(mb_rewards_i)
 		mb_advs_i = np.zeros_like(mb_rewards_i)
@@ -770,6 +767,8 @@ def learn(*, policy, env, eval_env, nsteps, total_timesteps, ent_coef, lr,
 	os.environ["WANDB_API_KEY"] = "02e3820b69de1b1fcc645edcfc3dd5c5079839a1"
 	group_name = "%s__%s__%f" %(Config.ENVIRONMENT,Config.RUN_ID,Config.REP_LOSS_WEIGHT)
 	name = "%s__%s__%f__%d" %(Config.ENVIRONMENT,Config.RUN_ID,Config.REP_LOSS_WEIGHT,np.random.randint(100000000))
+	import wandb
+	from sklearn.metrics import silhouette_score
 	wandb.init(project='procgen_generalization', entity='ssl_rl', config=Config.args_dict, group=group_name, name=name, mode="disabled" if Config.DISABLE_WANDB else "online")
 	PRETRAIN = False
 	BOLZTMANN_PROTO_SKILL_SELECTION = True
@@ -939,6 +938,7 @@ def learn(*, policy, env, eval_env, nsteps, total_timesteps, ent_coef, lr,
 			mpi_print('eprew', rew_mean_10)
 			mpi_print('eprew_eval', eval_rew_mean)
 			mpi_print('fps', fps)
+			sizing.log_memory(tb_writer, step)
 			mpi_print('total_timesteps', update*nbatch)
 			mpi_print([epinfo['r'] for epinfo in epinfobuf10])
 			
@@ -951,7 +951,8 @@ def learn(*, policy, env, eval_env, nsteps, total_timesteps, ent_coef, lr,
 			mb_Q = mb_Q.reshape(-1,Config.N_SKILLS)
 			try:
 				sil_score = silhouette_score(mb_Q,mb_Q.argmax(1))
-			except:
+			except ValueError:
+				# fewer than two clusters among the argmax labels
 				sil_score = 1
 
 			wandb.log({"%s/ep_len_mean"%(Config.ENVIRONMENT): ep_len_mean,
@@ -1,15 +1,11 @@
 """
 This is a copy of PPO from openai/baselines (https://github.com/openai/baselines/blob/52255beda5f5c8760b0ae1f676aa656bb1a61f80/baselines/ppo2/ppo2.py) with some minor changes.
 """
-import wandb
 import time
 import joblib
 import numpy as np
 import tensorflow as tf
 from collections import deque
-import gym3
-from PIL import Image
-import ffmpeg
 import datetime
 
 
@@ -19,9 +15,10 @@ from mpi4py import MPI
 
 from coinrun.tb_utils import TB_Writer
 import coinrun.main_utils as utils
+from coinrun import sizing
 
-from coinrun.train_agent import make_env
 from coinrun.config import Config, count_latent_factors
+from coinrun.models import sinkhorn
 
 mpi_print = utils.mpi_print
 
@@ -36,37 +33,8 @@ from tensorflow.python.ops.ragged.ragged_util import repeat
 
 from random import choice
 
-from sklearn.metrics import silhouette_score, calinski_harabasz_score
-
-
-# k: k parameter for K-nn
-def sinkhorn(scores, temp=0.1, k=3):
-    def remove_infs(x):
-        m = tf.math.reduce_max(x[tf.math.is_inf(x)])
-        casted_x = tf.cast(tf.ones_like(x, dtype=tf.dtypes.float32), tf.float32)
-        max_tensor = tf.math.multiply(casted_x, m)
-        return tf.where(tf.math.is_inf(x), max_tensor, x)
-
-    # set temperature through flag
-    temp = Config.TEMP
-    Q = scores / temp
-    Q -= tf.math.reduce_max(Q)
-
-    Q = tf.transpose(tf.math.exp(Q))
-    Q /= tf.math.reduce_sum(Q)
-
-    r = tf.ones(tf.shape(Q)[0]) / tf.cast(tf.shape(Q)[0], tf.float32)
-    c = tf.ones(tf.shape(Q)[1]) / tf.cast(tf.shape(Q)[1], tf.float32)
-
-    for it in range(k):
-        u = tf.reduce_sum(Q, axis=1)
-        u = tf.cast(u, tf.float32)
-        u = remove_infs(r / u)
-        Q = tf.cast(Q, tf.float32)
-        Q *= tf.expand_dims(u, axis=1)
-        Q *= tf.expand_dims((c / tf.math.reduce_sum(Q, axis=0)), axis=0)
-    Q = Q / tf.math.reduce_sum(Q, axis=0, keepdims=True)
-    return tf.transpose(Q)
+
+
 """
 Intrinsic advantage methods
 """
@@ -122,6 +90,7 @@ def running_stats_fun(run_stats, buf, clip, clip_state):
 
 # helper function to turn numpy array into video file
 def vidwrite(filename, images, framerate=60, vcodec='libx264'):
+    import ffmpeg
     if not isinstance(images, np.ndarray):
         images = np.asarray(images)
     n,height,width,channels = images.shape
@@ -773,6 +742,8 @@ def learn(*, policy, env, eval_env, nsteps, total_timesteps, ent_coef, lr,
     os.environ["WANDB_CONSOLE"] = "off"
     group_name = "%s__%s__%d__%d__%f__%d" %(Config.ENVIRONMENT,Config.RUN_ID,Config.CLUSTER_T,Config.N_KNN, Config.TEMP, Config.N_SKILLS)
     name = "%s__%s__%d__%d__%f__%d__%d" %(Config.ENVIRONMENT,Config.RUN_ID,Config.CLUSTER_T,Config.N_KNN,  Config.TEMP, Config.N_SKILLS, np.random.randint(100000000))
+    import wandb
+    from sklearn.metrics import silhouette_score, calinski_harabasz_score
     wandb.init(project='ising_generalization' if Config.ENVIRONMENT == 'ising' else 'procgen_generalization' , entity='ssl_rl', config=Config.args_dict, group=group_name, name=name, mode="disabled" if Config.DISABLE_WANDB else "online")
     PRETRAIN = False
     BOLZTMANN_PROTO_SKILL_SELECTION = False
@@ -1017,6 +988,7 @@ def learn(*, policy, env, eval_env, nsteps, total_timesteps, ent_coef, lr,
             mpi_print('eprew', rew_mean_10)
             mpi_print('eprew_eval', eval_rew_mean)
             mpi_print('fps', fps)
+            sizing.log_memory(tb_writer, step)
             mpi_print('total_timesteps', update*nbatch)
             mpi_print([epinfo['r'] for epinfo in epinfobuf10])
             
@@ -1030,7 +1002,8 @@ def learn(*, policy, env, eval_env, nsteps, total_timesteps, ent_coef, lr,
             try:
                 sil_score = silhouette_score(mb_Q,mb_Q.argmax(1))
                 ch_score = calinski_harabasz_score(mb_Q,mb_Q.argmax(1))
-            except:
+            except ValueError:
+                # fewer than two clusters among the argmax labels
                 sil_score = 1
                 ch_score = 1
 
@@ -1,15 +1,11 @@
 """
 This is a copy of PPO from openai/baselines (https://github.com/openai/baselines/blob/52255beda5f5c8760b0ae1f676aa656bb1a61f80/baselines/ppo2/ppo2.py) with some minor changes.
 """
-import wandb
 import time
 import joblib
 import numpy as np
 import tensorflow as tf
 from collections import deque
-import gym3
-from PIL import Image
-import ffmpeg
 import datetime
 
 
@@ -19,8 +15,8 @@ from mpi4py import MPI
 
 from coinrun.tb_utils import TB_Writer
 import coinrun.main_utils as utils
+from coinrun import sizing
 
-from coinrun.train_agent import make_env
 from coinrun.config import Config, count_latent_factors
 
 mpi_print = utils.mpi_print
@@ -36,7 +32,6 @@ from tensorflow.python.ops.ragged.ragged_util import repeat
 
 from random import choice
 
-from sklearn.metrics import silhouette_score, calinski_harabasz_score
 
 
 # k: k parameter for K-nn
@@ -120,6 +115,7 @@ def running_stats_fun(run_stats, buf, clip, clip_state):
 
 # helper function to turn numpy array into video file
 def vidwrite(filename, images, framerate=60, vcodec='libx264'):
+    import ffmpeg
     if not isinstance(images, np.ndarray):
         images = np.asarray(images)
     n,height,width,channels = images.shape
@@ -763,6 +759,8 @@ def learn(*, policy, env, eval_env, nsteps, total_timesteps, ent_coef, lr,
     os.environ["WANDB_API_KEY"] = "02e3820b69de1b1fcc645edcfc3dd5c5079839a1"
     group_name = "%s__%s__%f" %(Config.ENVIRONMENT,Config.RUN_ID,Config.REP_LOSS_WEIGHT)
     name = "%s__%s__%f__%d" %(Config.ENVIRONMENT,Config.RUN_ID,Config.REP_LOSS_WEIGHT,np.random.randint(100000000))
+    import wandb
+    from sklearn.metrics import silhouette_score, calinski_harabasz_score
     wandb.init(project='procgen_generalization', entity='ssl_rl', config=Config.args_dict, group=group_name, name=name, mode="disabled" if Config.DISABLE_WANDB else "online")
     PRETRAIN = False
     BOLZTMANN_PROTO_SKILL_SELECTION = False
@@ -985,6 +983,7 @@ def learn(*, policy, env, eval_env, nsteps, total_timesteps, ent_coef, lr,
             mpi_print('eprew', rew_mean_10)
             mpi_print('eprew_eval', eval_rew_mean)
             mpi_print('fps', fps)
+            sizing.log_memory(tb_writer, step)
             mpi_print('total_timesteps', update*nbatch)
             mpi_print([epinfo['r'] for epinfo in epinfobuf10])
             
@@ -998,7 +997,8 @@ def learn(*, policy, env, eval_env, nsteps, total_timesteps, ent_coef, lr,
             try:
                 sil_score = silhouette_score(mb_Q,mb_Q.argmax(1))
                 ch_score = calinski_harabasz_score(mb_Q,mb_Q.argmax(1))
-            except:
+            except ValueError:
+                # fewer than two clusters among the argmax labels
                 sil_score = 1
                 ch_score = 1
 
@@ -0,0 +1,199 @@
+"""
+Int8 post-training quantization of the act model for CPU rollouts.
+
+The frozen act graph (see export_policy.py) is converted with the TFLite
+converter. Conv and dense weights are quantized to int8 and activation ranges
+are calibrated on rollout frames. Sampling happens in NumPy on the dequantized
+logits, so the quantized graph only computes logits and value.
+
+To quantize an exported graph and check it against the fp32 graph:
+python -m coinrun.quantize_policy -frozen myrun.pb
+
+To collect training rollouts with an int8 copy of the policy, re-quantized
+every 10 updates (ppo only, training stays fp32):
+python -m coinrun.train_agent --run-id myrun -quant 10
+"""
+
+import json
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from coinrun import setup_utils, wrappers
+import coinrun.main_utils as utils
+from coinrun.config import Config
+from coinrun.export_policy import add_act_outputs, freeze_act_model, load_frozen_policy
+
+mpi_print = utils.mpi_print
+
+QUANT_OUTPUTS = ['logits', 'value']
+
+def quantize_graph_def(graph_def, input_name, output_names, frames):
+    """
+    Int8 TFLite flatbuffer of a frozen graph, with activation ranges calibrated on `frames`.
+    """
+    def representative_dataset():
+        for frame in frames:
+            yield [frame[None]]
+
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        ob = graph.get_tensor_by_name(input_name + ':0')
+        outputs = [graph.get_tensor_by_name(name + ':0') for name in output_names]
+
+        with tf.compat.v1.Session(graph=graph) as sess:
+            converter = tf.compat.v1.lite.TFLiteConverter.from_session(sess, [ob], outputs)
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.representative_dataset = representative_dataset
+
+            return converter.convert()
+
+def quantize_act_model(sess, act, frames):
+    graph_def, input_name, output_names = freeze_act_model(sess, act, QUANT_OUTPUTS)
+
+    return QuantizedPolicy(quantize_graph_def(graph_def, input_name, output_names, frames))
+
+def quantize_frozen_policy(path, frames):
+    with open(path + '.json') as f:
+        meta = json.load(f)
+
+    graph_def = tf.compat.v1.GraphDef()
+    with open(path, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+
+    return quantize_graph_def(graph_def, meta['input'], meta['outputs'][:len(QUANT_OUTPUTS)], frames)
+
+def sample_actions(logits):
+    """
+    Gumbel-max sample and its negative log-probability, matching the act model's Categorical pd.
+    """
+    u = np.random.uniform(size=logits.shape)
+    actions = np.argmax(logits - np.log(-np.log(u)), axis=-1)
+    logp = logits - logits.max(axis=-1, keepdims=True)
+    logp -= np.log(np.exp(logp).sum(axis=-1, keepdims=True))
+    neglogp = -logp[np.arange(len(actions)), actions]
+
+    return actions, neglogp.astype(np.float32)
+
+class QuantizedPolicy(object):
+    """
+    Runs a quantized act model with the TFLite interpreter. `step` and `value` mirror the act model.
+    """
+    def __init__(self, model_content):
+        self.model_content = model_content
+        self.interpreter = tf.lite.Interpreter(model_content=model_content)
+        input_details = self.interpreter.get_input_details()[0]
+        self.input_index = input_details['index']
+        self.input_dtype = input_details['dtype']
+        self.output_indices = [d['index'] for d in self.interpreter.get_output_details()]
+        self.batch_size = None
+        self.initial_state = None
+
+    def _run(self, ob):
+        if len(ob) != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input_index, [len(ob)] + list(ob.shape[1:]))
+            self.interpreter.allocate_tensors()
+            self.batch_size = len(ob)
+
+        self.interpreter.set_tensor(self.input_index, ob.astype(self.input_dtype, copy=False))
+        self.interpreter.invoke()
+        logits, value = [self.interpreter.get_tensor(i) for i in self.output_indices]
+
+        return logits, value
+
+    def action_logits(self, ob):
+        return self._run(ob)[0]
+
+    def step(self, ob, *_args, **_kwargs):
+        logits, v = self._run(ob)
+        a, neglogp = sample_actions(logits)
+        return a, v, self.initial_state, neglogp
+
+    def value(self, ob, *_args, **_kwargs):
+        return [self._run(ob)[1]]
+
+class ActModelReference(object):
+    """
+    The fp32 act model behind the interface `check_accuracy` expects.
+    """
+    def __init__(self, sess, act):
+        self.sess = sess
+        self.X = act.X
+        self.logits, self.vf, self.action = add_act_outputs(act)
+        self.initial_state = None
+
+    def step(self, ob, *_args, **_kwargs):
+        a, v = self.sess.run([self.action, self.vf], {self.X: ob})
+        return a, v, self.initial_state, None
+
+    def action_logits(self, ob):
+        return self.sess.run(self.logits, {self.X: ob})
+
+    def value(self, ob, *_args, **_kwargs):
+        return [self.sess.run(self.vf, {self.X: ob})]
+
+def check_accuracy(reference, quantized, frames, batch_size=32):
+    """
+    Greedy action agreement and value error of `quantized` against `reference` on `frames`.
+    """
+    agree = []
+    value_err = []
+
+    for start in range(0, len(frames), batch_size):
+        ob = frames[start:start + batch_size]
+        agree.append(np.argmax(reference.action_logits(ob), -1) == np.argmax(quantized.action_logits(ob), -1))
+        value_err.append(np.abs(reference.value(ob)[0] - quantized.value(ob)[0]))
+
+    value_err = np.concatenate(value_err)
+
+    return {'action_agreement': float(np.mean(np.concatenate(agree))),
+            'value_mae': float(np.mean(value_err)),
+            'value_max_err': float(np.max(value_err))}
+
+def step_latency(policy, ob, repeats=50):
+    policy.step(ob)
+    tstart = time.perf_counter()
+    for _ in range(repeats):
+        policy.step(ob)
+
+    return (time.perf_counter() - tstart) / repeats
+
+def collect_frames(policy, env, nframes):
+    frames = []
+    obs = env.reset()
+
+    while len(frames) * env.num_envs < nframes:
+        frames.append(obs.copy())
+        actions, _, _, _ = policy.step(obs)
+        obs, _, _, _ = env.step(actions)
+
+    return np.concatenate(frames)[:nframes]
+
+def main():
+    setup_utils.setup_and_load()
+    assert Config.FROZEN_POLICY is not None, 'pass the exported graph with -frozen'
+
+    fp32 = load_frozen_policy(Config.FROZEN_POLICY)
+    env = wrappers.add_final_wrappers(utils.make_general_env(Config.NUM_EVAL))
+    frames = collect_frames(fp32, env, 2 * Config.QUANT_CALIB_FRAMES)
+    env.close()
+
+    calib, held_out = frames[:Config.QUANT_CALIB_FRAMES], frames[Config.QUANT_CALIB_FRAMES:]
+    model_content = quantize_frozen_policy(Config.FROZEN_POLICY, calib)
+    int8 = QuantizedPolicy(model_content)
+
+    out_path = Config.FROZEN_POLICY + '.tflite'
+    with open(out_path, 'wb') as f:
+        f.write(model_content)
+    mpi_print('wrote', out_path, '%.2f MB' % (len(model_content) / 2 ** 20))
+
+    for key, val in sorted(check_accuracy(fp32, int8, held_out).items()):
+        mpi_print(key, val)
+
+    ob = held_out[:Config.NUM_ENVS]
+    mpi_print('fp32_step_s', step_latency(fp32, ob))
+    mpi_print('int8_step_s', step_latency(int8, ob))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Host memory of the rollout and train buffers, estimated from Config before anything is allocated.
+
+The peak is at the end of `Runner.run`: the stacked rollout arrays, their sf01
+flattened copies and the previous update's batch, which `learn` still holds
+while the next rollout runs, are all alive at once. With the representation
+loss the NCE states dominate, one [M, envs, 64, 64, 3] probe rollout every
+NCE_UPDATE_FREQ steps, converted to float32.
+
+train_agent checks the estimate against Config.MEM_BUDGET before building the
+envs, and the learners log the live and peak RSS of each rank every update.
+"""
+
+import os
+import resource
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from coinrun.config import Config
+
+GB = 2 ** 30
+MB = 2 ** 20
+
+FRAME_SHAPE = (64, 64, 3)
+# Runner.nce_update_freq
+NCE_UPDATE_FREQ = 8
+# runners that collect NCE probe rollouts when Config.CUSTOM_REP_LOSS is set
+NCE_AGENTS = ['ppo', 'ppo_curl', 'ppo_bisimulation']
+
+Buffer = namedtuple('Buffer', ['name', 'shape', 'itemsize', 'copies'])
+
+def buffer_bytes(buf):
+    return int(np.prod(buf.shape)) * buf.itemsize * buf.copies
+
+def uses_nce():
+    return Config.CUSTOM_REP_LOSS and Config.AGENT in NCE_AGENTS
+
+def buffers(num_envs=None, num_steps=None, num_minibatches=None):
+    """
+    Buffers alive together in each phase of an update, as an OrderedDict of phase name to Buffer list.
+    Shapes are per rank. Arguments default to their Config values.
+    """
+    envs = Config.NUM_ENVS if num_envs is None else num_envs
+    nsteps = Config.NUM_STEPS if num_steps is None else num_steps
+    nminibatches = Config.NUM_MINIBATCHES if num_minibatches is None else num_minibatches
+
+    # procgen frames are never stacked (Config.FRAME_STACK only applies to the native CoinRun env).
+    # Runner observations are float32, raw frames from the env stay uint8
+    obs_shape = FRAME_SHAPE
+    frame_itemsize = 1
+    heads = Config.POLICY_NHEADS if Config.CUSTOM_REP_LOSS else 1
+    # rewards, actions, values per head, dones, neglogpacs
+    scalar_itemsize = 4 + 8 + 4 * heads + 1 + 4
+    nbatch_train = nsteps * envs // nminibatches
+
+    rollout = [Buffer('mb_obs', (nsteps, envs) + obs_shape, 4, 3),
+               Buffer('mb_scalars', (nsteps, envs), scalar_itemsize, 3)]
+    train = [Buffer('obs', (nsteps * envs,) + obs_shape, 4, 1),
+             Buffer('scalars', (nsteps * envs,), scalar_itemsize, 1),
+             Buffer('minibatch_obs', (nbatch_train,) + obs_shape, 4, 1)]
+
+    if uses_nce():
+        nce_steps = -(-nsteps // NCE_UPDATE_FREQ)
+        nce_shape = (nce_steps, Config.REP_LOSS_M, 1, envs) + obs_shape
+        nbatch_nce = nbatch_train // NCE_UPDATE_FREQ
+
+        rollout += [Buffer('probe_states', (Config.REP_LOSS_M, envs) + obs_shape, frame_itemsize, 2),
+                    Buffer('mb_states_nce', nce_shape, 4, 3),
+                    Buffer('mb_anchors_nce', (nce_steps, envs) + obs_shape, 4, 3)]
+        # the minibatch is sliced, then transposed into a new array when fed
+        train += [Buffer('states_nce', nce_shape, 4, 1),
+                  Buffer('anchors_nce', (nce_steps, envs) + obs_shape, 4, 1),
+                  Buffer('minibatch_states_nce', (nbatch_nce, Config.REP_LOSS_M, 1) + obs_shape, 4, 2),
+                  Buffer('minibatch_anchors_nce', (nbatch_nce,) + obs_shape, 4, 1)]
+
+    return OrderedDict([('rollout', rollout), ('train', train)])
+
+def peak_bytes(num_envs=None, num_steps=None, num_minibatches=None):
+    phases = buffers(num_envs, num_steps, num_minibatches)
+
+    return max(sum(buffer_bytes(buf) for buf in bufs) for bufs in phases.values())
+
+def host_memory():
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+def budget_bytes():
+    """
+    Config.MEM_BUDGET in bytes, by default 80% of host memory split between the ranks on this host.
+    """
+    if Config.MEM_BUDGET is not None:
+        return Config.MEM_BUDGET * GB
+
+    from coinrun import placement
+    return 0.8 * host_memory() / placement.get_placement().local_size
+
+def print_breakdown(phases, budget):
+    for phase, bufs in phases.items():
+        for buf in bufs:
+            print('%-8s %-22s %-32s x%d %10.1f MB' % (phase, buf.name, buf.shape, buf.copies, buffer_bytes(buf) / MB))
+        print('%-8s %-22s %-32s %3s %10.1f MB' % (phase, 'total', '', '', sum(buffer_bytes(buf) for buf in bufs) / MB))
+
+    print('peak %.2f GB per rank, budget %.2f GB' % (peak_bytes() / GB, budget / GB))
+
+def check_budget():
+    """
+    Prints the buffer breakdown and raises MemoryError if the peak is over budget, before anything is allocated.
+    """
+    from mpi4py import MPI
+
+    budget = budget_bytes()
+    peak = peak_bytes()
+
+    if MPI.COMM_WORLD.Get_rank() == 0:
+        print_breakdown(buffers(), budget)
+
+    if budget > 0 and peak > budget:
+        raise MemoryError('rollout and train buffers peak at %.2f GB per rank, over the %.2f GB budget (-mem). '
+                          'Lower -ne, -ns or -m, or raise -mem.' % (peak / GB, budget / GB))
+
+def memory_stats():
+    """
+    Resident and peak resident bytes of this process.
+    """
+    with open('/proc/self/statm') as f:
+        rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    return {'rss': rss, 'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+def log_memory(tb_writer, step):
+    """
+    Logs this rank's live and peak RSS in MB to tensorboard, and prints them on rank 0.
+    """
+    from mpi4py import MPI
+
+    mem = memory_stats()
+    for name, key in [('rss_mb', 'rss'), ('peak_rss_mb', 'peak_rss')]:
+        tb_writer.log_scalar(mem[key] / MB, name, step=step)
+        if MPI.COMM_WORLD.Get_rank() == 0:
+            print(name, mem[key] / MB)
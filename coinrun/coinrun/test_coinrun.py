@@ -1,8 +1,33 @@
-from coinrun import random_agent
+import numpy as np
+
+from coinrun import random_agent, setup_utils, make
 
 def test_coinrun():
     random_agent.random_agent(num_envs=16, max_steps=100)
 
+def make_stepped_env(num_envs=16, steps=50):
+    setup_utils.setup_and_load(use_cmd_line_args=False)
+    env = make('standard', num_envs=num_envs)
+    rng = np.random.RandomState(0)
+    for _ in range(steps):
+        env.step(rng.randint(env.action_space.n, size=num_envs).astype(np.int32))
+    return env
+
+def test_software_render_matches_qt():
+    env = make_stepped_env()
+    qt = env.render_obs('qt').astype(np.int32)
+    sw = env.render_obs('software').astype(np.int32)
+    env.close()
+
+    # Qt antialiases sprites at fractional positions where the software renderer blits at
+    # integer ones, so each pixel is compared against the Qt pixels within one pixel of it
+    h, w = qt.shape[1:3]
+    padded = np.pad(qt, [(0, 0), (1, 1), (1, 1), (0, 0)], mode='edge')
+    diff = np.min([np.abs(padded[:, dy:dy + h, dx:dx + w] - sw).max(axis=-1) for dy in range(3) for dx in range(3)], axis=0)
+
+    assert diff.mean() < 1
+    assert np.mean(diff > 8) < 0.002
+
 
 if __name__ == '__main__':
-    test_coinrun()
\ No newline at end of file
+    test_coinrun()
@@ -0,0 +1,180 @@
+import os
+import threading
+
+import numpy as np
+
+from coinrun import ising_env
+from coinrun.ising_env import GoalBank, Ising, IsingEnv, IsingGym3Env, acceptance_table, FLIP_COSTS
+
+def equilibrium_stats(method, beta, ordered_start, N=16, burn_in=200, sweeps=400, seed=0):
+    np.random.seed(seed)
+    model = Ising(beta=beta, N=N, method=method)
+    model.reset()
+    if ordered_start:
+        # avoids the long-lived stripe states a quench can get stuck in
+        model.config[...] = 1
+    model.simulate_n(burn_in)
+
+    mags, energies = [], []
+    for _ in range(sweeps):
+        model.simulate_n(1)
+        mags.append(abs(model.magnetization()))
+        energies.append(model.energy())
+
+    return np.mean(mags), np.mean(energies)
+
+def test_acceptance_table():
+    table = acceptance_table(np.array([0.1, 0.3]))
+    assert table.shape == (2, len(FLIP_COSTS))
+    np.testing.assert_allclose(table[:, :3], 1)
+    np.testing.assert_allclose(table[1, 3:], np.exp(-0.3 * np.array([4, 8])))
+
+def test_checkerboard_matches_random_updates():
+    # disordered and ordered side of beta_c ~ 0.44
+    for beta, ordered_start in [(0.25, False), (0.6, True)]:
+        m_random, e_random = equilibrium_stats('random', beta, ordered_start)
+        m_checker, e_checker = equilibrium_stats('checkerboard', beta, ordered_start)
+
+        assert abs(m_random - m_checker) < 0.05
+        assert abs(e_random - e_checker) < 0.05
+
+def test_checkerboard_keeps_spins():
+    model = Ising(beta=0.2, N=8)
+    config = model.reset()
+    model.simulate_n(5)
+    assert model.config is config
+    assert set(np.unique(config)) <= {-1, 1}
+
+def observed_overlaps(lazy, actions, replicas=30, seed=0):
+    """
+    Overlap of the last observed path with its configuration at reset.
+    """
+    np.random.seed(seed)
+    path = actions[-1]
+    overlaps = []
+    for _ in range(replicas):
+        env = IsingEnv(T=len(actions) + 1, k=3, lazy=lazy)
+        initial = env.models[path].config.copy()
+        for a in actions:
+            env.step(a)
+        overlaps.append((env.models[path].config * initial).mean())
+
+    return np.array(overlaps)
+
+def test_lazy_paths_match_eager():
+    # path 0 has beta ~ 0, where most spins flip every sweep, so the sign of the
+    # overlap gives away the parity of the number of sweeps it went through
+    actions = [1, 0, 2, 2, 0]
+    eager = observed_overlaps(False, actions)
+    lazy = observed_overlaps(True, actions, seed=1)
+
+    assert eager.mean() < -0.5
+    stderr = np.sqrt(eager.var() / len(eager) + lazy.var() / len(lazy))
+    assert abs(eager.mean() - lazy.mean()) < 4 * stderr
+
+def assert_same_envs(env, other):
+    for name in ['spins', 'goals', 'goal_betas', 'current_path', 't', 'pending']:
+        np.testing.assert_array_equal(getattr(env, name), getattr(other, name))
+
+def test_gym3_state_round_trip():
+    # k * N * N + N * N is not a multiple of 8, so the float and int counters are unaligned
+    np.random.seed(0)
+    env = IsingGym3Env(num=3, T=20, k=2, N=6, lazy=True)
+    for a in [0, 1, 1]:
+        env.act(np.full(3, a))
+    assert env.pending.any()
+
+    states = env.get_state()
+    restored = IsingGym3Env(num=3, T=20, k=2, N=6, lazy=True)
+    restored.set_state(states)
+    assert_same_envs(env, restored)
+
+    for target in [env, restored]:
+        np.random.seed(1)
+        for a in [2, 0, 1]:
+            target.act(np.array([a % 2, 1, 0]))
+    assert_same_envs(env, restored)
+    np.testing.assert_array_equal(env.observe()[0], restored.observe()[0])
+
+def test_gym3_resets_each_env_at_T():
+    np.random.seed(0)
+    env = IsingGym3Env(num=3, T=4, k=2, N=8)
+    env.t[:] = [3, 1, 0]
+    goals = env.goals.copy()
+
+    env.act(np.zeros(3))
+    np.testing.assert_array_equal(env.observe()[2], [True, False, False])
+    np.testing.assert_array_equal(env.t, [0, 2, 1])
+    assert (env.goals[0] != goals[0]).any()
+    np.testing.assert_array_equal(env.goals[1:], goals[1:])
+
+    env.act(np.zeros(3))
+    env.act(np.zeros(3))
+    np.testing.assert_array_equal(env.observe()[2], [False, True, False])
+    np.testing.assert_array_equal(env.t, [2, 0, 3])
+
+def test_gym3_batched_sweep_matches_ising():
+    np.random.seed(0)
+    N, burn_in, sweeps = 16, 200, 100
+    env = IsingGym3Env(num=8, T=burn_in + sweeps + 1, k=2, N=N)
+    model = Ising(N=N)
+    for _ in range(burn_in):
+        env.act(np.zeros(env.num))
+
+    mags, energies = [[] for _ in env.betas], [[] for _ in env.betas]
+    for _ in range(sweeps):
+        env.act(np.zeros(env.num))
+        for path in range(env.k):
+            for spins in env.spins[:, path]:
+                model.config = spins.astype(np.int64)
+                mags[path].append(abs(model.magnetization()))
+                energies[path].append(model.energy())
+
+    for path, beta in enumerate(env.betas):
+        m_single, e_single = equilibrium_stats('checkerboard', beta, False, N=N)
+        assert abs(np.mean(mags[path]) - m_single) < 0.05
+        assert abs(np.mean(energies[path]) - e_single) < 0.05
+
+def test_goal_bank_persists_and_reuses(tmp_path):
+    path = str(tmp_path / 'goals')
+    bank = GoalBank(size=8, N=4, max_t=3, chunk=3, path=path, seed=0)
+    bank.thread.join()
+    assert bank.filled == 8
+    assert os.path.exists(path + '.configs.npy') and os.path.exists(path + '.params.npy')
+    assert not os.path.exists(path + '.configs.npy.partial')
+
+    reused = GoalBank(size=8, N=4, max_t=3, path=path)
+    assert reused.filled == 8 and reused.thread is None
+    np.testing.assert_array_equal(reused.configs, bank.configs)
+    np.testing.assert_array_equal(reused.params, bank.params)
+
+def test_goal_bank_sample_waits_for_first_chunk(monkeypatch):
+    release = threading.Event()
+    generate_goals = ising_env.generate_goals
+    def held_generate_goals(*args):
+        release.wait()
+        return generate_goals(*args)
+    monkeypatch.setattr(ising_env, 'generate_goals', held_generate_goals)
+
+    bank = GoalBank(size=8, N=4, max_t=3, chunk=4, seed=0)
+    samples = []
+    sampler = threading.Thread(target=lambda: samples.append(bank.sample(2)))
+    sampler.start()
+    sampler.join(0.2)
+    assert sampler.is_alive() and bank.filled == 0
+
+    release.set()
+    sampler.join(5)
+    assert not sampler.is_alive()
+    betas, configs = samples[0]
+    assert betas.shape == (2,) and configs.shape == (2, 4, 4)
+    bank.close()
+
+def test_goal_bank_close_joins_refresh_thread():
+    bank = GoalBank(size=4, N=4, max_t=3, chunk=4, refresh=True, refresh_interval=60, seed=0)
+    bank.sample(1)
+    bank.close()
+    assert not bank.thread.is_alive()
+
+if __name__ == '__main__':
+    test_checkerboard_matches_random_updates()
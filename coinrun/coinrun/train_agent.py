@@ -33,6 +33,9 @@ python3 -m coinrun.train_agent --env coinrun --run-id goal --num-levels 0 --shor
 RND:
 python3 -m coinrun.train_agent --env coinrun --run-id rnd --num-levels 0 --short --agent ppo_rnd
 
+To see where the time goes before the first env step (imports, config, envs, agent, graph):
+python3 -m coinrun.train_agent --env coinrun --run-id baseline --num-levels 0 --short --profile-startup
+
 # to change the distribution mode of the first and second phase:
 -phase1 exploration -phase2 hard
 -phase1 hard -phase2 exploration
@@ -64,10 +67,12 @@ GS envs: bigfish leaper starpilot plunder
 
 python jobs_launcher.py --agent ppo_goal_bogdan --env bigfish leaper starpilot plunder  --nheads 200  --run_ID bogdan_smarterMYOW --n_knn 1 3 --cluster_T 10
 """
+import time
+STARTUP_TSTART = time.time()
 print('Importing packages')
 import os
+import importlib
 import copy
-import time
 import numpy as np
 from mpi4py import MPI
 import tensorflow as tf
@@ -76,36 +81,38 @@ from baselines.bench.monitor import ResultsWriter
 print('Imported baselines')
 from collections import deque
 import coinrun.main_utils as utils
-from coinrun import setup_utils, wrappers
+from coinrun import placement, setup_utils, sizing, wrappers
 from coinrun.config import Config
 from abc import ABC, abstractmethod
 from typing import Any, Dict, List, Sequence, Tuple
-from gym3.types import (
-    DictType,
-    Discrete,
-    Real,
-    TensorType,
-    ValType,
-    multimap,
-    INTEGER_DTYPE_NAMES,
-    FLOAT_DTYPE_NAMES,
-)
 print('Imported coinrun')
-from baselines.common.mpi_util import setup_mpi_gpus
 from gym.spaces import Box, Dict, Discrete as DiscreteG
-from procgen import ProcgenGym3Env
-from procgen import ProcgenEnv
-print('Imported procgen')
 
 from baselines.common.vec_env import (
     VecExtractDictObs,
-    VecFrameStack,
     VecNormalize,
     VecEnvWrapper
 )
 
 mpi_print = utils.mpi_print
 
+# (phase, time) marks since STARTUP_TSTART, reported at the first env step with --profile-startup
+startup_marks = [('imports', time.time())]
+
+def mark_startup(phase):
+    startup_marks.append((phase, time.time()))
+
+def mark_first_env_step():
+    if startup_marks[-1][0] == 'first env step':
+        return
+
+    mark_startup('first env step')
+    last = STARTUP_TSTART
+    mpi_print('startup profile: %-16s %8s %8s' % ('phase', 'secs', 'total'))
+    for phase, t in startup_marks:
+        mpi_print('startup profile: %-16s %8.2f %8.2f' % (phase, t - last, t - STARTUP_TSTART))
+        last = t
+
 import sys
 
 # defined vec_monitor here for modiciations 12/17/2020
@@ -160,8 +167,9 @@ class VecMonitor(VecEnvWrapper):
         return obs, rews, dones, newinfos
 
 # MOD
-def _vt2space(vt: ValType):
+def _vt2space(vt: "ValType"):
     from gym import spaces
+    from gym3.types import Discrete, Real, TensorType, ValType
 
     def tt2space(tt: TensorType):
         if isinstance(tt.eltype, Discrete):
@@ -214,6 +222,8 @@ class FakeEnv:
 
     def step_wait(self):
         rew, ob, first = self.env.observe()
+        if Config.PROFILE_STARTUP:
+            mark_first_env_step()
         return ob, rew, first, self.env.get_info()
 
     def step(self, ac):
@@ -233,7 +243,8 @@ class FakeEnv:
             return info["rgb"]
 
     def close(self):
-        pass
+        if hasattr(self.env, "close"):
+            self.env.close()
     
     # added this in to see if it'll properly call the method for the gym3 object
     def callmethod(
@@ -243,55 +254,103 @@ class FakeEnv:
 # end mod
 
 
-# helper function to make env
-def make_env(steps_per_env):
+def make_gym3_env(**kwargs):
+    """
+    ProcgenGym3Env, or the deterministic NumPy stand-in from coinrun.bench when Config.BENCH_ENV is set.
+    """
+    if Config.BENCH_ENV:
+        from coinrun.bench.standin_env import StandInGym3Env
+        return StandInGym3Env(**kwargs)
+
+    from procgen import ProcgenGym3Env
+    kwargs.setdefault('num_threads', placement.get_placement().env_threads)
+    return ProcgenGym3Env(**kwargs)
+
+def make_phase_env(distribution_mode, num_levels=None):
+    """
+    Baselines VecEnv of one training phase. `num_levels` defaults to Config.NUM_LEVELS, except
+    in exploration mode, which always uses its fixed levels.
+    """
     observation_space = Dict(rgb=Box(shape=(64,64,3),low=0,high=255))
     action_space = DiscreteG(15)
-    if Config.FIRST_PHASE == 'exploration':
-        # baseline_vec_train = ProcgenEnv(num_envs=Config.NUM_ENVS, env_name=Config.ENVIRONMENT, paint_vel_info=Config.PAINT_VEL_INFO, distribution_mode=Config.FIRST_PHASE)
-        gym3_env_train = ProcgenGym3Env(num=Config.NUM_ENVS, env_name=Config.ENVIRONMENT, paint_vel_info=Config.PAINT_VEL_INFO, distribution_mode=Config.FIRST_PHASE)
-    else:
-        # baseline_vec_train = ProcgenEnv(num_envs=Config.NUM_ENVS, env_name=Config.ENVIRONMENT, num_levels=Config.NUM_LEVELS, paint_vel_info=Config.PAINT_VEL_INFO, distribution_mode=Config.FIRST_PHASE)
-        gym3_env_train = ProcgenGym3Env(num=Config.NUM_ENVS, env_name=Config.ENVIRONMENT, num_levels=Config.NUM_LEVELS, paint_vel_info=Config.PAINT_VEL_INFO, distribution_mode=Config.FIRST_PHASE)
-    if Config.SECOND_PHASE == 'exploration':
-        # baseline_vec_adapt = ProcgenEnv(num_envs=Config.NUM_ENVS, env_name=Config.ENVIRONMENT,  paint_vel_info=Config.PAINT_VEL_INFO, distribution_mode=Config.SECOND_PHASE)
-        gym3_env_adapt = ProcgenGym3Env(num=Config.NUM_ENVS, env_name=Config.ENVIRONMENT,  paint_vel_info=Config.PAINT_VEL_INFO, distribution_mode=Config.SECOND_PHASE)
-    elif Config.SECOND_PHASE != "None":
-        # baseline_vec_adapt = ProcgenEnv(num_envs=Config.NUM_ENVS, env_name=Config.ENVIRONMENT, num_levels=Config.NUM_LEVELS, paint_vel_info=Config.PAINT_VEL_INFO, distribution_mode=Config.SECOND_PHASE)
-        gym3_env_adapt = ProcgenGym3Env(num=Config.NUM_ENVS, env_name=Config.ENVIRONMENT, num_levels=Config.NUM_LEVELS, paint_vel_info=Config.PAINT_VEL_INFO, distribution_mode=Config.SECOND_PHASE)
-    else:
-        baseline_vec_adapt = gym3_env_adapt = None
-    
-    venv_train = FakeEnv(gym3_env_train, observation_space, action_space)
-    venv_train = VecExtractDictObs(venv_train, "rgb")
-    if Config.SECOND_PHASE != "None":
-        venv_adapt = FakeEnv(gym3_env_adapt, observation_space, action_space)   
-        venv_adapt = VecExtractDictObs(venv_adapt, "rgb")
-    venv_train = VecMonitor(
-        venv=venv_train, filename=None, keep_buf=100,
+    env_kwargs = dict(num=Config.NUM_ENVS, env_name=Config.ENVIRONMENT, paint_vel_info=Config.PAINT_VEL_INFO, distribution_mode=distribution_mode)
+    if num_levels is not None:
+        env_kwargs['num_levels'] = num_levels
+    elif distribution_mode != 'exploration':
+        env_kwargs['num_levels'] = Config.NUM_LEVELS
+
+    venv = FakeEnv(make_gym3_env(**env_kwargs), observation_space, action_space)
+    venv = VecExtractDictObs(venv, "rgb")
+    venv = VecMonitor(
+        venv=venv, filename=None, keep_buf=100,
     )
-    if Config.SECOND_PHASE != "None":
-        venv_adapt = VecMonitor(
-            venv=venv_adapt, filename=None, keep_buf=100,
-        )
+    venv = VecNormalize(venv=venv, ob=False)
+    venv = wrappers.add_final_wrappers(venv)
+
+    return venv
 
-    venv_train = VecNormalize(venv=venv_train, ob=False)
-    venv_train = wrappers.add_final_wrappers(venv_train)
+def phase_env_fns():
+    phases = [Config.FIRST_PHASE]
     if Config.SECOND_PHASE != "None":
-        venv_adapt = VecNormalize(venv=venv_adapt, ob=False)
-        venv_adapt = wrappers.add_final_wrappers(venv_adapt)
+        phases.append(Config.SECOND_PHASE)
 
-        venv = wrappers.DistributionShiftWrapperVec(env_list=[venv_train, venv_adapt], steps_per_env=steps_per_env) 
+    return [lambda mode=mode: make_phase_env(mode) for mode in phases]
+
+# helper function to make env
+def make_env(steps_per_env):
+    """
+    Training env. With a second phase, only the active phase's procgen env exists at a time,
+    the next one is built when DistributionShiftWrapperVec switches to it.
+    """
+    env_fns = phase_env_fns()
+    if len(env_fns) > 1:
+        venv = wrappers.DistributionShiftWrapperVec(env_list=env_fns, steps_per_env=steps_per_env)
+        venv_train = venv.env
     else:
-        venv = venv_train
-        venv_adapt = venv_train = None
+        venv = env_fns[0]()
+        venv_train = None
         venv.current_env_steps_left = steps_per_env
 
-    return venv, venv_train, venv_adapt
+    # the adapt env doesn't exist until the switch
+    return venv, venv_train, None
+
+def make_probe_env(venv):
+    """
+    Copy of the active phase of training env `venv` for rollouts from restored states, built on first use.
+    """
+    if isinstance(venv, wrappers.DistributionShiftWrapperVec):
+        return wrappers.PhaseProbeVec(venv.env_fns, lambda: venv.current_env_idx)
+
+    return wrappers.PhaseProbeVec(phase_env_fns(), lambda: 0)
+
+def make_eval_env():
+    return make_phase_env(Config.FIRST_PHASE, num_levels=0)
+
+# Config.AGENT -> (learner module, policies module)
+AGENT_MODULES = {
+    'ppo': ('ppo2', 'policies'),
+    'ppo_rnd': ('ppo2_rnd', 'policies'),
+    'ppo_diayn': ('ppo2_diayn', 'policies'),
+    'ppg': ('ppo2_ppg', 'policies'),
+    'ppg_ssl': ('ppo2_ppg_ssl', 'policies'),
+    'ppo_goal': ('ppo2_goal', 'policies'),
+    'ppo_curl': ('ppo2_curl', 'policies'),
+    'ppo_goal_bogdan': ('ppo2_goal_bogdan', 'policies_bogdan'),
+    'ppg_cluster': ('ppo2_ppg_sinkhorn', 'policies_ppg_sinkhorn'),
+    'ppo_bisimulation': ('ppo2_bisimulation', 'policies_bisimulation'),
+}
+
+def import_agent(agent_name):
+    agent_module, policies_module = AGENT_MODULES[agent_name]
+    agent = importlib.import_module('coinrun.' + agent_module)
+    policies = importlib.import_module('coinrun.' + policies_module)
+
+    return agent, policies
 
 def main():
     print('Parsing args')
     args = setup_utils.setup_and_load()
+    mark_startup('config')
     print('Setting up MPI')
     comm = MPI.COMM_WORLD
     rank = comm.Get_rank()
@@ -308,6 +367,7 @@ def main():
     
     config = tf.compat.v1.ConfigProto()
     config.gpu_options.allow_growth = True # pylint: disable=E1101
+    placement.configure_tf(config)
     
     total_timesteps = int(160e6)
     if Config.LONG_TRAINING:
@@ -322,21 +382,14 @@ def main():
     #print (env)
 
     mpi_print(Config.ENVIRONMENT)
+    sizing.check_budget()
     venv, venv_train, venv_adapt = make_env(total_timesteps//2) #switch "easy" -> "exploration" halfway
     # import ipdb;ipdb.set_trace()
     observation_space = Dict(rgb=Box(shape=(64,64,3),low=0,high=255))
     action_space = DiscreteG(15)
     
-    # baseline_vec_eval = ProcgenEnv(num_envs=Config.NUM_ENVS, env_name=Config.ENVIRONMENT, num_levels=0, paint_vel_info=Config.PAINT_VEL_INFO, distribution_mode=Config.FIRST_PHASE)
-    gym3_env_eval = ProcgenGym3Env(num=Config.NUM_ENVS, env_name=Config.ENVIRONMENT, num_levels=0, paint_vel_info=Config.PAINT_VEL_INFO, distribution_mode=Config.FIRST_PHASE)
-
-    venv_eval = FakeEnv(gym3_env_eval, observation_space, action_space)
-    venv_eval = VecExtractDictObs(venv_eval, "rgb")
-    venv_eval = VecMonitor(
-        venv=venv_eval, filename=None, keep_buf=100,
-    )
-    venv_eval = VecNormalize(venv=venv_eval, ob=False)
-    venv_eval = wrappers.add_final_wrappers(venv_eval)
+    venv_eval = make_eval_env()
+    mark_startup('envs')
 
     
     with tf.compat.v1.Session(config=config) as sess:
@@ -345,38 +398,11 @@ def main():
 
         #sess.run(tf.compat.v1.global_variables_initializer())
         
-        if Config.AGENT == 'ppo':
-            from coinrun import ppo2 as agent
-            from coinrun import policies
-        elif Config.AGENT == 'ppo_rnd':
-            from coinrun import ppo2_rnd as agent
-            from coinrun import policies
-        elif Config.AGENT == 'ppo_diayn':
-            from coinrun import ppo2_diayn as agent
-            from coinrun import policies
-        elif Config.AGENT == 'ppg':
-            from coinrun import ppo2_ppg as agent
-            from coinrun import policies
-        elif Config.AGENT == 'ppg_ssl':
-            from coinrun import ppo2_ppg_ssl as agent
-            from coinrun import policies
-        elif Config.AGENT == 'ppo_goal':
-            from coinrun import ppo2_goal as agent
-            from coinrun import policies
-        elif Config.AGENT == 'ppo_curl':
-            from coinrun import ppo2_curl as agent
-            from coinrun import policies
-        elif Config.AGENT == 'ppo_goal_bogdan':
-            from coinrun import ppo2_goal_bogdan as agent
-            from coinrun import policies_bogdan as policies
-        elif Config.AGENT == 'ppg_cluster':
-            from coinrun import ppo2_ppg_sinkhorn as agent
-            from coinrun import policies_ppg_sinkhorn as policies
-        elif Config.AGENT == 'ppo_bisimulation':
-            from coinrun import ppo2_bisimulation as agent
-            from coinrun import policies_bisimulation as policies
+        agent, policies = import_agent(Config.AGENT)
         policy = policies.get_policy()
+        mark_startup('agent import')
 
+        mark_startup('graph build')
         agent.learn(policy=policy,
                     env=venv,
                     eval_env=venv_eval,
@@ -393,5 +419,7 @@ def main():
                     total_timesteps=total_timesteps)
 
 if __name__ == '__main__':
+    # learners import make_env from coinrun.train_agent, don't execute this module a second time for them
+    sys.modules.setdefault('coinrun.train_agent', sys.modules[__name__])
     main()
 
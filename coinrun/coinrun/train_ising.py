@@ -1,5 +1,5 @@
 """
-python3 -m coinrun.train_ising --run-id goal --num-levels 0 --short --agent ppo_goal_bogdan -gpu 1 -n_skills 5 --ema --myow --num-envs 1 -disable_wandb 0 -env ising -cluster_t 2
+python3 -m coinrun.train_ising --run-id goal --num-levels 0 --short --agent ppo_goal_bogdan -gpu 1 -n_skills 5 --ema --myow --num-envs 32 -disable_wandb 0 -env ising -cluster_t 2
 """
 print('Importing packages')
 import os
@@ -13,30 +13,15 @@ from baselines.bench.monitor import ResultsWriter
 print('Imported baselines')
 from collections import deque
 import coinrun.main_utils as utils
-from coinrun import setup_utils, wrappers
+from coinrun import placement, setup_utils, wrappers
 from coinrun.config import Config
 from abc import ABC, abstractmethod
 from typing import Any, Dict, List, Sequence, Tuple
-from gym3.types import (
-    DictType,
-    Discrete,
-    Real,
-    TensorType,
-    ValType,
-    multimap,
-    INTEGER_DTYPE_NAMES,
-    FLOAT_DTYPE_NAMES,
-)
 print('Imported coinrun')
-from baselines.common.mpi_util import setup_mpi_gpus
 from gym.spaces import Box, Dict, Discrete as DiscreteG
-from procgen import ProcgenGym3Env
-from procgen import ProcgenEnv
-print('Imported procgen')
 
 from baselines.common.vec_env import (
     VecExtractDictObs,
-    VecFrameStack,
     VecNormalize,
     VecEnvWrapper
 )
@@ -46,51 +31,23 @@ mpi_print = utils.mpi_print
 import sys
 
 from coinrun import ising_env
+from coinrun.train_agent import FakeEnv, VecMonitor
 
 import gym
 
 
-class VecMonitor():
-    def __init__(self, venv, obs_space, act_space):
-        self.venv = venv
-        self.eprets = 0
-        self.eplens = 0
-        self.epcount = 0
-        self.num_envs = 1
-
-        self.observation_space = obs_space
-        self.action_space = act_space
-
-    def reset(self):
-        obs = self.venv.reset()
-        self.eprets = 0
-        self.eplens = 0
-        return np.array([obs])
-
-    def step(self,a):
-        obs, rews, dones, infos = self.venv.step(a)
-        self.eprets += rews
-        self.eplens += 1
-
-        info = infos.copy()
-        
-        if dones:
-            
-            ret = self.eprets
-            eplen = self.eplens
-            epinfo = {'r': ret, 'l': eplen}
-            
-            info['episode'] = epinfo
-            
-            self.epcount += 1
-            self.eprets = 0
-            self.eplens = 0
-            
-        return np.array([obs]), np.array([rews]), np.array([dones]), np.array([info])
-
 # helper function to make env
-def make_env(steps_per_env, obs_space, act_space):
-    venv = VecMonitor(ising_env.IsingEnv(T=32,k=5),obs_space, act_space)
+def make_env(steps_per_env, obs_space, act_space, goal_bank=None):
+    """
+    Config.NUM_ENVS batched Ising envs behind the same wrappers as the procgen envs in train_agent.
+    """
+    venv = FakeEnv(ising_env.IsingGym3Env(num=Config.NUM_ENVS, T=32, k=5, lazy=True, goal_bank=goal_bank), Dict(rgb=obs_space), act_space)
+    venv = VecExtractDictObs(venv, "rgb")
+    venv = VecMonitor(venv=venv, filename=None, keep_buf=100)
+    venv = VecNormalize(venv=venv, ob=False)
+    venv = wrappers.add_final_wrappers(venv)
+    venv.current_env_steps_left = steps_per_env
+
     return venv
 
 def main():
@@ -112,6 +69,7 @@ def main():
     
     config = tf.compat.v1.ConfigProto()
     config.gpu_options.allow_growth = True # pylint: disable=E1101
+    placement.configure_tf(config)
     
     total_timesteps = int(1e6)
     
@@ -126,8 +84,10 @@ def main():
     observation_space = Box(shape=(64,64,3),low=0,high=255)
     action_space = DiscreteG(5)
 
-    venv = make_env(total_timesteps,observation_space, action_space)
-    venv_eval = make_env(total_timesteps,observation_space, action_space)
+    # resets draw goals from a pool that a background thread refreshes a chunk at a time once it is full
+    goal_bank = ising_env.GoalBank(refresh=True, refresh_interval=1.0, seed=seed * 100 + rank)
+    venv = make_env(total_timesteps,observation_space, action_space, goal_bank)
+    venv_eval = make_env(total_timesteps,observation_space, action_space, goal_bank)
    
     
 
@@ -102,17 +102,19 @@ class DistributionShiftWrapperVec(gym.Wrapper):
     def __init__(self, env_list, steps_per_env, log=False):
         """
         Takes 2 parameters:
-        episodes_per_env: int, number of steps for each env before switching
-        kwargs: dict of lists
+        env_list: list of envs, or of functions building them. An env given as a function is
+            built when its phase starts and closed when the next phase starts
+        steps_per_env: int, number of steps for each env before switching
         """
         self.log = log
-        self.envs = env_list
+        self.env_fns = [None if hasattr(env, 'step') else env for env in env_list]
+        self.envs = [env if hasattr(env, 'step') else None for env in env_list]
         self.steps_per_env = steps_per_env
 
         self.current_env_idx = 0
         self.current_env_steps_left = self.steps_per_env
 
-        self.env = self.envs[0]
+        self.env = self.get_env(0)
         try:
             self.observation_space = self.env.observation_space
             self.action_space = self.env.action_space
@@ -120,16 +122,30 @@ class DistributionShiftWrapperVec(gym.Wrapper):
             pass
         self.switch_at_next_reset = False
 
+    def get_env(self, idx):
+        if self.envs[idx] is None:
+            self.envs[idx] = self.env_fns[idx]()
+        return self.envs[idx]
+
+    def switch_env(self):
+        prev_idx = self.current_env_idx
+        self.current_env_idx = (prev_idx + 1) % len(self.envs)
+        self.env = self.get_env(self.current_env_idx)
+
+        if self.current_env_idx != prev_idx and self.env_fns[prev_idx] is not None:
+            self.envs[prev_idx].close()
+            self.envs[prev_idx] = None
+
     def reset(self):
-        return self.envs[self.current_env_idx].reset()
+        return self.env.reset()
 
     def step(self, action):
         if self.switch_at_next_reset:
             self.current_env_steps_left = self.steps_per_env
-            self.current_env_idx = ( self.current_env_idx + 1 ) % len(self.envs)
+            self.switch_env()
             self.switch_at_next_reset = False
         
-        next_state, reward, is_done, info =  self.envs[self.current_env_idx].step(action)
+        next_state, reward, is_done, info =  self.env.step(action)
         self.current_env_steps_left = max(0, self.current_env_steps_left - Config.NUM_ENVS)
         if self.current_env_steps_left == 0:
             if not self.switch_at_next_reset:
@@ -143,6 +159,45 @@ class DistributionShiftWrapperVec(gym.Wrapper):
         
         return next_state, reward, is_done, info
 
+    def close(self):
+        for env in self.envs:
+            if env is not None:
+                env.close()
+
+class PhaseProbeVec(gym.Wrapper):
+    """
+    Separate copy of the active phase of a training env, for short rollouts from states restored
+    with callmethod('set_state'). The copy is built on first use and rebuilt when the phase changes.
+    """
+    def __init__(self, env_fns, get_phase):
+        self.env_fns = env_fns
+        self.get_phase = get_phase
+        self.phase = None
+        self.env = None
+
+    def sync(self):
+        phase = self.get_phase()
+        if phase != self.phase:
+            if self.env is not None:
+                self.env.close()
+            self.env = self.env_fns[phase]()
+            self.phase = phase
+        return self.env
+
+    def reset(self):
+        return self.sync().reset()
+
+    def step(self, action):
+        return self.sync().step(action)
+
+    def callmethod(self, method, *args, **kwargs):
+        return self.sync().callmethod(method, *args, **kwargs)
+
+    def close(self):
+        if self.env is not None:
+            self.env.close()
+            self.env = self.phase = None
+
 
 def add_final_wrappers(env):
     env = EpisodeRewardWrapper(env)
@@ -1,16 +1,17 @@
 """
-Load an agent trained with train_agent.py and
+Load agents trained with train_agent.py and exported with coinrun.export_policy,
+and plot the saliency of their chosen action for every image in ./images/.
+
+Export each model first:
+python -m coinrun.export_policy -resid 0322_plain -frozen frozen/0322_plain.pb
 """
 
 import time
 
 import tensorflow as tf
 import numpy as np
-from coinrun import setup_utils
 import coinrun.main_utils as utils
-from coinrun.config import Config
-from coinrun import config
-from coinrun import policies, wrappers
+from coinrun.export_policy import load_frozen_policy
 import imageio
 import sys
 
@@ -89,41 +90,33 @@ UPSCALE_FACTOR = 10
 
 mpi_print = utils.mpi_print
 
-def create_act_model(sess, env, nenvs):
-    ob_space = env.observation_space
-    ac_space = env.action_space
-
-    policy = policies.get_policy()
-    act = policy(sess, ob_space, ac_space, nenvs, 1, reuse=False)
+def saliency_input(agent):
+    """
+    The uint8 observation placeholder has no gradient, so saliency is taken with
+    respect to its float cast, which can be fed directly.
+    """
+    for op in agent.graph.get_operations():
+        if op.type == 'Cast' and agent.X in list(op.inputs):
+            return op.outputs[0]
 
-    return act
+    return agent.X
 
 def enjoy_env_sess():
-    # utils.setup_mpi_gpus()
-    # setup_utils.setup_and_load({'restore_id': collecting_model})
-
-
-
     directory = './images/'
     directory_saliency = "./images_saliency"
+    directory_frozen = './frozen/'
 
-    def create_saliency(model_idx, sess):
-        graph = tf.get_default_graph()
-        env = utils.make_general_env(1)
-        env = wrappers.add_final_wrappers(env)
-        agent = create_act_model(sess, env, 1)
-        action_selector = tf.placeholder(tf.int32)
-        gradient_saliency = saliency.GradientSaliency(graph, sess, agent.pd.logits[0][action_selector], agent.X)
-        sess.run(tf.compat.v1.global_variables_initializer())
-
-        # setup_utils.restore_file(models[model_idx])
-        try:
-            loaded_params = utils.load_params_for_scope(sess, 'model')
-            if not loaded_params:
-                print('NO SAVED PARAMS LOADED')
-        except AssertionError as e:
+    def create_saliency(model_idx):
+        path = os.path.join(directory_frozen, models[model_idx] + '.pb')
+        if not os.path.exists(path):
+            print('NO FROZEN POLICY AT', path)
             models[model_idx] = None
             return [None]*3
+
+        agent = load_frozen_policy(path)
+        with agent.graph.as_default():
+            action_selector = tf.compat.v1.placeholder(tf.int32)
+            gradient_saliency = saliency.GradientSaliency(agent.graph, agent.sess, agent.logits[0][action_selector], saliency_input(agent))
         return agent, gradient_saliency, action_selector
 
     orig_images_low = []
@@ -155,22 +148,25 @@ def enjoy_env_sess():
 
         model_images = []
         vmaxs = []
-        config.Config = config.ConfigSingle()
-        setup_utils.setup_and_load(use_cmd_line_args=False, restore_id=model_name, replay=True)
         print("\nComputing saliency for Model {}\{}: {}...".format(idx, len(models)-1, names[model_name]))
 
-        with tf.compat.v1.Session() as sess:
-            agent, gradient_saliency, action_selector = create_saliency(idx, sess)
-            for img in orig_images_low:
-                print('.', end=''); sys.stdout.flush()
-                action, values, state, _ = agent.step(np.expand_dims(img, 0), agent.initial_state, False)
-                s_vanilla_mask_3d = gradient_saliency.GetSmoothedMask(img, feed_dict={'model/is_training_:0': False, action_selector: action[0]})
-                s_vanilla_mask_grayscale, vmax = saliency.VisualizeImageGrayscale(s_vanilla_mask_3d)
-                model_images.append(s_vanilla_mask_grayscale)
-                vmaxs.append(vmax)
-
-            list_of_images_lists.append(model_images)
-            list_of_vmax_lists.append(vmaxs)
+        agent, gradient_saliency, action_selector = create_saliency(idx)
+        if agent is None:
+            list_of_images_lists.append(None)
+            list_of_vmax_lists.append(None)
+            continue
+
+        for img in orig_images_low:
+            print('.', end=''); sys.stdout.flush()
+            action, values, state, _ = agent.step(np.expand_dims(img, 0))
+            s_vanilla_mask_3d = gradient_saliency.GetSmoothedMask(img, feed_dict={action_selector: action[0]})
+            s_vanilla_mask_grayscale, vmax = saliency.VisualizeImageGrayscale(s_vanilla_mask_3d)
+            model_images.append(s_vanilla_mask_grayscale)
+            vmaxs.append(vmax)
+        agent.sess.close()
+
+        list_of_images_lists.append(model_images)
+        list_of_vmax_lists.append(vmaxs)
 
     print("\nMaking pretty images..")
     for idx, filename in enumerate(filenames):